@@ -0,0 +1,111 @@
+"""
+Library backends that bridge.py talks to.
+
+A backend exposes the handful of appscript entry points the bridge needs:
+``app`` (the Music application reference), ``its`` (for whose-filters) and
+``k`` (constants). ``reference_types`` lists the classes of reference objects,
+so they can be told apart from plain values. ``events`` is the number of Apple Events sent so far, or
+None when the backend can't count them.
+"""
+
+import os
+
+class AppscriptBackend:
+    """The live Music application, reached through appscript."""
+
+    name = 'appscript'
+
+    def __init__(self, app_name='Music'):
+        import appscript
+        import appscript.reference
+
+        self.app = appscript.app(app_name)
+        self.its = appscript.its
+        self.k = appscript.k
+        self.reference_types = (appscript.reference.Reference,)
+
+    @property
+    def events(self):
+        return None
+
+class FakeBackend:
+    """
+    An in-memory Music library that counts every simulated Apple Event.
+
+    Args:
+        tracks (iterable, optional): Track property dicts (see fake_music.synthetic_tracks)
+        playlists (dict, optional): Playlist name mapped to a list of track ids
+        latency (float, optional): Seconds to sleep per simulated Apple Event (default: 0)
+    """
+
+    name = 'fake'
+
+    def __init__(self, tracks=(), playlists=None, latency=0.0):
+        import fake_music
+
+        self.music = fake_music.FakeMusic(tracks, playlists, latency)
+        self.app = self.music.app
+        self.its = fake_music.its
+        self.k = fake_music.k
+        self.reference_types = fake_music.REFERENCE_TYPES
+
+    @classmethod
+    def synthetic(cls, count, seed=0, playlist_count=0, latency=0.0):
+        """
+        Create a backend seeded with a generated library.
+
+        Args:
+            count (int): Number of tracks
+            seed (int, optional): Random seed (default: 0)
+            playlist_count (int, optional): Number of random playlists to create (default: 0)
+            latency (float, optional): Seconds per simulated Apple Event (default: 0)
+        """
+        import random
+        import fake_music
+
+        tracks = fake_music.synthetic_tracks(count, seed)
+        rng = random.Random(seed)
+        ids = [track['id'] for track in tracks]
+        playlists = {
+            f"Playlist {index + 1}": rng.sample(ids, min(len(ids), rng.randint(5, 50)))
+            for index in range(playlist_count)
+        }
+        return cls(tracks, playlists, latency)
+
+    @classmethod
+    def from_csv(cls, path, latency=0.0):
+        """Create a backend seeded from a CSV written by ``amutils export``."""
+        import fake_music
+
+        return cls(fake_music.tracks_from_csv(path), latency=latency)
+
+    @property
+    def events(self):
+        return self.music.events
+
+    @property
+    def events_by_kind(self):
+        return self.music.events_by_kind
+
+    def reset_events(self):
+        self.music.reset_events()
+
+def default_backend():
+    """
+    Create the backend selected by the environment.
+
+    AMUTILS_BACKEND chooses 'appscript' (default) or 'fake'. The fake backend is seeded
+    from AMUTILS_FAKE_CSV if set, otherwise with AMUTILS_FAKE_TRACKS synthetic tracks
+    (default: 1000), and sleeps AMUTILS_FAKE_LATENCY seconds per event (default: 0).
+    """
+    kind = os.environ.get('AMUTILS_BACKEND', 'appscript')
+    if kind == 'appscript':
+        return AppscriptBackend()
+    if kind == 'fake':
+        latency = float(os.environ.get('AMUTILS_FAKE_LATENCY', '0'))
+        csv_path = os.environ.get('AMUTILS_FAKE_CSV')
+        if csv_path:
+            return FakeBackend.from_csv(csv_path, latency=latency)
+        count = int(os.environ.get('AMUTILS_FAKE_TRACKS', '1000'))
+        return FakeBackend.synthetic(count, playlist_count=10, latency=latency)
+    raise ValueError(f"Unknown AMUTILS_BACKEND '{kind}', expected 'appscript' or 'fake'")
@@ -0,0 +1,136 @@
+"""
+Batched track updates for CSV import.
+
+Instead of looking every track up and setting each property separately
+(what bridge.update_track_by_id does), the batch updater resolves all ids
+against one bulk fetch of the library, diffs each update against the current
+values, and sends only the properties that change. Identical assignments
+(e.g. favorited = true for many tracks) are grouped into one whose-filtered
+set per chunk of tracks.
+"""
+
+from collections import defaultdict
+from types import SimpleNamespace
+import bridge
+
+# update_track_by_id keyword mapped to the Music property it sets
+UPDATE_PROPERTIES = (
+    ('play_count', 'played_count'),
+    ('is_favorite', 'favorited'),
+    ('name', 'name'),
+    ('album', 'album'),
+    ('artist', 'artist'),
+)
+
+class BatchUpdater:
+    """
+    Collects track updates by id and applies them with as few Apple Events as possible.
+
+    Args:
+        chunk_size (int, optional): Maximum number of tracks per whose-filtered set (default: 100)
+    """
+
+    def __init__(self, chunk_size=100):
+        self.chunk_size = chunk_size
+        self.tracks_ref = bridge.app.library_playlists[1].tracks
+        self.current = None
+        self.pending = defaultdict(dict)
+        self.naive_events = 0
+        self.events_sent = 0
+
+    def resolve(self):
+        """Fetch the id and current values of every library track in one column fetch per property."""
+        properties = ['id'] + [prop for _, prop in UPDATE_PROPERTIES]
+        columns = bridge.fetch_columns(self.tracks_ref, properties)
+        self.events_sent += len(properties)
+        self.current = {
+            values[0]: dict(zip(properties[1:], values[1:]))
+            for values in zip(*(columns[prop] for prop in properties))
+        }
+
+    def add(self, track_id, play_count=None, is_favorite=None, name=None, album=None, artist=None):
+        """
+        Queue an update, with the same arguments and rules as bridge.update_track_by_id.
+
+        Returns:
+            bool: True if the track exists in the library, False otherwise
+        """
+        if self.current is None:
+            self.resolve()
+
+        requested = {'play_count': play_count, 'is_favorite': is_favorite,
+                     'name': name, 'album': album, 'artist': artist}
+        wanted = {}
+        for field, prop in UPDATE_PROPERTIES:
+            value = requested[field]
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            wanted[prop] = value
+
+        # One lookup plus one set per provided property, as update_track_by_id would send
+        self.naive_events += 1 + len(wanted)
+
+        try:
+            key = int(track_id)
+        except (TypeError, ValueError):
+            key = None
+        current = self.current.get(key)
+        if current is None:
+            print(f"Error updating track {track_id}: no track with this id in the library")
+            return False
+
+        for prop, value in wanted.items():
+            if current[prop] != value:
+                self.pending[key][prop] = value
+            else:
+                self.pending[key].pop(prop, None)
+        return True
+
+    def flush(self):
+        """
+        Send every queued change, grouping identical assignments.
+
+        Returns:
+            SimpleNamespace: number of changed properties, number of tracks whose update
+                failed, and the Apple Events sent and saved compared to per-track updates
+        """
+        groups = defaultdict(list)
+        for track_id, changes in self.pending.items():
+            for prop, value in changes.items():
+                groups[(prop, value)].append(track_id)
+
+        changed = sum(len(ids) for ids in groups.values())
+        failed_ids = set()
+
+        for (prop, value), ids in groups.items():
+            for start in range(0, len(ids), self.chunk_size):
+                chunk = ids[start:start + self.chunk_size]
+                try:
+                    self.events_sent += 1
+                    getattr(bridge.tracks_by_ids(self.tracks_ref, chunk), prop).set(value)
+                    for track_id in chunk:
+                        self.current[track_id][prop] = value
+                except Exception as e:
+                    if len(chunk) == 1:
+                        print(f"Error updating track {chunk[0]}: {e}")
+                        failed_ids.add(chunk[0])
+                        continue
+                    # Retry the chunk track by track so one bad track doesn't fail the rest
+                    for track_id in chunk:
+                        try:
+                            self.events_sent += 1
+                            getattr(self.tracks_ref.ID(track_id), prop).set(value)
+                            self.current[track_id][prop] = value
+                        except Exception as e:
+                            print(f"Error updating track {track_id}: {e}")
+                            failed_ids.add(track_id)
+
+        self.pending.clear()
+        result = SimpleNamespace(
+            changed=changed,
+            failed=len(failed_ids),
+            events_sent=self.events_sent,
+            events_saved=max(0, self.naive_events - self.events_sent),
+        )
+        self.naive_events = self.events_sent = 0
+        return result
@@ -0,0 +1,317 @@
+"""
+Benchmarks of the bridge operations against the fake Music backend.
+
+For each library size a synthetic library is generated (fake_music.synthetic_tracks:
+.movpkg packages, CJK names, numbered duplicate basenames, tracks without a file),
+together with a CSV export of it, a CSV with changed play counts to import, file
+path queries with the variants Music paths come in (numbered copies, decomposed
+accents, zero-width characters) and a folder of small tagged .m4a files. Every
+operation then runs against a fresh fake library, and the Apple Events it sent
+and its wall time are reported and compared against a stored baseline.
+
+Apple Event counts are deterministic, so any increase over the baseline is
+reported as a regression and makes the run fail; wall times depend on the
+machine and only fail the run with --max-slowdown.
+
+Usage::
+
+    python3 benchmark.py [--sizes 1000,10000|all] [--only NAME,...] [--baseline FILE]
+                         [--update-baseline] [--max-slowdown FACTOR] [--keep DIR]
+
+The default baseline, benchmark_baseline.json, is kept in the source checkout next to
+this file and is not installed with the package; run the suite from a checkout or pass
+--baseline.
+"""
+
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unicodedata
+from types import SimpleNamespace
+import backend as backends
+import bridge
+import exporter
+import path_keys
+
+# Library sizes the suite knows; 1M tracks needs several GB of memory for the fake library
+SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Playlists in each fake library
+PLAYLISTS = 10
+
+# get_track_by_file_path queries per run
+PATH_QUERIES = 200
+
+# Tagged files written for the process_folder run
+FOLDER_FILES = 200
+
+# Every n-th row of the import CSV gets one more play
+IMPORT_CHANGE_EVERY = 10
+
+SEED = 0
+
+def _atom(name, payload):
+    return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+def write_m4a(path, title, artist, album):
+    """
+    Write a minimal MPEG-4 audio file carrying only title, artist and album tags.
+
+    The file has no audio track, which mutagen accepts, so thousands of them take a few kilobytes.
+    """
+    def text(name, value):
+        return _atom(name, _atom(b'data', struct.pack('>II', 1, 0) + (value or '').encode('utf-8')))
+
+    ilst = _atom(b'ilst', text(b'\xa9nam', title) + text(b'\xa9ART', artist) + text(b'\xa9alb', album))
+    hdlr = _atom(b'hdlr', bytes(8) + b'mdir' + b'appl' + bytes(9))
+    moov = _atom(b'moov', _atom(b'udta', _atom(b'meta', bytes(4) + hdlr + ilst)))
+    with open(path, 'wb') as f:
+        f.write(_atom(b'ftyp', b'M4A ' + bytes(4) + b'M4A mp42isom') + moov)
+
+def _fresh_backend(size):
+    return bridge.use_backend(backends.FakeBackend.synthetic(size, SEED, playlist_count=PLAYLISTS))
+
+def _path_variant(rng, path):
+    """Return a path the way a file on disk may differ from the library's copy of it."""
+    roll = rng.random()
+    if roll < 0.25:
+        stem, extension = os.path.splitext(path)
+        return f"{stem} 2{extension}"
+    if roll < 0.5:
+        return unicodedata.normalize('NFD', path.replace('a', '\u00e1', 1))
+    if roll < 0.6:
+        cut = rng.randrange(1, len(path))
+        return path[:cut] + '\u200b' + path[cut:]
+    return path
+
+def _safe(name):
+    return (name or 'Unknown').replace('/', '_')[:80]
+
+def prepare(size, directory):
+    """
+    Generate the inputs for one library size.
+
+    Args:
+        size (int): Number of tracks
+        directory (str): Empty folder to write the CSVs and the .m4a folder to
+
+    Returns:
+        SimpleNamespace: size, directory, csv_path, folder and path_queries
+    """
+    rng = random.Random(SEED)
+    fake = _fresh_backend(size)
+    records = fake.music.library.records
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        export_path = os.path.join(directory, 'library.csv')
+        exporter.export_tracks_to_csv(export_path)
+    csv_path = os.path.join(directory, 'import.csv')
+    with open(export_path, newline='', encoding='utf-8-sig') as source, \
+            open(csv_path, 'w', newline='', encoding='utf-8-sig') as target:
+        reader = csv.DictReader(source)
+        writer = csv.DictWriter(target, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        for row_number, row in enumerate(reader):
+            if row_number % IMPORT_CHANGE_EVERY == 0:
+                row['play_count'] = str(int(row['play_count'] or 0) + 1)
+            writer.writerow(row)
+
+    located = [record for record in records if record['location'] is not None]
+    path_queries = [_path_variant(rng, record['location'].path)
+                    for record in rng.sample(located, min(PATH_QUERIES, len(located)))]
+
+    folder = os.path.join(directory, 'music')
+    for record in rng.sample(located, min(FOLDER_FILES, len(located))):
+        album_folder = os.path.join(folder, _safe(record['artist']), _safe(record['album']))
+        os.makedirs(album_folder, exist_ok=True)
+        write_m4a(os.path.join(album_folder, _safe(record['name']) + '.m4a'),
+                  record['name'], record['artist'], record['album'])
+
+    return SimpleNamespace(size=size, directory=directory, csv_path=csv_path, folder=folder,
+                           path_queries=path_queries)
+
+def _get_all_tracks(workspace):
+    bridge.get_all_tracks()
+
+def _get_total_playtime(workspace):
+    bridge.get_total_playtime()
+
+def _get_track_by_file_path(workspace):
+    for path in workspace.path_queries:
+        bridge.get_track_by_file_path(path)
+
+def _export_tracks_to_csv(workspace):
+    exporter.export_tracks_to_csv(os.path.join(workspace.directory, 'export.csv'))
+
+def _import_tracks_from_csv(workspace):
+    exporter.import_tracks_from_csv(workspace.csv_path)
+
+def _process_folder(workspace):
+    import main
+    import pipeline  # needs mutagen; imported here so a missing one skips only this operation
+
+    main.process_folder(workspace.folder, jobs=4)
+
+# Benchmarked operations in run order
+OPERATIONS = {
+    'get_all_tracks': _get_all_tracks,
+    'get_total_playtime': _get_total_playtime,
+    'get_track_by_file_path': _get_track_by_file_path,
+    'export_tracks_to_csv': _export_tracks_to_csv,
+    'import_tracks_from_csv': _import_tracks_from_csv,
+    'process_folder': _process_folder,
+}
+
+def run_operation(name, workspace):
+    """
+    Run one operation against a fresh fake library.
+
+    Returns:
+        dict: events and seconds, or None if the operation could not run here
+    """
+    fake = _fresh_backend(workspace.size)
+    path_keys.get_path_keys.cache_clear()
+    fake.reset_events()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            OPERATIONS[name](workspace)
+    except ImportError as e:
+        print(f"{name:<26}{workspace.size:>9}  skipped: {e}")
+        return None
+    seconds = time.perf_counter() - start
+    return {'events': fake.events, 'seconds': round(seconds, 4)}
+
+def run(sizes=DEFAULT_SIZES, names=None, keep=None):
+    """
+    Run the benchmarks and print one line per operation and size.
+
+    Args:
+        sizes (list, optional): Library sizes (default: DEFAULT_SIZES)
+        names (list, optional): Operations to run (default: all of OPERATIONS)
+        keep (str, optional): Write the generated inputs under this folder instead of a
+            temporary one that is removed afterwards
+
+    Returns:
+        dict: "operation@size" mapped to {'events': ..., 'seconds': ...}
+    """
+    results = {}
+    print(f"{'Operation':<26}{'Tracks':>9}{'Events':>10}{'Seconds':>10}")
+    for size in sizes:
+        directory = os.path.join(keep, str(size)) if keep else tempfile.mkdtemp(prefix='amutils-benchmark-')
+        os.makedirs(directory, exist_ok=True)
+        try:
+            workspace = prepare(size, directory)
+            for name in names or OPERATIONS:
+                result = run_operation(name, workspace)
+                if result is not None:
+                    results[f"{name}@{size}"] = result
+                    print(f"{name:<26}{size:>9}{result['events']:>10}{result['seconds']:>10.3f}")
+        finally:
+            if not keep:
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def compare(results, baseline, max_slowdown=None):
+    """
+    Compare results with a baseline and print the differences.
+
+    Args:
+        results (dict): Output of run()
+        baseline (dict): Earlier output of run()
+        max_slowdown (float, optional): Also fail when an operation takes more than this many
+            times its baseline wall time
+
+    Returns:
+        list: Descriptions of the regressions found
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result['events'] > expected['events']:
+            regressions.append(f"{key}: {result['events']} Apple Events, baseline {expected['events']}")
+        elif result['events'] < expected['events']:
+            print(f"{key}: {result['events']} Apple Events, down from {expected['events']}; "
+                  f"run with --update-baseline to keep the improvement")
+        if max_slowdown and expected['seconds'] and result['seconds'] > expected['seconds'] * max_slowdown:
+            regressions.append(f"{key}: {result['seconds']:.3f}s, baseline {expected['seconds']:.3f}s")
+    return regressions
+
+def _parse_sizes(value):
+    if value == 'all':
+        return SIZES
+    sizes = []
+    for part in value.split(','):
+        part = part.strip().lower()
+        multiplier = {'k': 1000, 'm': 1000000}.get(part[-1:], 1)
+        sizes.append(int(part.rstrip('km')) * multiplier)
+    return sizes
+
+def main(args):
+    """Command line entry point; returns the process exit status."""
+    import main as cli
+
+    if '-h' in args or '--help' in args:
+        print(__doc__.strip())
+        return 0
+    try:
+        sizes = cli.pop_option(args, '--sizes')
+        sizes = _parse_sizes(sizes) if sizes else DEFAULT_SIZES
+        max_slowdown = cli.pop_option(args, '--max-slowdown')
+        max_slowdown = float(max_slowdown) if max_slowdown else None
+    except ValueError:
+        print("Error: --sizes expects sizes like 1000,10k,1m and --max-slowdown a number")
+        return 2
+    names = cli.pop_option(args, '--only')
+    names = names.split(',') if names else None
+    unknown = [name for name in names or [] if name not in OPERATIONS]
+    if unknown:
+        print(f"Error: unknown operation {', '.join(unknown)}; expected one of {', '.join(OPERATIONS)}")
+        return 2
+    baseline_path = cli.pop_option(args, '--baseline') or DEFAULT_BASELINE_PATH
+    keep = cli.pop_option(args, '--keep')
+    update = '--update-baseline' in args
+    if update:
+        args.remove('--update-baseline')
+    if args:
+        print(f"Error: unknown arguments {' '.join(args)}; see --help")
+        return 2
+
+    results = run(sizes, names, keep)
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if update:
+        baseline.update(results)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, max_slowdown)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions" if baseline else f"\nNo baseline at {baseline_path}; run with --update-baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
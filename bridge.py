@@ -1,10 +1,203 @@
-from appscript import app as attach, its
+import logging
+import os
 from types import SimpleNamespace
-import hashlib
+from collections import namedtuple, defaultdict
+import backend as backends
+import hashing
+import path_index
+import path_keys
+import duration_index
+import fuzzy_index
+import stats
 
-app = attach('Music')
+class _Unconnected:
+    """
+    Stands in for a backend attribute (app, its or k) until the backend is first used.
+    
+    Any attribute access connects to the default backend, after which use_backend has
+    replaced the stand-ins with the real objects.
+    """
+    
+    def __init__(self, name):
+        self._name = name
+    
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        return getattr(getattr(connect(), self._name), attribute)
+    
+    def __repr__(self):
+        return f"<{self._name}: not connected>"
+
+logger = logging.getLogger('amutils')
+
+backend = None
+app, its, k = _Unconnected('app'), _Unconnected('its'), _Unconnected('k')
+
+# Creates the backend on first use; the default honours AMUTILS_BACKEND (see backend.default_backend)
+backend_factory = backends.default_backend
+
+_playlists = None
+_path_index = None
+_duration_index = None
+_fuzzy_index = _fuzzy_ids = None
+_playlist_index = None
+
+# False once use_backend swapped in a library of the caller's own, which an `amutils serve`
+# server (see library_server.py) doesn't hold
+backend_is_default = True
+
+# Whether the server has refreshed since this session started or last changed the library
+_server_in_sync = False
+
+def use_backend(new_backend):
+    """
+    Route every bridge function through the given library backend.
+    
+    Args:
+        new_backend: A backend from backend.py, e.g. backend.FakeBackend.synthetic(10000)
+        
+    Returns:
+        The backend that is now in use
+    """
+    global backend, app, its, k, _playlists, _path_index, _duration_index, _fuzzy_index, _playlist_index
+    global backend_is_default, _server_in_sync
+    backend = new_backend
+    backend_is_default = False
+    _server_in_sync = False
+    _playlists = None
+    _path_index = None
+    _duration_index = None
+    _fuzzy_index = None
+    _playlist_index = None
+    app = new_backend.app
+    its = new_backend.its
+    k = new_backend.k
+    return backend
+
+def connect():
+    """
+    Get the backend in use, creating it with backend_factory on first use.
+    
+    Nothing talks to Music until this runs, so commands that never touch the library
+    (help, argument errors) don't launch it.
+    
+    Returns:
+        The backend that is now in use
+    """
+    global backend_is_default
+    if backend is None:
+        use_backend(backend_factory())
+        backend_is_default = True
+    return backend
+
+def _ask_server(op, **args):
+    """
+    Send a lookup to a running ``amutils serve``.
+    
+    The first lookup of a session, and the first after this session changed the library,
+    makes the server refresh before answering.
+    
+    Returns:
+        The answer, or library_server.NOT_RUNNING if no server answered
+    """
+    global _server_in_sync
+    import library_server
+    
+    answer = library_server.request(op, max_age=None if _server_in_sync else 0, **args)
+    if answer is not library_server.NOT_RUNNING:
+        _server_in_sync = True
+    return answer
+
+def get_playlists(refresh=False):
+    """
+    Get references to every playlist, fetched once per session.
+    
+    Args:
+        refresh (bool, optional): Fetch the playlist list again
+        
+    Returns:
+        list: Playlist references, library first
+    """
+    global _playlists
+    if _playlists is None or refresh:
+        _playlists = app.playlists()
+    return _playlists
+
+# Track fields paired with the Music property each one is read from
+TRACK_PROPERTIES = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('album', 'album'),
+    ('artist', 'artist'),
+    ('album_artist', 'album_artist'),
+    ('play_count', 'played_count'),
+    ('is_favorite', 'favorited'),
+    ('duration', 'duration'),
+    ('file_path', 'location'),
+)
+TRACK_FIELDS = [field for field, _ in TRACK_PROPERTIES]
+
+Track = namedtuple('Track', TRACK_FIELDS)
+
+# Lowest similarity score (0..1) accepted as a title/artist match
+FUZZY_MATCH_THRESHOLD = 0.6
+
+# Tracks fetched per request by iter_track_chunks
+TRACK_CHUNK_SIZE = 5000
+
+# Ranges at most this long are fetched track by track when a column request fails
+COLUMN_FALLBACK_ROWS = 16
+
+# Tracks duplicated to a playlist per Apple Event
+PLAYLIST_ADD_CHUNK_SIZE = 100
+
+def get_playlist_index(rebuild=False):
+    """
+    Get the session's playlist membership index, building it on first use.
+    
+    The index maps each track persistent ID to the playlists containing it, built with
+    one persistent ID column fetch per playlist.
+    
+    Args:
+        rebuild (bool, optional): Discard the current index and build a fresh one
+        
+    Returns:
+        dict: Persistent ID mapped to a list of playlist references, in playlist order
+    """
+    global _playlist_index
+    if _playlist_index is None and not rebuild:
+        _playlist_index = _playlist_index_from_server()
+    if _playlist_index is None or rebuild:
+        index = defaultdict(list)
+        for playlist in get_playlists(refresh=rebuild):
+            try:
+                persistent_ids = playlist.tracks.persistent_ID.get()
+            except Exception as e:
+                print(f"Error reading playlist members: {e}")
+                continue
+            for persistent_id in dict.fromkeys(persistent_ids):
+                index[persistent_id].append(playlist)
+        _playlist_index = index
+    return _playlist_index
 
-playlists = app.playlists()
+def _playlist_index_from_server():
+    """Get the playlist membership index from a running server, or None."""
+    import library_server
+    
+    answer = _ask_server('playlist_index')
+    if answer is library_server.NOT_RUNNING:
+        return None
+    # Playlist numbers are only valid if the playlists are still the ones the server saw
+    try:
+        if app.playlists.persistent_ID.get() != answer['playlists']:
+            return None
+    except Exception as e:
+        print(f"Error reading playlist IDs: {e}")
+        return None
+    playlists = get_playlists()
+    return defaultdict(list, {persistent_id: [playlists[number - 1] for number in numbers]
+                              for persistent_id, numbers in answer['members'].items()})
 
 def get_song_info(track_name, artist, album):
     try:
@@ -18,16 +211,14 @@ def get_song_info(track_name, artist, album):
         date_added = track.date_added()
         favorite = track.favorited()
         location = track.location().path
+        persistent_id = track.persistent_ID()
 
-        containing_playlists = []
-
-        for playlist in playlists:
-            if playlist.tracks[its.persistent_ID == track.persistent_ID()].exists():
-                containing_playlists.append(playlist)
+        containing_playlists = list(get_playlist_index().get(persistent_id, []))
 
         return SimpleNamespace(
             track=track,
             id=id,
+            persistent_id=persistent_id,
             play_count=play_count,
             date_added=date_added,
             favorite=favorite,
@@ -42,25 +233,39 @@ def replace_song(file, track):
     try:
         if track: track.track.delete()
         newer = app.add(file.path)
+        invalidate_track_indexes()
         if track:
             # if newer.location().path == track.location: return
             newer.played_count.set(track.play_count)
             newer.favorited.set(track.favorite)
             for playlist in track.containing_playlists:
                 newer.duplicate(to=playlist.end())
+            
+            # Keep the membership index in step with the library
+            if _playlist_index is not None:
+                _playlist_index.pop(track.persistent_id, None)
+                _playlist_index[newer.persistent_ID()] = list(track.containing_playlists)
     except Exception as e:
         print(f"Error replacing song: {e}")
 
+def get_library_stats(names=stats.DEFAULT_STATS):
+    """
+    Compute library aggregates from one column fetch per property they need.
+    
+    Args:
+        names (list, optional): Aggregates registered in stats.py (default: stats.DEFAULT_STATS)
+        
+    Returns:
+        dict: Aggregate name mapped to its value
+    """
+    library = app.library_playlists[1]
+    columns = fetch_columns(library.tracks, stats.required_columns(names))
+    return stats.compute(columns, names)
+
 def get_total_playtime():
     try:
-        library = app.library_playlists[1]
-        tracks = library.tracks()
-        total_duration = 0
-        for track in tracks:
-            duration = track.duration()
-            play_count = track.played_count()
-            total_duration += duration * play_count
-        return total_duration, len(tracks)
+        result = get_library_stats(['total_playtime', 'track_count'])
+        return result['total_playtime'], result['track_count']
     except Exception as e:
         print(f"Error: {e}")
         return 0
@@ -92,79 +297,172 @@ def calculate_file_sha256(file_path):
         if not file_path:
             return ""
             
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            # Read and update hash in chunks to efficiently handle large files
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+        # Read in large buffers; see hashing.py for cached and parallel hashing
+        return hashing.hash_file(file_path)
     except Exception as e:
         print(f"Error calculating hash for {file_path}: {e}")
         return ""
 
+def _fetch_property(track, prop):
+    """Fetch a single property of one track, returning None if it is unavailable."""
+    try:
+        return getattr(track, prop).get()
+    except Exception:
+        return None
+
+def _fetch_column_range(tracks_ref, prop, start, stop):
+    """
+    Fetch one property for tracks start..stop (1-based, inclusive) with a single range request.
+    
+    If the range request fails, the range is split in half and retried so that only the rows
+    around the failing track end up being fetched one by one.
+    """
+    try:
+        return list(getattr(tracks_ref[start:stop], prop).get())
+    except Exception:
+        if stop - start < COLUMN_FALLBACK_ROWS:
+            return [_fetch_property(tracks_ref[index], prop) for index in range(start, stop + 1)]
+        middle = (start + stop) // 2
+        return (_fetch_column_range(tracks_ref, prop, start, middle) +
+                _fetch_column_range(tracks_ref, prop, middle + 1, stop))
+
+def fetch_columns(tracks_ref, properties, start=None, stop=None):
+    """
+    Fetch whole property columns for every track behind a tracks reference.
+    
+    Each property is requested once for all tracks (``library.tracks.name()`` style) instead
+    of once per track. When a column request fails, it falls back to range and per-track
+    requests for the affected rows only.
+    
+    Args:
+        tracks_ref: An appscript tracks reference, e.g. ``app.library_playlists[1].tracks``
+        properties (list): Property names to fetch, e.g. ['name', 'played_count']
+        start (int, optional): First track to fetch (1-based); all tracks when omitted
+        stop (int, optional): Last track to fetch (inclusive), required with start
+        
+    Returns:
+        dict: Property name mapped to a list of values in library order (None where unavailable)
+    """
+    columns = {}
+    count = None if start is None else stop - start + 1
+    source = tracks_ref if start is None else tracks_ref[start:stop]
+    
+    for prop in properties:
+        try:
+            values = list(getattr(source, prop).get())
+        except Exception as e:
+            print(f"Column fetch for '{prop}' failed, falling back to smaller requests: {e}")
+            values = None
+        
+        if values is None or (count is not None and len(values) != count):
+            if count is None:
+                count = tracks_ref.count()
+            first = start or 1
+            values = _fetch_column_range(tracks_ref, prop, first, first + count - 1) if count else []
+        
+        count = len(values)
+        columns[prop] = values
+    
+    return columns
+
+def _location_path(location):
+    """Return the POSIX path of a track location, or an empty string for tracks without a file."""
+    try:
+        return location.path or ""
+    except Exception:
+        return ""
+
+def make_track(values):
+    """
+    Build a Track from raw Music property values.
+    
+    Args:
+        values (dict): Music property name (see TRACK_PROPERTIES) mapped to its raw value
+        
+    Returns:
+        Track: The cleaned-up track record
+        
+    Raises:
+        ValueError: If the track's id could not be read
+    """
+    track_id = values.get('id')
+    if track_id is None:
+        raise ValueError(f"no id for track '{values.get('name')}'")
+    artist = values.get('artist')
+    album_artist = values.get('album_artist')
+    return Track(
+        id=str(track_id),
+        name=values.get('name'),
+        album=values.get('album'),
+        artist=artist,
+        # Default to regular artist if album artist is not available
+        album_artist=album_artist if album_artist is not None else artist,
+        play_count=values.get('played_count') or 0,
+        is_favorite=bool(values.get('favorited')),
+        # Track duration in seconds rounded to one decimal place
+        duration=round(values.get('duration') or 0, 1),
+        file_path=_location_path(values.get('location'))
+    )
+
 def get_all_tracks():
     """
     Get all tracks from the Apple Music library with their id, name, album, artist, album artist, play count, favorite status, duration, and file path.
     
+    Every property is fetched as a single column for the whole library, so the cost is one
+    Apple Event per property rather than one per property per track.
+    
     Returns:
-        list: A list of track objects with id, name, album, artist, album_artist, play_count, is_favorite, duration, and file_path attributes
+        TrackTable: The tracks in library order; each row has the id, name, album, artist, album_artist, play_count, is_favorite, duration, and file_path attributes of a Track
     """
-    from collections import namedtuple
-    
-    # Create a track object to store information
-    Track = namedtuple('Track', ['id', 'name', 'album', 'artist', 'album_artist', 'play_count', 'is_favorite', 'duration', 'file_path'])
+    import track_table
     
     try:
-        # Use appscript to query Apple Music library (consistent with other functions)
         library = app.library_playlists[1]
-        tracks = library.tracks()
+        properties = [prop for _, prop in TRACK_PROPERTIES]
+        columns = fetch_columns(library.tracks, properties)
         
-        result = []
-        for track in tracks:
+        tracks = track_table.TrackTable()
+        tracks.extend_properties(columns)
+        return tracks
+    except Exception as e:
+        print(f"Failed to get tracks: {e}")
+        return track_table.TrackTable()
+
+def iter_track_chunks(chunk_size=TRACK_CHUNK_SIZE):
+    """
+    Get all tracks in chunks, paging through the library in index ranges.
+    
+    Only one chunk is held in memory at a time, so callers can process or write
+    tracks while the rest of the library is still being fetched. Tracks whose id
+    could not be read are left out.
+    
+    Args:
+        chunk_size (int, optional): Tracks per chunk (default: TRACK_CHUNK_SIZE)
+        
+    Yields:
+        list: Track objects, as returned by get_all_tracks(), for consecutive ranges of the library
+    """
+    tracks_ref = app.library_playlists[1].tracks
+    properties = [prop for _, prop in TRACK_PROPERTIES]
+    count = tracks_ref.count()
+    
+    for start in range(1, count + 1, chunk_size):
+        stop = min(start + chunk_size - 1, count)
+        columns = fetch_columns(tracks_ref, properties, start, stop)
+        chunk = []
+        missing = 0
+        for values in zip(*(columns[prop] for prop in properties)):
+            values = dict(zip(properties, values))
+            if values['id'] is None:
+                missing += 1
+                continue
             try:
-                # Get track information
-                track_id = track.id()
-                track_name = track.name()
-                album_name = track.album()
-                artist_name = track.artist()
-                
-                # Get album artist (might be different from the track artist)
-                try:
-                    album_artist_name = track.album_artist()
-                except:
-                    album_artist_name = artist_name  # Default to regular artist if album artist is not available
-                
-                play_count = track.played_count()
-                is_favorite = track.favorited()
-                
-                # Get track duration in seconds and round to one decimal place
-                duration = round(track.duration(), 1)
-                
-                # Get file path (if available)
-                try:
-                    file_path = track.location().path
-                except:
-                    file_path = ""
-                
-                result.append(Track(
-                    id=str(track_id),
-                    name=track_name,
-                    album=album_name,
-                    artist=artist_name,
-                    album_artist=album_artist_name,
-                    play_count=play_count,
-                    is_favorite=bool(is_favorite),
-                    duration=duration,
-                    file_path=file_path
-                ))
+                chunk.append(make_track(values))
             except Exception as e:
                 print(f"Error processing track: {e}")
-                continue
-                
-        return result
-    except Exception as e:
-        print(f"Failed to get tracks: {e}")
-        return []
+        if missing:
+            print(f"Error processing track: no id for {missing} tracks, leaving them out")
+        yield chunk
 
 def update_track_by_id(track_id, play_count=None, is_favorite=None, name=None, album=None, artist=None):
     """
@@ -210,6 +508,32 @@ def update_track_by_id(track_id, play_count=None, is_favorite=None, name=None, a
         print(f"Error updating track {track_id}: {e}")
         return False
 
+def get_path_index(rebuild=False):
+    """
+    Get the session's path index, building it on first use.
+    
+    The index holds the path keys of every library track, so repeated
+    get_track_by_file_path calls don't walk the library again.
+    
+    Args:
+        rebuild (bool, optional): Discard the current index and build a fresh one
+        
+    Returns:
+        PathIndex: The index of every library track
+    """
+    global _path_index
+    if _path_index is None or rebuild:
+        _path_index = path_index.build_path_index(app.library_playlists[1].tracks, fetch_columns)
+    return _path_index
+
+def invalidate_track_indexes():
+    """Drop the session's path, duration and fuzzy name indexes after tracks were added to or removed from the library."""
+    global _path_index, _duration_index, _fuzzy_index, _server_in_sync
+    _path_index = None
+    _duration_index = None
+    _fuzzy_index = None
+    _server_in_sync = False
+
 def get_track_by_file_path(file_path):
     """
     Find a track in the Apple Music library by its file path.
@@ -223,188 +547,24 @@ def get_track_by_file_path(file_path):
     try:
         if not file_path:
             return None
-            
-        # Get all tracks from the library
-        library = app.library_playlists[1]
-        tracks = library.tracks()
-        
-        # Get the filename for fallback matching
-        import os
-        import unicodedata
-        import re
-        
-        # Print out all bytes in file_path to debug hidden characters
-        print(f"Debug original path: {file_path}")
-        hex_bytes = ' '.join([f'{ord(c):x}' for c in file_path])
-        print(f"Path bytes (hex): {hex_bytes[:50]}... (truncated)")
-        
-        # Create clean normalized version of the path
-        def deep_clean_path(path):
-            if not path:
-                return ""
-            # Remove any control characters and zero-width spaces
-            path = re.sub(r'[\u200B-\u200F\u2028-\u202F\uFEFF]', '', path)
-            # Normalize unicode form
-            path = unicodedata.normalize('NFC', path)
-            # Strip all trailing whitespace, slashes and numbers before extension
-            path = re.sub(r'\s+\d+(\.\w+)$', r'\1', path)
-            path = path.rstrip('/ ')
-            return path
-            
-        # Create search keys from a path
-        def get_path_keys(path):
-            """Extract various identifying keys from a path for fuzzy matching"""
-            if not path:
-                return {}
-                
-            # Basic path normalization
-            clean_path = deep_clean_path(path)
-            
-            # Get filename components
-            filename = os.path.basename(clean_path)
-            dirname = os.path.dirname(clean_path)
-            
-            # Handle .movpkg special case
-            is_movpkg = clean_path.endswith('.movpkg')
-            if is_movpkg:
-                basename = filename[:-7]  # Remove .movpkg
-            else:
-                basename = os.path.splitext(filename)[0]
-                
-            # Clean the basename further (remove special chars and numbers)
-            simple_basename = re.sub(r'[^\w\s]', '', basename)
-            simple_basename = re.sub(r'\s+\d+$', '', simple_basename).strip().lower()
-            
-            # Get path segments for partial matching
-            path_parts = clean_path.split('/')
-            # Last 1-3 path segments are most useful for matching
-            segments = [p for p in path_parts[-3:] if p]
-            
-            # For Japanese/special char filenames, create an ASCII-only version
-            ascii_name = ''.join(c for c in simple_basename if ord(c) < 128)
-            
-            return {
-                'clean_path': clean_path,
-                'filename': filename,
-                'basename': basename,
-                'simple_basename': simple_basename,
-                'dirname': dirname,
-                'is_movpkg': is_movpkg,
-                'segments': segments,
-                'ascii_name': ascii_name
-            }
-        
-        # Get search keys from our target path
-        target_keys = get_path_keys(file_path)
-        print(f"Matching basename: '{target_keys['basename']}'")
-        
-        # Special log helper
-        def log_match(quality, track, reason):
-            try:
-                track_name = track.name()
-                artist_name = track.artist()
-                track_path = str(track.location())
-                filename = os.path.basename(track_path)
-                print(f"Match ({quality}): '{track_name}' by '{artist_name}' - {reason}")
-                print(f"Path: {filename}")
-            except:
-                print(f"Match ({quality}): [details unavailable] - {reason}")
-        
-        # First try direct lookup for better performance
-        if target_keys['is_movpkg']:
-            try:
-                # Try to find directly by name if it's a .movpkg (usually more reliable than path)
-                dir_name = os.path.basename(os.path.dirname(file_path))
-                name_to_search = target_keys['basename']
-                
-                # Clean up the name for better matching
-                name_to_search = re.sub(r'\s+\d+$', '', name_to_search)
-                name_to_search = re.sub(r'(?: \(feat\..+?\)|­+)$', '', name_to_search)
-                
-                print(f"Trying direct lookup by name: '{name_to_search}'")
-                exact_match_tracks = library.tracks[its.name == name_to_search]
-                if exact_match_tracks.count() > 0:
-                    track = exact_match_tracks.first()
-                    log_match('DIRECT', track, "exact name match")
-                    return track
-            except Exception as e:
-                print(f"Direct lookup error: {e}")
-        
-        # Collect matches with their quality scores
-        matches = []
-        
-        # Try each track with various matching strategies
-        for track in tracks:
-            try:
-                # Skip tracks without location
-                location = track.location()
-                if location is None:
-                    continue
-                
-                # Get the track's path and extract search keys
-                track_path = str(location)
-                track_keys = get_path_keys(track_path)
-                
-                # Direct match - highest priority 
-                if target_keys['clean_path'] == track_keys['clean_path']:
-                    matches.append((100, track, "exact path match"))
-                    continue
-                
-                # Exact filename match (very reliable)
-                if target_keys['filename'] == track_keys['filename']:
-                    matches.append((90, track, "exact filename match"))
-                    continue
-                
-                # Base filename match (without extension or numbers)
-                if target_keys['basename'] == track_keys['basename']:
-                    matches.append((80, track, "basename match"))
-                    continue
-                
-                # Simple basename match (ignoring special chars and numbers)
-                if target_keys['simple_basename'] and target_keys['simple_basename'] == track_keys['simple_basename']:
-                    matches.append((70, track, "simple basename match"))
-                    continue
-                    
-                # For .movpkg files specifically
-                if target_keys['is_movpkg'] and track_keys['is_movpkg']:
-                    # Special case: try without version numbers at the end (e.g. "song 2.movpkg")
-                    if re.sub(r'\s+\d+$', '', target_keys['basename']) == re.sub(r'\s+\d+$', '', track_keys['basename']):
-                        matches.append((65, track, ".movpkg basename match without numbers"))
-                        continue
-                
-                # Check if track filename contains our target basename
-                if target_keys['basename'] in track_keys['filename']:
-                    matches.append((60, track, "filename contains target basename"))
-                    continue
-                    
-                # Last segments matching (useful for nested paths)
-                common_segments = set(target_keys['segments']).intersection(set(track_keys['segments']))
-                if len(common_segments) >= 2:
-                    matches.append((50, track, f"{len(common_segments)} common path segments"))
-                    continue
-                
-                # Parent directory matches + similar filename 
-                if (os.path.basename(target_keys['dirname']) == os.path.basename(track_keys['dirname']) and
-                    len(target_keys['simple_basename']) > 3 and 
-                    target_keys['simple_basename'] in track_keys['simple_basename']):
-                    matches.append((40, track, "same directory, similar filename"))
-                    continue
-                
-                # For ASCII-only simplified matching (when nothing else works)
-                if (len(target_keys['ascii_name']) > 3 and target_keys['ascii_name'] == track_keys['ascii_name']):
-                    matches.append((30, track, "ASCII-only name match"))
-                    continue
-                    
-            except Exception as e:
-                # Skip tracks with errors
-                continue
-                
-        # Sort by match quality and return best match
-        if matches:
-            matches.sort(key=lambda x: x[0], reverse=True)
-            best_match = matches[0][1]
-            log_match(matches[0][0], best_match, matches[0][2])
-            return best_match
+        import library_server
+        
+        # Code points of the path reveal hidden characters; only built when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Debug original path: %s", file_path)
+            hex_bytes = ' '.join([f'{ord(c):x}' for c in file_path])
+            logger.debug("Path bytes (hex): %s... (truncated)", hex_bytes[:50])
+        
+        # A running server answers from its own index
+        match = _ask_server('match_path', path=file_path)
+        if match is library_server.NOT_RUNNING:
+            match = match_track_path(get_path_index(), file_path)
+        
+        if match:
+            quality, track_id, name, path, reason = match
+            logger.info("Match (%s): '%s' - %s", quality, name, reason)
+            logger.debug("Path: %s", os.path.basename(path))
+            return app.library_playlists[1].tracks.ID(track_id)
             
         # If we get here, we've tried everything and found nothing
         print(f"No matching track found in library for: {file_path}")
@@ -414,13 +574,81 @@ def get_track_by_file_path(file_path):
         print(f"Error finding track by file path: {e}")
         return None
 
-def get_track_by_duration(duration, tolerance=0.1):
+def match_track_path(index, file_path):
+    """
+    Find the library track best matching a file path.
+    
+    Args:
+        index (PathIndex): Index of the library, e.g. from get_path_index()
+        file_path (str): The file path to search for
+        
+    Returns:
+        tuple: (quality, track id, name, path, reason) of the match, or None
+    """
+    # Get search keys from our target path
+    target_keys = path_keys.get_path_keys(file_path)
+    logger.debug("Matching basename: '%s'", target_keys.basename)
+    
+    # First try direct lookup by name for .movpkg files (usually more reliable than path)
+    match = None
+    if target_keys.is_movpkg:
+        # Clean up the name for better matching
+        name_to_search = path_keys.movpkg_title(target_keys.basename)
+        
+        logger.debug("Trying direct lookup by name: '%s'", name_to_search)
+        position = index.find_name(name_to_search)
+        if position is not None:
+            match = ('DIRECT', position, "exact name match")
+    
+    # Best match across all quality tiers (exact path 100 down to ASCII-only name 30)
+    match = match or index.match(file_path)
+    if not match:
+        return None
+    quality, position, reason = match
+    return quality, index.ids[position], index.names[position], index.paths[position], reason
+
+def get_duration_index(rebuild=False):
+    """
+    Get the session's duration index, building it on first use.
+    
+    Args:
+        rebuild (bool, optional): Discard the current index and build a fresh one
+        
+    Returns:
+        DurationIndex: Durations of every library track, sorted for tolerance lookups
+    """
+    global _duration_index
+    if _duration_index is None or rebuild:
+        columns = fetch_columns(app.library_playlists[1].tracks, ['id', 'duration', 'name', 'artist', 'album'])
+        _duration_index = duration_index.DurationIndex(columns)
+    return _duration_index
+
+def duration_matches(index, duration, tolerance=0.1, album=None, limit=3):
+    """
+    Find the tracks closest to a duration.
+    
+    Args:
+        index (DurationIndex): Index of the library, e.g. from get_duration_index()
+        duration (float): The duration to search for in seconds
+        tolerance (float, optional): Allowed duration difference in seconds (default: 0.1)
+        album (str, optional): Only match tracks from this album
+        limit (int, optional): Maximum number of matches (default: 3)
+        
+    Returns:
+        list: (track id, name, artist, duration, difference) of each match, closest first
+    """
+    return [(index.ids[position], index.names[position], index.artists[position],
+             index.track_durations[position], diff)
+            for position, diff in index.find(duration, tolerance, album)[:limit]]
+
+def get_track_by_duration(duration, tolerance=0.1, album=None):
     """
     Find a track in the Apple Music library by its duration with precise matching.
     
     Args:
         duration (float): The duration of the track in seconds
         tolerance (float, optional): Allowed duration difference in seconds (default: 0.1)
+        album (str, optional): Only match tracks from this album, to tell near-identical lengths apart
         
     Returns:
         An appscript track object if found, None otherwise
@@ -430,36 +658,19 @@ def get_track_by_duration(duration, tolerance=0.1):
             return None
             
         print(f"Searching for track with duration: {duration}s (tolerance: {tolerance}s)")
+        import library_server
         
-        # Get all tracks from the library
-        library = app.library_playlists[1]
-        tracks = library.tracks()
-        
-        # Find all tracks with matching duration within tolerance
-        matching_tracks = []
-        for track in tracks:
-            try:
-                track_duration = track.duration()
-                
-                # Check if duration is within tolerance
-                if abs(track_duration - float(duration)) <= tolerance:
-                    matching_tracks.append((track, abs(track_duration - float(duration))))
-            except Exception:
-                continue
+        matching_tracks = _ask_server('find_duration', duration=duration, tolerance=tolerance, album=album)
+        if matching_tracks is library_server.NOT_RUNNING:
+            matching_tracks = duration_matches(get_duration_index(), duration, tolerance, album)
                 
         if matching_tracks:
-            # Sort by duration difference
-            matching_tracks.sort(key=lambda x: x[1])
-            
             # Print some debug info for top matches
-            for i, (track, diff) in enumerate(matching_tracks[:3]):
-                try:
-                    print(f"Match {i+1}: '{track.name()}' by '{track.artist()}' - {track.duration()}s (diff: {diff:.3f}s)")
-                except:
-                    print(f"Match {i+1}: [track name unavailable] - {track.duration()}s (diff: {diff:.3f}s)")
+            for i, (track_id, name, artist, track_duration, diff) in enumerate(matching_tracks):
+                print(f"Match {i+1}: '{name}' by '{artist}' - {track_duration}s (diff: {diff:.3f}s)")
             
             # Return the closest duration match
-            return matching_tracks[0][0]
+            return app.library_playlists[1].tracks.ID(matching_tracks[0][0])
             
         # No match found
         print(f"No tracks found with duration close to {duration}s (tolerance: {tolerance}s)")
@@ -468,6 +679,31 @@ def get_track_by_duration(duration, tolerance=0.1):
         print(f"Error finding track by duration: {e}")
         return None
 
+def get_tracks_by_durations(queries, tolerance=0.1):
+    """
+    Find the closest track for many durations at once.
+    
+    Args:
+        queries (list): Durations in seconds, or (duration, album) pairs
+        tolerance (float, optional): Allowed duration difference in seconds (default: 0.1)
+        
+    Returns:
+        list: An appscript track object, or None where nothing matched, for each query
+    """
+    try:
+        import library_server
+        
+        ids = _ask_server('find_durations', queries=queries, tolerance=tolerance)
+        if ids is library_server.NOT_RUNNING:
+            index = get_duration_index()
+            ids = [index.ids[position] if position is not None else None
+                   for position in index.find_many(queries, tolerance)]
+        tracks = app.library_playlists[1].tracks
+        return [tracks.ID(track_id) if track_id is not None else None for track_id in ids]
+    except Exception as e:
+        print(f"Error finding tracks by duration: {e}")
+        return [None] * len(queries)
+
 def update_track_info(track, name=None, album=None, artist=None, album_artist=None, play_count=None, is_favorite=None):
     """
     Update various information for a track.
@@ -514,6 +750,49 @@ def update_track_info(track, name=None, album=None, artist=None, album_artist=No
         print(f"Error updating track information: {e}")
         return False
 
+def get_fuzzy_index(rebuild=False):
+    """
+    Get the session's fuzzy name index, building it on first use.
+    
+    Args:
+        rebuild (bool, optional): Discard the current index and build a fresh one
+        
+    Returns:
+        FuzzyIndex: Trigram index over the name, artist and album of every library track
+    """
+    global _fuzzy_index, _fuzzy_ids
+    if _fuzzy_index is None or rebuild:
+        columns = fetch_columns(app.library_playlists[1].tracks, ['id', 'name', 'artist', 'album'])
+        _fuzzy_index = fuzzy_index.FuzzyIndex(columns['name'], columns['artist'], columns['album'])
+        _fuzzy_ids = columns['id']
+    return _fuzzy_index
+
+def find_tracks_fuzzy(title, artist=None, album=None, limit=5, artist_contains=None):
+    """
+    Rank library tracks by similarity to a title, artist and album.
+    
+    Args:
+        title (str): The title of the track
+        artist (str, optional): The artist name
+        album (str, optional): The album name
+        limit (int, optional): Maximum number of candidates (default: 5)
+        artist_contains (str, optional): Only rank tracks whose artist contains this, ignoring
+            case, punctuation and Unicode form
+        
+    Returns:
+        list: (appscript track object, score) pairs, best first, scores from 0 to 1
+    """
+    import library_server
+    
+    candidates = _ask_server('find_fuzzy', title=title, artist=artist, album=album, limit=limit,
+                             artist_contains=artist_contains)
+    if candidates is library_server.NOT_RUNNING:
+        index = get_fuzzy_index()
+        candidates = [(_fuzzy_ids[position], score) for position, score
+                      in index.search(title, artist, album, limit, artist_contains=artist_contains)]
+    tracks = app.library_playlists[1].tracks
+    return [(tracks.ID(track_id), score) for track_id, score in candidates]
+
 def get_track_by_title_and_artist(title, artist=None):
     """
     Find a track in the Apple Music library by its title and artist.
@@ -529,18 +808,10 @@ def get_track_by_title_and_artist(title, artist=None):
         if not title:
             return None
             
-        # Create search condition
-        condition = its.name.contains(title)
-        if artist:
-            condition = condition.AND(its.artist.contains(artist))
-            
-        # Find track
-        library = app.library_playlists[1]
-        tracks = library.tracks[condition]
-        
-        # Return first match if any
-        if tracks.count():
-            return tracks.first()
+        # Best ranked candidate by the artist, if it is similar enough
+        candidates = find_tracks_fuzzy(title, artist, limit=1, artist_contains=artist)
+        if candidates and candidates[0][1] >= FUZZY_MATCH_THRESHOLD:
+            return candidates[0][0]
         return None
         
     except Exception as e:
@@ -565,30 +836,10 @@ def get_track_by_title_artist_combo(title, artist=None, album=None):
         
         print(f"Searching for track: '{title}' by '{artist or 'any artist'}'")
         
-        # Get library tracks
-        library = app.library_playlists[1]
-        
-        # First try exact match
-        if artist and album:
-            tracks = library.tracks[its.name == title and its.artist == artist and its.album == album]
-            if tracks.count() > 0:
-                return tracks.first()
-        
-        if artist:
-            tracks = library.tracks[its.name == title and its.artist == artist]
-            if tracks.count() > 0:
-                return tracks.first()
-        
-        # Then try contains match
-        if artist:
-            tracks = library.tracks[its.name.contains(title) and its.artist.contains(artist)]
-            if tracks.count() > 0:
-                return tracks.first()
-        
-        # Last resort, just title match
-        tracks = library.tracks[its.name.contains(title)]
-        if tracks.count() > 0:
-            return tracks.first()
+        # Title, artist and album are all scored together; exact matches rank first
+        candidates = find_tracks_fuzzy(title, artist, album, limit=1)
+        if candidates and candidates[0][1] >= FUZZY_MATCH_THRESHOLD:
+            return candidates[0][0]
         
         return None
     except Exception as e:
@@ -606,61 +857,156 @@ def add_files_to_playlist(file_paths, playlist_name):
     Returns:
         Number of files successfully added
     """
-    import appscript
-    
-    itunes = appscript.app('Music')
-    
     # Try to find the playlist, create it if it doesn't exist
     try:
-        playlist = itunes.playlists[playlist_name].get()
+        playlist = app.playlists[playlist_name].get()
     except:
-        playlist = itunes.make(new=appscript.k.playlist, with_properties={'name': playlist_name})
+        playlist = app.make(new=k.playlist, with_properties={'name': playlist_name})
     
     added_count = 0
     
     for file_path in file_paths:
         try:
             # Add the file to iTunes library and the playlist
-            track = itunes.add(file_path, to=playlist)
+            track = app.add(file_path, to=playlist)
+            invalidate_track_indexes()
             added_count += 1
         except Exception as e:
             print(f"Failed to add {file_path}: {str(e)}")
     
     return added_count
 
+def tracks_by_ids(tracks_ref, ids):
+    """
+    Reference to the tracks with the given ids: by id for one track, by whose-filter for several.
+    
+    Args:
+        tracks_ref: An appscript tracks reference, e.g. ``app.library_playlists[1].tracks``
+        ids (list): Track ids (int)
+    """
+    if len(ids) == 1:
+        return tracks_ref.ID(ids[0])
+    condition = (its.id == ids[0]).OR(*[its.id == track_id for track_id in ids[1:]])
+    return tracks_ref[condition]
+
+def _get_or_make_playlist(playlist_name):
+    """Return (playlist reference, created) for the named user playlist, creating it if needed."""
+    try:
+        return app.playlists[playlist_name].get(), False
+    except Exception:
+        return app.make(new=k.playlist, with_properties={'name': playlist_name}), True
+
+def _duplicate_to_playlist(ids, persistent_ids, playlist_name, chunk_size=PLAYLIST_ADD_CHUNK_SIZE):
+    """
+    Duplicate library tracks to a playlist, skipping tracks it already contains.
+    
+    Tracks are duplicated chunk_size at a time with one Apple Event per chunk. If a chunk
+    fails, its tracks are retried one by one so a single bad track doesn't block the rest.
+    
+    Args:
+        ids (list): Library track ids (int)
+        persistent_ids (list): Persistent ID of each track in ids
+        playlist_name (str): Target playlist, created if it doesn't exist
+        chunk_size (int, optional): Tracks per duplicate event
+    
+    Returns:
+        int: Number of tracks added
+    """
+    try:
+        playlist, created = _get_or_make_playlist(playlist_name)
+        # One column fetch tells which tracks the playlist already has, so re-runs add nothing twice
+        present = set() if created else set(playlist.tracks.persistent_ID.get())
+    except Exception as e:
+        print(f"Error creating or accessing playlist: {str(e)}")
+        return 0
+    
+    pending = {}
+    for track_id, persistent_id in zip(ids, persistent_ids):
+        if persistent_id not in present:
+            pending.setdefault(persistent_id, track_id)
+    skipped = len(ids) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} tracks already in playlist '{playlist_name}'")
+    
+    tracks_ref = app.library_playlists[1].tracks
+    queued = list(pending.items())
+    added = []
+    for start in range(0, len(queued), chunk_size):
+        chunk = queued[start:start + chunk_size]
+        try:
+            tracks_by_ids(tracks_ref, [track_id for _, track_id in chunk]).duplicate(to=playlist)
+            added.extend(chunk)
+        except Exception as e:
+            print(f"Batch add failed ({str(e)}), adding {len(chunk)} tracks one by one")
+            for persistent_id, track_id in chunk:
+                try:
+                    tracks_ref.ID(track_id).duplicate(to=playlist)
+                    added.append((persistent_id, track_id))
+                except Exception as e:
+                    print(f"Failed to add track {track_id}: {str(e)}")
+        logger.debug("Added %d of %d tracks to playlist '%s'", len(added), len(queued), playlist_name)
+    
+    if _playlist_index is not None:
+        for persistent_id, _ in added:
+            _playlist_index[persistent_id].append(playlist)
+    return len(added)
+
 def add_tracks_to_playlist(tracks, playlist_name):
     """
     Add existing library tracks to a specified Apple Music playlist.
     
+    Tracks the playlist already contains are skipped, and the rest are added in batches.
+    
     Args:
-        tracks: List of track objects from get_all_tracks()
+        tracks: Tracks from get_all_tracks(), or a list of Track objects
         playlist_name: Name of the playlist to add tracks to
     
     Returns:
         Number of tracks successfully added
     """
     try:
-        # Try to find the playlist, create it if it doesn't exist
-        try:
-            playlist = app.playlists[playlist_name].get()
-        except:
-            playlist = app.make(new=app.k.playlist, with_properties={'name': playlist_name})
-        
-        added_count = 0
-        
-        for track in tracks:
-            try:
-                # Find the actual track object using the ID
-                library_track = app.library_playlists[1].tracks[its.id == int(track.id)].first()
-                
-                # Duplicate the track to the playlist
-                library_track.duplicate(to=playlist)
-                added_count += 1
-                print(f"Added '{track.name}' by {track.artist} to playlist '{playlist_name}'")
-            except Exception as e:
-                print(f"Failed to add track '{track.name}': {str(e)}")
-        
-        return added_count
+        # Persistent IDs identify tracks across playlists; one column fetch maps ids to them
+        columns = fetch_columns(app.library_playlists[1].tracks, ['id', 'persistent_ID'])
     except Exception as e:
-        print(f"Error creating or accessing playlist: {str(e)}")
-        return 0
\ No newline at end of file
+        print(f"Error reading library: {str(e)}")
+        return 0
+    persistent_ids = dict(zip(columns['id'], columns['persistent_ID']))
+    
+    ids = []
+    for track in tracks:
+        track_id = int(track.id)
+        if track_id in persistent_ids:
+            ids.append(track_id)
+        else:
+            print(f"Failed to add track '{track.name}': no track with this id in the library")
+    return _duplicate_to_playlist(ids, [persistent_ids[track_id] for track_id in ids], playlist_name)
+
+def add_matching_tracks_to_playlist(playlist_name, path_filter):
+    """
+    Add every library track whose file path passes a filter to a playlist.
+    
+    Matching tracks are found with one fetch of the id, persistent ID and location columns,
+    so the library is not walked track by track.
+    
+    Args:
+        playlist_name (str): Name of the playlist, created if it doesn't exist
+        path_filter (callable): Called with each track's POSIX path; True selects the track
+    
+    Returns:
+        tuple: (number of matching tracks, number of tracks added)
+    """
+    try:
+        columns = fetch_columns(app.library_playlists[1].tracks, ['id', 'persistent_ID', 'location'])
+    except Exception as e:
+        print(f"Error reading library: {str(e)}")
+        return 0, 0
+    
+    ids, persistent_ids = [], []
+    for track_id, persistent_id, location in zip(columns['id'], columns['persistent_ID'], columns['location']):
+        path = _location_path(location)
+        if path and path_filter(path):
+            ids.append(track_id)
+            persistent_ids.append(persistent_id)
+    if not ids:
+        return 0, 0
+    return len(ids), _duplicate_to_playlist(ids, persistent_ids, playlist_name)
@@ -0,0 +1,336 @@
+"""
+Columnar binary snapshot of the track list.
+
+Numeric columns are stored as packed fixed-width arrays and string columns as
+an offset table over a UTF-8 heap, each section aligned to 8 bytes. A JSON
+footer records where every section lives, so the file can be written in one
+pass and read back through a memory map, one column at a time and only when
+a column is first used.
+
+Layout::
+
+    MAGIC | column sections ... | footer JSON | footer offset (uint64) | MAGIC
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from types import SimpleNamespace
+import bridge
+import stats
+
+MAGIC = b'AMUTCOL1'
+VERSION = 1
+
+# Storage type of every Track field: an array typecode for numeric columns, 'str' for strings
+COLUMN_TYPES = {
+    'id': 'q',
+    'name': 'str',
+    'album': 'str',
+    'artist': 'str',
+    'album_artist': 'str',
+    'play_count': 'i',
+    'is_favorite': 'b',
+    'duration': 'd',
+    'file_path': 'str',
+}
+
+# Music property each Track field is read from, for answering stats like bridge.fetch_columns
+FIELD_PROPERTIES = dict(bridge.TRACK_PROPERTIES)
+
+_TRAILER = struct.Struct('<Q8s')
+
+def is_columnar(path):
+    """Return True if the file at path starts with the columnar snapshot magic."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+def _write_array(f, values):
+    """Write an array as a little-endian section and return its (offset, byte length)."""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    _pad(f)
+    offset = f.tell()
+    values.tofile(f)
+    return offset, f.tell() - offset
+
+def _copy_spool(f, spool):
+    _pad(f)
+    offset = f.tell()
+    spool.seek(0)
+    while True:
+        block = spool.read(1 << 20)
+        if not block:
+            break
+        f.write(block)
+    return offset, f.tell() - offset
+
+def write_snapshot(output_path, chunks):
+    """
+    Write tracks to a columnar snapshot file.
+
+    Numeric columns and string offsets are kept as packed arrays while writing and string
+    heaps are spooled to temporary files, so memory stays small for large libraries. The
+    file is written next to output_path and renamed into place once complete; when there
+    are no tracks, nothing is written and an existing file at output_path is kept. Tracks
+    without a numeric id are left out.
+
+    Args:
+        output_path (str): Path of the snapshot file
+        chunks (iterable): Lists of Track records, e.g. from library_cache.iter_track_chunks
+
+    Returns:
+        int: Number of tracks written
+    """
+    numbers = {field: array(code) for field, code in COLUMN_TYPES.items() if code != 'str'}
+    strings = {field: (array('Q', [0]), bytearray(), tempfile.TemporaryFile())
+               for field, code in COLUMN_TYPES.items() if code == 'str'}
+    rows = skipped = 0
+    try:
+        for tracks in chunks:
+            for track in tracks:
+                try:
+                    track_id = int(track.id)
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                numbers['id'].append(track_id)
+                numbers['play_count'].append(track.play_count or 0)
+                numbers['is_favorite'].append(int(bool(track.is_favorite)))
+                numbers['duration'].append(track.duration or 0.0)
+                for field, (offsets, nulls, heap) in strings.items():
+                    value = getattr(track, field)
+                    nulls.append(value is None)
+                    if value:
+                        heap.write(value.encode('utf-8', 'surrogatepass'))
+                    offsets.append(heap.tell())
+                rows += 1
+        if skipped:
+            print(f"Error processing track: no id for {skipped} tracks, leaving them out")
+        if not rows:
+            return 0
+
+        directory = os.path.dirname(os.path.abspath(output_path))
+        with tempfile.NamedTemporaryFile('wb', dir=directory, prefix='.tracks_export-', suffix='.tmp',
+                                         delete=False) as f:
+            try:
+                f.write(MAGIC)
+                columns = {}
+                for field, code in COLUMN_TYPES.items():
+                    if code != 'str':
+                        offset, length = _write_array(f, numbers[field])
+                        columns[field] = {'type': code, 'offset': offset, 'length': length}
+                        continue
+                    offsets, nulls, heap = strings[field]
+                    if offsets[-1] < 1 << 32:
+                        # Heaps under 4 GB use 32-bit offsets
+                        offsets = array('I', offsets)
+                    offsets_at, _ = _write_array(f, offsets)
+                    nulls_at, _ = _write_array(f, array('B', nulls))
+                    heap_at, heap_length = _copy_spool(f, heap)
+                    columns[field] = {'type': 'str', 'offsets': offsets_at, 'offset_type': offsets.typecode,
+                                      'nulls': nulls_at, 'heap': heap_at, 'heap_length': heap_length}
+                footer_at = f.tell()
+                f.write(json.dumps({'version': VERSION, 'rows': rows, 'columns': columns}).encode('utf-8'))
+                f.write(_TRAILER.pack(footer_at, MAGIC))
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        # NamedTemporaryFile creates the file as 0600; give it the mode open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(f.name, 0o666 & ~umask)
+        os.replace(f.name, output_path)
+        return rows
+    finally:
+        for _, _, heap in strings.values():
+            heap.close()
+
+class StringColumn:
+    """
+    Lazily decoded string column; values are decoded from the heap on access.
+
+    Supports len(), indexing and iteration like a list of str (None for missing values).
+    """
+
+    def __init__(self, offsets, nulls, heap):
+        self.offsets = offsets
+        self.nulls = nulls
+        self.heap = heap
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if self.nulls[position]:
+            return None
+        return str(self.heap[self.offsets[position]:self.offsets[position + 1]], 'utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+class ColumnarSnapshot:
+    """
+    Memory-mapped reader for a columnar snapshot file.
+
+    Columns are mapped on first use; numeric columns are zero-copy memoryviews over the file.
+    Columns must not be used after close().
+
+    Args:
+        path (str): Snapshot file written by write_snapshot
+
+    Raises:
+        ValueError: If the file is not a columnar snapshot
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is not a columnar snapshot")
+        self._view = memoryview(self._map)
+        self._views = [self._view]
+        self._columns = {}
+        try:
+            if len(self._map) < len(MAGIC) + _TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a columnar snapshot")
+            footer_at, magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is truncated or damaged")
+            footer = json.loads(bytes(self._map[footer_at:len(self._map) - _TRAILER.size]))
+            if footer['version'] != VERSION:
+                raise ValueError(f"Unsupported columnar snapshot version {footer['version']}")
+        except ValueError:
+            self.close()
+            raise
+        self.rows = footer['rows']
+        self.layout = footer['columns']
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._columns.clear()
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._map.close()
+        self._file.close()
+
+    def _array(self, offset, typecode, count):
+        view = self._view[offset:offset + count * array(typecode).itemsize].cast(typecode)
+        self._views.append(view)
+        if sys.byteorder != 'little':
+            # Snapshots are little-endian; other machines read a swapped copy
+            swapped = array(typecode, view)
+            swapped.byteswap()
+            return swapped
+        return view
+
+    def column(self, field):
+        """
+        Return one column, mapping it on first use.
+
+        Args:
+            field (str): Track field, e.g. 'play_count' or 'name'
+
+        Returns:
+            memoryview or StringColumn: Numeric values, or lazily decoded strings
+        """
+        if field not in self._columns:
+            layout = self.layout[field]
+            if layout['type'] == 'str':
+                heap = self._view[layout['heap']:layout['heap'] + layout['heap_length']]
+                self._views.append(heap)
+                offsets = self._array(layout['offsets'], layout['offset_type'], self.rows + 1)
+                nulls = self._array(layout['nulls'], 'B', self.rows)
+                self._columns[field] = StringColumn(offsets, nulls, heap)
+            else:
+                self._columns[field] = self._array(layout['offset'], layout['type'], self.rows)
+        return self._columns[field]
+
+    def columns(self, properties):
+        """
+        Read whole columns by Music property name, like bridge.fetch_columns.
+
+        Args:
+            properties (list): Music property names, e.g. ['duration', 'played_count']
+
+        Returns:
+            dict: Property name mapped to its column
+        """
+        fields = {prop: field for field, prop in FIELD_PROPERTIES.items()}
+        return {prop: self.column(fields[prop]) for prop in properties}
+
+    def track(self, position):
+        """Return the Track at a position."""
+        values = {field: self.column(field)[position] for field in COLUMN_TYPES}
+        values['id'] = str(values['id'])
+        values['is_favorite'] = bool(values['is_favorite'])
+        return bridge.Track(**values)
+
+    def tracks(self):
+        """Yield every track as a Track record in library order."""
+        for position in range(self.rows):
+            yield self.track(position)
+
+    def stats(self, names=stats.DEFAULT_STATS):
+        """Compute library aggregates from the snapshot, see stats.compute."""
+        return stats.compute(self.columns(stats.required_columns(names)), names)
+
+def diff(old, new, fields=('play_count', 'is_favorite')):
+    """
+    Compare two snapshots by track ID.
+
+    Args:
+        old (ColumnarSnapshot): Earlier snapshot
+        new (ColumnarSnapshot): Later snapshot
+        fields (tuple, optional): Fields to compare (default: play count and favorite status)
+
+    Returns:
+        SimpleNamespace: added and removed track IDs, and changed mapping each ID present in
+            both to {field: (old value, new value)} for the fields that differ
+    """
+    old_positions = {track_id: position for position, track_id in enumerate(old.column('id'))}
+    new_ids = new.column('id')
+    old_columns = [old.column(field) for field in fields]
+    new_columns = [new.column(field) for field in fields]
+    added, changed = [], {}
+    for position, track_id in enumerate(new_ids):
+        old_position = old_positions.pop(track_id, None)
+        if old_position is None:
+            added.append(str(track_id))
+            continue
+        changes = {}
+        for field, old_column, new_column in zip(fields, old_columns, new_columns):
+            if old_column[old_position] != new_column[position]:
+                changes[field] = (old_column[old_position], new_column[position])
+        if changes:
+            changed[str(track_id)] = changes
+    return SimpleNamespace(added=added, removed=[str(track_id) for track_id in old_positions], changed=changed)
@@ -0,0 +1,104 @@
+"""
+Sorted duration index for bridge.get_track_by_duration.
+
+Durations are held in a sorted ``array('d')`` with the library positions of the
+tracks alongside, so a tolerance window is found with two bisections. An optional
+album key narrows the search to one album to tell near-identical lengths apart.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Widening applied to bisection bounds before the exact tolerance test, against float rounding
+_EPSILON = 1e-9
+
+def album_key(album):
+    """Normalize an album name for composite lookups."""
+    return (album or '').strip().casefold()
+
+class _SortedDurations:
+    """Durations in ascending order with the library position of each one."""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self.durations = array('d', (duration for duration, _ in pairs))
+        self.positions = array('q', (position for _, position in pairs))
+
+    def window(self, duration, tolerance):
+        """Return (position, difference) of every entry within tolerance of duration."""
+        low = bisect_left(self.durations, duration - tolerance - _EPSILON)
+        high = bisect_right(self.durations, duration + tolerance + _EPSILON)
+        hits = []
+        for offset in range(low, high):
+            difference = abs(self.durations[offset] - duration)
+            if difference <= tolerance:
+                hits.append((self.positions[offset], difference))
+        return hits
+
+class DurationIndex:
+    """
+    Track durations sorted for O(log n) tolerance lookups.
+
+    Args:
+        columns (dict): 'id', 'duration', 'name', 'artist' and 'album' columns in library order,
+            as returned by bridge.fetch_columns
+    """
+
+    def __init__(self, columns):
+        self.ids = columns['id']
+        self.names = columns['name']
+        self.artists = columns['artist']
+        self.albums = columns['album']
+        self.track_durations = columns['duration']
+
+        pairs = [(float(duration), position) for position, duration in enumerate(self.track_durations)
+                 if duration is not None]
+        self.all = _SortedDurations(pairs)
+
+        by_album = {}
+        for duration, position in pairs:
+            by_album.setdefault(album_key(self.albums[position]), []).append((duration, position))
+        self.by_album = {key: _SortedDurations(album_pairs) for key, album_pairs in by_album.items()}
+
+    def __len__(self):
+        return len(self.all.durations)
+
+    def find(self, duration, tolerance=0.1, album=None):
+        """
+        Find tracks within tolerance of a duration, closest first.
+
+        Args:
+            duration (float): The duration to search for in seconds
+            tolerance (float, optional): Allowed difference in seconds (default: 0.1)
+            album (str, optional): Only consider tracks from this album
+
+        Returns:
+            list: (position, difference) pairs sorted by difference, then library order
+        """
+        if album is not None:
+            sorted_durations = self.by_album.get(album_key(album))
+            if sorted_durations is None:
+                return []
+        else:
+            sorted_durations = self.all
+        hits = sorted_durations.window(float(duration), tolerance)
+        hits.sort(key=lambda hit: (hit[1], hit[0]))
+        return hits
+
+    def find_many(self, queries, tolerance=0.1):
+        """
+        Find the closest track for many durations in one call.
+
+        Args:
+            queries (iterable): Durations, or (duration, album) pairs for composite lookups
+            tolerance (float, optional): Allowed difference in seconds (default: 0.1)
+
+        Returns:
+            list: Position of the closest track for each query, or None where nothing is in range
+        """
+        results = []
+        for query in queries:
+            duration, album = query if isinstance(query, tuple) else (query, None)
+            hits = self.find(duration, tolerance, album) if duration else []
+            results.append(hits[0][0] if hits else None)
+        return results
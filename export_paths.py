@@ -6,35 +6,38 @@
 
 import os
 import sys
-import bridge
+from main import pop_cache_options
 
-def export_paths_to_txt(output_path):
+def export_paths_to_txt(output_path, max_age=None):
     """
     将所有曲目的文件路径导出到文本文件。
 
     Args:
         output_path (str): 保存文本文件的路径
+        max_age (float, optional): 从本地曲库快照读取时允许的最大快照时长（秒），None 表示直接读取曲库
 
     Returns:
         bool: 导出成功返回 True，否则返回 False
     """
+    import library_cache
+
     try:
         # 获取所有曲目
-        tracks = bridge.get_all_tracks()
+        tracks = library_cache.get_all_tracks(max_age)
         
         if not tracks:
             print("库中没有找到曲目。")
             return False
             
         # 过滤出有文件路径的曲目
-        tracks_with_paths = [track for track in tracks if track.file_path]
+        tracks_with_paths = tracks.where('file_path')
         
         if not tracks_with_paths:
             print("未找到带有文件路径的曲目。")
             return False
             
         # 按文件路径排序
-        tracks_with_paths.sort(key=lambda x: x.file_path)
+        tracks_with_paths = tracks_with_paths.sorted('file_path')
         
         # 写入文本文件
         try:
@@ -60,19 +63,26 @@ def export_paths_to_txt(output_path):
 
 def main():
     """主函数，处理命令行参数并运行程序"""
+    args = sys.argv[1:]
+    try:
+        max_age = pop_cache_options(args)
+    except ValueError:
+        print("错误: --max-age 需要一个秒数")
+        return
+    
     # 检查参数
-    if len(sys.argv) < 2:
-        print("用法: python3 export_paths.py <输出路径.txt>")
+    if len(args) < 1:
+        print("用法: python3 export_paths.py <输出路径.txt> [--cached | --max-age 秒数]")
         return
         
-    output_path = sys.argv[1]
+    output_path = args[0]
     
     # 确保文件扩展名是 .txt
     if not output_path.endswith('.txt'):
         output_path += '.txt'
     
     # 导出路径
-    export_paths_to_txt(output_path)
+    export_paths_to_txt(output_path, max_age)
 
 if __name__ == "__main__":
     main()
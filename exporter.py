@@ -1,47 +1,81 @@
+import codecs
 import csv
 import os  # Make sure os is imported at the file level
+import tempfile
 import bridge
+import library_cache
+import columnar
+from batch_update import BatchUpdater
 
-def export_tracks_to_csv(output_path):
+# Encodings tried in order on the start of a CSV file without a byte order mark; latin-1
+# accepts any input, so it is the final fallback
+IMPORT_ENCODINGS = ['utf-8', 'gb18030', 'shift_jis', 'latin-1']
+
+# Byte order marks and the encoding each one selects
+BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+# Number of leading bytes examined to choose the encoding
+SNIFF_BYTES = 1 << 16
+
+def export_tracks_to_csv(output_path, max_age=None):
     """
     Export track list to CSV file with id, name, album, artist, album artist, play count, favorite status, duration, and file path.
     
     Args:
         output_path (str): Path to save the CSV file
+        max_age (float, optional): Export from the library snapshot if it is at most this many
+            seconds old (float('inf') for any age); None reads the live library
     
     Returns:
         bool: True if export was successful, False otherwise
     """
     try:
-        tracks = bridge.get_all_tracks()
-        
-        if not tracks:
-            print("No tracks found in your library.")
-            return False
-        
+        # Write to a temporary file next to the target and rename it into place at the end,
+        # so a failed or interrupted export never replaces a good one
+        directory = os.path.dirname(os.path.abspath(output_path))
+        temp_file = tempfile.NamedTemporaryFile('w', dir=directory, prefix='.tracks_export-', suffix='.tmp',
+                                                newline='', encoding='utf-8-sig', delete=False)
+        exported = 0
         try:
             # Use 'utf-8-sig' encoding which includes BOM for Excel compatibility
-            with open(output_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+            with temp_file as csvfile:
                 fieldnames = ['id', 'name', 'album', 'artist', 'album_artist', 'play_count', 'is_favorite', 'duration', 'file_path']
                 writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
                 
                 writer.writeheader()
-                for track in tracks:
-                    writer.writerow({
-                        'id': track.id,
-                        'name': track.name,
-                        'album': track.album,
-                        'artist': track.artist,
-                        'album_artist': track.album_artist,
-                        'play_count': track.play_count,
-                        'is_favorite': track.is_favorite,
-                        'duration': track.duration,
-                        'file_path': track.file_path
-                    })
-                    
-            print(f"Successfully exported {len(tracks)} tracks to {output_path}")
+                # Tracks arrive chunk by chunk; each chunk is written and flushed before the next is fetched
+                for tracks in library_cache.iter_track_chunks(max_age):
+                    for track in tracks:
+                        writer.writerow({
+                            'id': track.id,
+                            'name': track.name,
+                            'album': track.album,
+                            'artist': track.artist,
+                            'album_artist': track.album_artist,
+                            'play_count': track.play_count,
+                            'is_favorite': track.is_favorite,
+                            'duration': track.duration,
+                            'file_path': track.file_path
+                        })
+                    csvfile.flush()
+                    exported += len(tracks)
+                    print(f"Exported {exported} tracks...")
+            
+            if not exported:
+                os.remove(temp_file.name)
+                print("No tracks found in your library.")
+                return False
+            
+            # NamedTemporaryFile creates the file as 0600; give it the mode open() would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_file.name, 0o666 & ~umask)
+            os.replace(temp_file.name, output_path)
+            print(f"Successfully exported {exported} tracks to {output_path}")
             return True
         except Exception as e:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
             print(f"Error writing CSV file: {e}")
             return False
             
@@ -49,6 +83,97 @@ def export_tracks_to_csv(output_path):
         print("Error: The bridge module doesn't support track export functionality.")
         print("Please make sure you have the latest version of this application.")
         return False
+    except OSError as e:
+        print(f"Error writing CSV file: {e}")
+        return False
+
+def export_tracks_to_columnar(output_path, max_age=None):
+    """
+    Export the track list to a columnar binary snapshot (see columnar.py).
+    
+    Args:
+        output_path (str): Path to save the snapshot file
+        max_age (float, optional): Maximum library snapshot age, see export_tracks_to_csv
+    
+    Returns:
+        bool: True if export was successful, False otherwise
+    """
+    try:
+        exported = columnar.write_snapshot(output_path, library_cache.iter_track_chunks(max_age))
+    except Exception as e:
+        print(f"Error writing columnar file: {e}")
+        return False
+    
+    if not exported:
+        # Nothing was written, so an earlier export at output_path is left as it was
+        print("No tracks found in your library.")
+        return False
+    
+    print(f"Successfully exported {exported} tracks to {output_path}")
+    return True
+
+def import_tracks_from_columnar(input_path):
+    """
+    Import play counts, favorite status, names, albums and artists from a columnar snapshot, matching by track ID.
+    
+    Args:
+        input_path (str): Path to the snapshot file
+        
+    Returns:
+        bool: True if import was successful, False otherwise
+    """
+    try:
+        with columnar.ColumnarSnapshot(input_path) as snapshot:
+            updater = BatchUpdater()
+            updated_count = failed_count = 0
+            for track in snapshot.tracks():
+                if updater.add(track.id, track.play_count, track.is_favorite, track.name, track.album, track.artist):
+                    updated_count += 1
+                else:
+                    failed_count += 1
+            result = updater.flush()
+    except Exception as e:
+        print(f"Error importing columnar file: {e}")
+        return False
+    
+    print(f"Changed {result.changed} track properties with {result.events_sent} Apple Events "
+          f"({result.events_saved} saved by batching)")
+    print(f"Import complete: {updated_count - result.failed} tracks updated, {failed_count + result.failed} failed, 0 skipped")
+    return True
+
+def sniff_encoding(input_path, sample_size=SNIFF_BYTES):
+    """
+    Pick the encoding of a CSV file from its byte order mark or, without one, from a bounded prefix.
+    
+    Args:
+        input_path (str): Path to the CSV file
+        sample_size (int, optional): Number of leading bytes to examine
+        
+    Returns:
+        str: The first encoding in IMPORT_ENCODINGS that decodes the prefix cleanly
+    """
+    with open(input_path, 'rb') as f:
+        sample = f.read(sample_size)
+        at_end = not f.read(1)
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in IMPORT_ENCODINGS:
+        try:
+            # A multi-byte character cut off at the end of the sample is not an error
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=at_end)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return IMPORT_ENCODINGS[-1]
+
+def _fallback_encodings(encoding):
+    """Return the encodings to try, in order, when a file fails to decode as the sniffed one."""
+    if encoding == 'utf-8-sig':
+        encoding = 'utf-8'
+    if encoding not in IMPORT_ENCODINGS:
+        return []
+    return IMPORT_ENCODINGS[IMPORT_ENCODINGS.index(encoding) + 1:]
 
 def import_tracks_from_csv(input_path):
     """
@@ -58,45 +183,47 @@ def import_tracks_from_csv(input_path):
     1. Standard format with 'id' column (from export_tracks_to_csv)
     2. Matched tracks format with 'File Directory' column
     
+    The encoding is sniffed from the start of the file. Every row is decoded before the
+    first change is sent to Music (updates by ID are queued, matched tracks rows are read
+    into memory), so if a later row doesn't decode, the file is read again with the next
+    candidate encoding.
+    
     Args:
         input_path (str): Path to the CSV file
         
     Returns:
         bool: True if import was successful, False otherwise
     """
-    # Import os directly in the function to ensure it's available
-    import os
-    
     if not os.path.exists(input_path):
         print(f"Error: File does not exist: {input_path}")
         return False
         
     try:
-        updated_count = 0
-        failed_count = 0
-        skipped_count = 0
-        
-        # Try multiple encodings in case of issues
-        encodings = ['utf-8-sig', 'utf-8', 'latin-1', 'gb18030', 'shift_jis']
-        
-        for encoding in encodings:
-            try:
-                with open(input_path, 'r', newline='', encoding=encoding) as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    
+        encoding = sniff_encoding(input_path)
+        candidates = [encoding] + _fallback_encodings(encoding)
+        for encoding in candidates:
+            if encoding not in ('utf-8', 'utf-8-sig'):
+                print(f"Reading CSV file as {encoding}")
+            updated_count = failed_count = skipped_count = 0
+            
+            with open(input_path, 'r', newline='', encoding=encoding) as csvfile:
+                reader = csv.DictReader(csvfile)
+                try:
                     # Check if this is a standard format or matched tracks format
-                    is_standard_format = 'id' in reader.fieldnames
-                    is_matched_format = 'File Directory' in reader.fieldnames
+                    fieldnames = reader.fieldnames or []
+                    is_standard_format = 'id' in fieldnames
+                    is_matched_format = 'File Directory' in fieldnames
                     
                     if not (is_standard_format or is_matched_format):
                         print(f"Error: CSV file must contain either 'id' or 'File Directory' column")
                         return False
                     
-                    # Store rows so we can process them after determining format
-                    rows = list(reader)
+                    # Updates by ID are queued and sent together once all rows are read
+                    updater = BatchUpdater() if is_standard_format else None
+                    # Matched tracks rows are applied one by one, so they are only applied once all are decoded
+                    matched_rows = [] if is_matched_format and not is_standard_format else None
                     
-                    # Process each row
-                    for row in rows:
+                    for row in reader:
                         if is_standard_format:
                             track_id = row.get('id')
                             if track_id:
@@ -105,7 +232,7 @@ def import_tracks_from_csv(input_path):
                                 name = row.get('name')
                                 album = row.get('album')
                                 artist = row.get('artist')
-                                play_count = int(row.get('play_count')) if row.get('play_count', '').isdigit() else None
+                                play_count = int(row.get('play_count')) if (row.get('play_count') or '').isdigit() else None
                                 is_favorite = row.get('is_favorite')
                                 
                                 # Convert string representation of boolean to actual boolean
@@ -117,43 +244,55 @@ def import_tracks_from_csv(input_path):
                                     else:
                                         is_favorite = None
                                 
-                                # Update track information including name, album, and artist
-                                if bridge.update_track_by_id(track_id, play_count, is_favorite, name, album, artist):
+                                # Queue track information update including name, album, and artist
+                                if updater.add(track_id, play_count, is_favorite, name, album, artist):
                                     updated_count += 1
                                 else:
                                     failed_count += 1
-                        
-                        elif is_matched_format:
-                            # Matched tracks import by file path
-                            file_path = row.get('File Directory')
-                            title = row.get('Title')
-                            album = row.get('Album')
-                            artist = row.get('Artist')
-                            album_artist = row.get('Album Artist')
-                            
-                            if file_path:
-                                # Try to find track by file path only (no title matching fallback)
-                                track = bridge.get_track_by_file_path(file_path)
-                                
-                                if track:
-                                    # Update the track with matched information
-                                    if bridge.update_track_info(track, title, album, artist, album_artist):
-                                        updated_count += 1
-                                    else:
-                                        failed_count += 1
-                                else:
-                                    # Just report failure - no fallback to title matching
-                                    print(f"Could not find track with path: {file_path}")
-                                    failed_count += 1
-                            else:
-                                skipped_count += 1
-                
-                break  # Break out of encoding loop if successful
-            except UnicodeDecodeError:
-                if encoding == encodings[-1]:
-                    print(f"Error: Could not decode the CSV file. Please ensure it's properly encoded.")
+                        else:
+                            matched_rows.append(row)
+                except UnicodeDecodeError as e:
+                    # Nothing has been sent to Music yet, so the file can be read again in another encoding
+                    if encoding != candidates[-1]:
+                        print(f"Could not decode the CSV file near line {reader.line_num + 1} as {encoding}, "
+                              f"trying the next encoding")
+                        continue
+                    print(f"Error: Could not decode the CSV file near line {reader.line_num + 1} as {encoding}: {e}")
+                    print("No changes were sent to Music.")
                     return False
-                continue
+            break
+        
+        for row in matched_rows or ():
+            # Matched tracks import by file path
+            file_path = row.get('File Directory')
+            title = row.get('Title')
+            album = row.get('Album')
+            artist = row.get('Artist')
+            album_artist = row.get('Album Artist')
+            
+            if file_path:
+                # Try to find track by file path only (no title matching fallback)
+                track = bridge.get_track_by_file_path(file_path)
+                
+                if track:
+                    # Update the track with matched information
+                    if bridge.update_track_info(track, title, album, artist, album_artist):
+                        updated_count += 1
+                    else:
+                        failed_count += 1
+                else:
+                    # Just report failure - no fallback to title matching
+                    print(f"Could not find track with path: {file_path}")
+                    failed_count += 1
+            else:
+                skipped_count += 1
+        
+        if updater:
+            result = updater.flush()
+            updated_count -= result.failed
+            failed_count += result.failed
+            print(f"Changed {result.changed} track properties with {result.events_sent} Apple Events "
+                  f"({result.events_saved} saved by batching)")
         
         print(f"Import complete: {updated_count} tracks updated, {failed_count} failed, {skipped_count} skipped")
         return True
@@ -161,17 +300,23 @@ def import_tracks_from_csv(input_path):
         print(f"Error importing CSV: {e}")
         return False
 
-def handle_export_command(path):
+def handle_export_command(path, max_age=None, format='csv'):
     """
     Handle the export command from the CLI.
     
     Args:
-        path (str): Path where to save the CSV file
+        path (str): Path where to save the export file, or a folder to save it in
+        max_age (float, optional): Maximum library snapshot age, see export_tracks_to_csv
+        format (str, optional): 'csv' (default) or 'columnar'
     """
-    if path.endswith('.csv'):
-        export_tracks_to_csv(path)
+    if format == 'columnar':
+        if os.path.isdir(path):
+            path = os.path.join(path, 'tracks_export.amcol')
+        export_tracks_to_columnar(path, max_age)
+    elif path.endswith('.csv'):
+        export_tracks_to_csv(path, max_age)
     else:
-        export_tracks_to_csv(os.path.join(path, 'tracks_export.csv'))
+        export_tracks_to_csv(os.path.join(path, 'tracks_export.csv'), max_age)
 
 def handle_import_command(path):
     """
@@ -185,7 +330,10 @@ def handle_import_command(path):
         return
     
     # 支持任意扩展名的文件，只要文件存在
-    if os.path.exists(path):
+    if columnar.is_columnar(path):
+        print(f"Using columnar file: {path}")
+        import_tracks_from_columnar(path)
+    elif os.path.exists(path):
         print(f"Using file: {path}")
         print("---------------------------------------")
         print("进阶文件路径匹配已启用，将进行多层次匹配")
@@ -0,0 +1,660 @@
+"""
+In-memory stand-in for the Music application.
+
+It mimics the small part of the appscript object model that bridge.py uses
+(playlists, track references, whose-filters, property columns, add/duplicate/delete)
+and counts every simulated Apple Event, optionally sleeping a fixed latency per event.
+This makes it possible to measure and test round-trip costs without a Mac.
+"""
+
+import csv
+import datetime
+import itertools
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+class FakeMusicError(Exception):
+    """Raised where the real Music application would return an Apple Event error."""
+
+class FakeAlias:
+    """Mimics mactypes.Alias, the value Music returns for a track location."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f"mactypes.Alias({self.path!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeAlias) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+# Stand-ins for appscript.k constants
+k = SimpleNamespace(
+    playlist='playlist',
+    missing_value=SimpleNamespace(),
+)
+
+# ---------------------------------------------------------------------------
+# whose-filters
+# ---------------------------------------------------------------------------
+
+class Test:
+    """A whose-filter condition built from ``its``."""
+
+    def __init__(self, predicate, description, equals=None):
+        self.predicate = predicate
+        self.description = description
+        # (property, set of values) for "property is one of values" tests, so that long OR
+        # chains of equality tests (e.g. selecting tracks by ID) match with one set lookup
+        self.equals = equals
+
+    def matches(self, record):
+        return self.predicate(record)
+
+    def AND(self, *others):
+        tests = (self,) + others
+        return Test(lambda r: all(t.matches(r) for t in tests),
+                    ' and '.join(t.description for t in tests))
+
+    def OR(self, *others):
+        tests = (self,) + others
+        description = ' or '.join(t.description for t in tests)
+        if all(t.equals is not None and t.equals[0] == self.equals[0] for t in tests):
+            name = self.equals[0]
+            values = frozenset().union(*(t.equals[1] for t in tests))
+            return Test(lambda r: _comparable(r.get(name)) in values, description, (name, values))
+        return Test(lambda r: any(t.matches(r) for t in tests), description)
+
+    @property
+    def NOT(self):
+        return Test(lambda r: not self.matches(r), f"not ({self.description})")
+
+    def __repr__(self):
+        return f"its.{self.description}"
+
+def _comparable(value):
+    if isinstance(value, FakeAlias):
+        return value.path
+    return value
+
+class TestProperty:
+    """A property of ``its`` that comparisons can be made against."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def _value(self, record):
+        return _comparable(record.get(self.name))
+
+    def __eq__(self, other):
+        try:
+            equals = (self.name, frozenset([other]))
+        except TypeError:
+            equals = None
+        return Test(lambda r: self._value(r) == other, f"{self.name} == {other!r}", equals)
+
+    def __ne__(self, other):
+        return Test(lambda r: self._value(r) != other, f"{self.name} != {other!r}")
+
+    def __lt__(self, other):
+        return Test(lambda r: self._value(r) is not None and self._value(r) < other, f"{self.name} < {other!r}")
+
+    def __le__(self, other):
+        return Test(lambda r: self._value(r) is not None and self._value(r) <= other, f"{self.name} <= {other!r}")
+
+    def __gt__(self, other):
+        return Test(lambda r: self._value(r) is not None and self._value(r) > other, f"{self.name} > {other!r}")
+
+    def __ge__(self, other):
+        return Test(lambda r: self._value(r) is not None and self._value(r) >= other, f"{self.name} >= {other!r}")
+
+    def contains(self, other):
+        return Test(lambda r: isinstance(self._value(r), str) and other in self._value(r),
+                    f"{self.name}.contains({other!r})")
+
+    def beginswith(self, other):
+        return Test(lambda r: isinstance(self._value(r), str) and self._value(r).startswith(other),
+                    f"{self.name}.beginswith({other!r})")
+
+    def endswith(self, other):
+        return Test(lambda r: isinstance(self._value(r), str) and self._value(r).endswith(other),
+                    f"{self.name}.endswith({other!r})")
+
+    def isin(self, other):
+        return Test(lambda r: self._value(r) in other, f"{self.name}.isin(...)")
+
+    __hash__ = None
+
+class Its:
+    """Mimics appscript.its."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return TestProperty(name)
+
+its = Its()
+
+# ---------------------------------------------------------------------------
+# References
+# ---------------------------------------------------------------------------
+
+class PropertyRef:
+    """A property of one track (single value) or of many tracks (a column)."""
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        self._name = name
+
+    def get(self):
+        music = self._owner._music
+        music.event('get', self._name)
+        if isinstance(self._owner, TrackRef):
+            return music.read(self._owner._resolve(), self._name)
+        return [music.read(record, self._name) for record in self._owner._resolve()]
+
+    __call__ = get
+
+    def set(self, value):
+        music = self._owner._music
+        music.event('set', self._name)
+        if isinstance(self._owner, TrackRef):
+            records = [self._owner._resolve()]
+        else:
+            records = self._owner._resolve()
+        for record in records:
+            music.write(record, self._name, value)
+
+class _ElementRef:
+    """Shared behaviour of track references."""
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return PropertyRef(self, name)
+
+class TrackRef(_ElementRef):
+    """A reference to a single track."""
+
+    def __init__(self, music, playlist, selector):
+        self._music = music
+        self._playlist = playlist
+        self._selector = selector
+
+    def _resolve(self):
+        kind, value = self._selector
+        if kind == 'id':
+            record = self._music.tracks_by_id.get(value)
+            if record is None or not self._music.contains(self._playlist, record):
+                raise FakeMusicError(f"Can't get track id {value}.")
+            return record
+        if kind == 'index':
+            try:
+                return self._playlist.records[value - 1 if value > 0 else value]
+            except IndexError:
+                raise FakeMusicError(f"Can't get track {value}.")
+        records = value._resolve()
+        if not records:
+            raise FakeMusicError("Can't get track: no such object.")
+        return records[0]
+
+    def get(self):
+        self._music.event('get', 'track')
+        record = self._resolve()
+        return TrackRef(self._music, self._playlist, ('id', record['id']))
+
+    __call__ = get
+
+    def exists(self):
+        self._music.event('exists', 'track')
+        try:
+            self._resolve()
+            return True
+        except FakeMusicError:
+            return False
+
+    def delete(self):
+        self._music.event('delete', 'track')
+        self._music.delete_track(self._resolve(), self._playlist)
+
+    def duplicate(self, to=None):
+        self._music.event('duplicate', 'track')
+        return self._music.duplicate_records([self._resolve()], to)[0]
+
+    def __eq__(self, other):
+        return isinstance(other, TrackRef) and self._resolve() is other._resolve()
+
+    def __hash__(self):
+        return id(self._resolve())
+
+    def __repr__(self):
+        return f"FakeMusic.track({self._selector[0]}={self._selector[1]!r})"
+
+class TracksRef(_ElementRef):
+    """A reference to the tracks of a playlist, optionally narrowed by range or whose-filter."""
+
+    def __init__(self, music, playlist, selectors=()):
+        self._music = music
+        self._playlist = playlist
+        self._selectors = selectors
+
+    def _resolve(self):
+        records = self._playlist.records
+        for kind, value in self._selectors:
+            if kind == 'range':
+                start, stop = value
+                count = len(records)
+                start = start if start > 0 else count + start + 1
+                stop = stop if stop > 0 else count + stop + 1
+                if start < 1 or stop > count or start > stop:
+                    raise FakeMusicError(f"Can't get tracks {start} thru {stop}.")
+                records = records[start - 1:stop]
+            else:
+                records = [record for record in records if value.matches(record)]
+        return records
+
+    def __getitem__(self, key):
+        if isinstance(key, Test):
+            return TracksRef(self._music, self._playlist, self._selectors + (('filter', key),))
+        if isinstance(key, slice):
+            return TracksRef(self._music, self._playlist, self._selectors + (('range', (key.start, key.stop)),))
+        if self._selectors:
+            return TrackRef(self._music, self._playlist, ('first', TracksRef(
+                self._music, self._playlist, self._selectors + (('range', (key, key)),))))
+        return TrackRef(self._music, self._playlist, ('index', key))
+
+    def ID(self, track_id):
+        return TrackRef(self._music, self._playlist, ('id', track_id))
+
+    def get(self):
+        self._music.event('get', 'tracks')
+        return [TrackRef(self._music, self._playlist, ('id', record['id'])) for record in self._resolve()]
+
+    __call__ = get
+
+    @property
+    def first(self):
+        return TrackRef(self._music, self._playlist, ('first', self))
+
+    @property
+    def last(self):
+        return self[-1]
+
+    def count(self):
+        self._music.event('count', 'tracks')
+        return len(self._resolve())
+
+    def exists(self):
+        self._music.event('exists', 'tracks')
+        return bool(self._resolve())
+
+    def delete(self):
+        self._music.event('delete', 'tracks')
+        for record in list(self._resolve()):
+            self._music.delete_track(record, self._playlist)
+
+    def duplicate(self, to=None):
+        self._music.event('duplicate', 'tracks')
+        return self._music.duplicate_records(list(self._resolve()), to)
+
+class InsertionRef:
+    """The ``playlist.end()`` insertion location."""
+
+    def __init__(self, playlist):
+        self.playlist = playlist
+
+class PlaylistRef:
+    """A reference to one playlist."""
+
+    def __init__(self, music, playlist):
+        self._music = music
+        self._playlist = playlist
+
+    @property
+    def tracks(self):
+        return TracksRef(self._music, self._playlist)
+
+    def get(self):
+        self._music.event('get', 'playlist')
+        return self
+
+    __call__ = get
+
+    def end(self):
+        return InsertionRef(self._playlist)
+
+    def name(self):
+        self._music.event('get', 'name')
+        return self._playlist.name
+
+    def persistent_ID(self):
+        self._music.event('get', 'persistent_ID')
+        return self._playlist.persistent_id
+
+    def __eq__(self, other):
+        return isinstance(other, PlaylistRef) and other._playlist is self._playlist
+
+    def __hash__(self):
+        return id(self._playlist)
+
+    def __repr__(self):
+        return f"FakeMusic.playlist({self._playlist.name!r})"
+
+class PlaylistsRef:
+    """A reference to a collection of playlists."""
+
+    def __init__(self, music, library_only=False):
+        self._music = music
+        self._library_only = library_only
+
+    def _resolve(self):
+        if self._library_only:
+            return [self._music.library]
+        return [self._music.library] + self._music.playlists
+
+    def __getitem__(self, key):
+        playlists = self._resolve()
+        if isinstance(key, int):
+            try:
+                return PlaylistRef(self._music, playlists[key - 1 if key > 0 else key])
+            except IndexError:
+                raise FakeMusicError(f"Can't get playlist {key}.")
+        for playlist in playlists:
+            if playlist.name == key:
+                return PlaylistRef(self._music, playlist)
+        return _MissingPlaylistRef(self._music, key)
+
+    def get(self):
+        self._music.event('get', 'playlists')
+        return [PlaylistRef(self._music, playlist) for playlist in self._resolve()]
+
+    __call__ = get
+
+    @property
+    def persistent_ID(self):
+        return PlaylistPropertyRef(self, 'persistent_ID', 'persistent_id')
+
+class PlaylistPropertyRef:
+    """A property of every playlist in a collection (a column)."""
+
+    def __init__(self, playlists, name, attribute):
+        self._playlists = playlists
+        self._name = name
+        self._attribute = attribute
+
+    def get(self):
+        self._playlists._music.event('get', self._name)
+        return [getattr(playlist, self._attribute) for playlist in self._playlists._resolve()]
+
+    __call__ = get
+
+class _MissingPlaylistRef:
+    """A by-name playlist reference that does not resolve."""
+
+    def __init__(self, music, name):
+        self._music = music
+        self._name = name
+
+    def get(self):
+        self._music.event('get', 'playlist')
+        raise FakeMusicError(f"Can't get playlist {self._name!r}.")
+
+    __call__ = get
+
+# Classes standing in for appscript references
+REFERENCE_TYPES = (PropertyRef, TrackRef, TracksRef, InsertionRef, PlaylistRef, PlaylistsRef, PlaylistPropertyRef,
+                   _MissingPlaylistRef)
+
+class FakeApp:
+    """Mimics ``appscript.app('Music')``."""
+
+    def __init__(self, music):
+        self._music = music
+        self.library_playlists = PlaylistsRef(music, library_only=True)
+        self.playlists = PlaylistsRef(music)
+        self.k = k
+
+    def add(self, path, to=None):
+        self._music.event('add', 'track')
+        record = self._music.add_file(path)
+        if to is not None:
+            self._music.duplicate_records([record], to)
+        return TrackRef(self._music, self._music.library, ('id', record['id']))
+
+    def make(self, new=None, with_properties=None):
+        self._music.event('make', new or 'element')
+        if new != k.playlist:
+            raise FakeMusicError(f"Can't make {new}.")
+        name = (with_properties or {}).get('name', 'untitled playlist')
+        return PlaylistRef(self._music, self._music.add_playlist(name))
+
+# ---------------------------------------------------------------------------
+# Library state
+# ---------------------------------------------------------------------------
+
+class FakePlaylist:
+    """A playlist holding an ordered list of track records."""
+
+    def __init__(self, name, persistent_id, records=None):
+        self.name = name
+        self.persistent_id = persistent_id
+        self.records = list(records or [])
+
+class FakeMusic:
+    """
+    An in-memory Music library.
+
+    Args:
+        tracks (iterable, optional): Track property dicts, e.g. from synthetic_tracks()
+        playlists (dict, optional): Playlist name mapped to a list of track ids
+        latency (float, optional): Seconds to sleep per simulated Apple Event (default: 0)
+    """
+
+    def __init__(self, tracks=(), playlists=None, latency=0.0):
+        self.latency = latency
+        self.events = 0
+        self.events_by_kind = Counter()
+        self._ids = itertools.count(1)
+        self._persistent_ids = itertools.count(1)
+        self.tracks_by_id = {}
+        self.library = FakePlaylist('Library', self._next_persistent_id())
+        self.playlists = []
+        self.app = FakeApp(self)
+
+        for properties in tracks:
+            self.add_record(properties)
+        for name, track_ids in (playlists or {}).items():
+            playlist = self.add_playlist(name)
+            playlist.records = [self.tracks_by_id[track_id] for track_id in track_ids if track_id in self.tracks_by_id]
+
+    def event(self, command, target):
+        """Count one simulated Apple Event."""
+        self.events += 1
+        self.events_by_kind[f"{command} {target}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_events(self):
+        """Reset the event counters."""
+        self.events = 0
+        self.events_by_kind.clear()
+
+    def _next_persistent_id(self):
+        return f"{next(self._persistent_ids):016X}"
+
+    def add_record(self, properties):
+        """Add a track to the library from a dict of Music property values, returning the record."""
+        now = datetime.datetime.now()
+        record = {
+            'id': None,
+            'persistent_ID': None,
+            'name': '',
+            'album': '',
+            'artist': '',
+            'album_artist': '',
+            'played_count': 0,
+            'favorited': False,
+            'duration': 0.0,
+            'location': None,
+            'date_added': now,
+            'modification_date': now,
+        }
+        record.update(properties)
+        if record['id'] is None or record['id'] in self.tracks_by_id:
+            record['id'] = next(self._ids)
+            while record['id'] in self.tracks_by_id:
+                record['id'] = next(self._ids)
+        if record['persistent_ID'] is None:
+            record['persistent_ID'] = self._next_persistent_id()
+        if isinstance(record['location'], str):
+            record['location'] = FakeAlias(record['location']) if record['location'] else None
+        self.tracks_by_id[record['id']] = record
+        self.library.records.append(record)
+        return record
+
+    def add_file(self, path):
+        """Add a file to the library the way ``app.add`` would."""
+        for record in self.library.records:
+            location = record['location']
+            if location is not None and location.path == path:
+                return record
+        name = path.rstrip('/').rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        return self.add_record({'name': name, 'location': path})
+
+    def contains(self, playlist, record):
+        if playlist is self.library:
+            return self.tracks_by_id.get(record['id']) is record
+        return any(each is record for each in playlist.records)
+
+    def add_playlist(self, name):
+        playlist = FakePlaylist(name, self._next_persistent_id())
+        self.playlists.append(playlist)
+        return playlist
+
+    def read(self, record, name):
+        if name not in record:
+            raise FakeMusicError(f"Can't get {name} of track.")
+        value = record[name]
+        if name == 'location' and value is None:
+            return k.missing_value
+        return value
+
+    def write(self, record, name, value):
+        if name in ('id', 'persistent_ID', 'location', 'duration', 'date_added'):
+            raise FakeMusicError(f"Can't set {name} of track.")
+        record[name] = value
+        record['modification_date'] = datetime.datetime.now()
+
+    def delete_track(self, record, playlist):
+        if playlist is self.library:
+            self.tracks_by_id.pop(record['id'], None)
+            for each in [self.library] + self.playlists:
+                each.records = [r for r in each.records if r is not record]
+        else:
+            playlist.records.remove(record)
+
+    def duplicate_records(self, records, to):
+        if isinstance(to, InsertionRef):
+            playlist = to.playlist
+        elif isinstance(to, PlaylistRef):
+            playlist = to._playlist
+        else:
+            raise FakeMusicError("Can't duplicate tracks: no destination playlist.")
+        playlist.records.extend(records)
+        return [TrackRef(self, playlist, ('id', record['id'])) for record in records]
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+_WORDS = ['love', 'night', 'summer', 'blue', 'dream', 'light', 'road', 'heart', 'rain', 'fire',
+          'star', 'river', 'home', 'wild', 'gold', 'echo', 'city', 'sky', 'moon', 'time']
+_CJK_WORDS = ['夜明け', '桜', '恋', '青い空', '夢', '星屑', '月光', '光', '雨音', '約束']
+
+def _title(rng):
+    if rng.random() < 0.2:
+        return ''.join(rng.sample(_CJK_WORDS, rng.randint(1, 2)))
+    return ' '.join(rng.sample(_WORDS, rng.randint(1, 3))).title()
+
+def synthetic_tracks(count, seed=0, media_root='/Users/music/Music/Media.localized'):
+    """
+    Generate a reproducible synthetic library.
+
+    Paths follow the Music media folder layout and include .movpkg packages,
+    CJK names, duplicate basenames ("song 2.m4a") and tracks without a file.
+
+    Args:
+        count (int): Number of tracks to generate
+        seed (int, optional): Random seed (default: 0)
+        media_root (str, optional): Root of the generated file paths
+
+    Returns:
+        list: Track property dicts suitable for FakeMusic
+    """
+    rng = random.Random(seed)
+    artists = [_title(rng) for _ in range(max(1, count // 40))]
+    albums = [_title(rng) for _ in range(max(1, count // 12))]
+    base = datetime.datetime(2020, 1, 1)
+    tracks = []
+
+    for index in range(count):
+        artist = rng.choice(artists)
+        album = rng.choice(albums)
+        name = _title(rng)
+        roll = rng.random()
+        if roll < 0.02:
+            location = None
+        elif roll < 0.25:
+            suffix = f" {rng.randint(2, 3)}" if rng.random() < 0.2 else ''
+            location = f"{media_root}/Apple Music/{artist}/{album}/{name}{suffix}.movpkg"
+        else:
+            suffix = f" {rng.randint(2, 3)}" if rng.random() < 0.05 else ''
+            location = f"{media_root}/Music/{artist}/{album}/{index % 20 + 1:02d} {name}{suffix}.m4a"
+        added = base + datetime.timedelta(minutes=index)
+        tracks.append({
+            'id': 1000 + index,
+            'persistent_ID': f"{rng.getrandbits(64):016X}",
+            'name': name,
+            'album': album,
+            'artist': artist,
+            'album_artist': artist if rng.random() < 0.9 else 'Various Artists',
+            'played_count': int(rng.expovariate(1 / 12)),
+            'favorited': rng.random() < 0.1,
+            'duration': round(rng.uniform(90, 420), 3),
+            'location': location,
+            'date_added': added,
+            'modification_date': added,
+        })
+
+    return tracks
+
+def tracks_from_csv(path):
+    """
+    Read track property dicts from a CSV written by exporter.export_tracks_to_csv.
+
+    Args:
+        path (str): Path to the CSV file
+
+    Returns:
+        list: Track property dicts suitable for FakeMusic
+    """
+    tracks = []
+    with open(path, newline='', encoding='utf-8-sig') as csvfile:
+        for row in csv.DictReader(csvfile):
+            tracks.append({
+                'id': int(row['id']) if row.get('id', '').isdigit() else None,
+                'name': row.get('name', ''),
+                'album': row.get('album', ''),
+                'artist': row.get('artist', ''),
+                'album_artist': row.get('album_artist', ''),
+                'played_count': int(row['play_count']) if row.get('play_count', '').isdigit() else 0,
+                'favorited': row.get('is_favorite', '').lower() in ('true', '1', 'yes', 'y'),
+                'duration': float(row['duration']) if row.get('duration') else 0.0,
+                'location': row.get('file_path') or None,
+            })
+    return tracks
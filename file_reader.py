@@ -1,7 +1,13 @@
 from mutagen.mp4 import MP4
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 import os
 
+DEFAULT_EXTENSIONS = ('.m4a',)
+
+# Extensions read with the MP4 tag reader; everything else goes through mutagen's easy tags
+MP4_EXTENSIONS = ('.m4a', '.m4p', '.m4b', '.mp4')
+
 def read_m4a_metadata(file_path):
     try:
         audio = MP4(file_path)
@@ -13,21 +19,101 @@ def read_m4a_metadata(file_path):
     except Exception as e:
         return f"Error reading metadata: {str(e)}"
 
-def process_folder(folder_path):
-    for file in os.listdir(folder_path):
-        if file.endswith('.m4a'):
-            full_path = os.path.join(folder_path, file)
-            yield full_path
+def read_metadata(file_path):
+    """Read title, artist and album of any audio file mutagen understands."""
+    if file_path.lower().endswith(MP4_EXTENSIONS):
+        return read_m4a_metadata(file_path)
+    try:
+        import mutagen
 
-def process_file(file_path):
-    metadata = read_m4a_metadata(file_path)
-    print(f"\nProcessing: {file_path}")
-    # print(f"Metadata: {metadata}")
+        audio = mutagen.File(file_path, easy=True) or {}
+        return SimpleNamespace(
+            title=audio.get('title', [os.path.splitext(os.path.basename(file_path))[0]])[0],
+            artist=audio.get('artist', [None])[0],
+            album=audio.get('album', [None])[0],
+        )
+    except Exception as e:
+        return f"Error reading metadata: {str(e)}"
+
+def scan_folder(folder_path, extensions=DEFAULT_EXTENSIONS, recursive=True):
+    """
+    Yield paths of audio files under a folder.
+
+    Args:
+        folder_path (str): Folder to scan
+        extensions (tuple, optional): File extensions to include, case-insensitive (default: ('.m4a',))
+        recursive (bool, optional): Descend into subfolders, not following symlinked ones (default: True)
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    pending = [folder_path]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error reading folder {directory}: {e}")
+            continue
+        subfolders = []
+        for entry in entries:
+            # Skip hidden files, including the ._ files macOS leaves on network storage
+            if entry.name.startswith('.'):
+                continue
+            try:
+                # Symlinked folders are not followed, so a link loop can't recurse forever
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subfolders.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    yield entry.path
+            except OSError:
+                continue
+        pending.extend(reversed(subfolders))
+
+def process_folder(folder_path, extensions=DEFAULT_EXTENSIONS, recursive=True):
+    yield from scan_folder(folder_path, extensions, recursive)
+
+def read_file(file_path):
     return SimpleNamespace(
-        meta=metadata,
+        meta=read_metadata(file_path),
         path=file_path,
     )
 
-def get_songs_in_folder(folder_path):
-    for file_path in process_folder(folder_path):
-        yield process_file(file_path)
+def process_file(file_path):
+    song = read_file(file_path)
+    print(f"\nProcessing: {file_path}")
+    # print(f"Metadata: {metadata}")
+    return song
+
+def get_songs_in_folder(folder_path, extensions=DEFAULT_EXTENSIONS, recursive=True, workers=8):
+    """
+    Scan a folder and read the metadata of every file on a bounded thread pool.
+
+    Results are yielded as soon as each file has been read, so callers can start working
+    before the scan finishes. At most a few batches of files are in flight at once.
+
+    Args:
+        folder_path (str): Folder to scan
+        extensions (tuple, optional): File extensions to include (default: ('.m4a',))
+        recursive (bool, optional): Descend into subfolders (default: True)
+        workers (int, optional): Number of reader threads (default: 8)
+
+    Yields:
+        SimpleNamespace: meta and path of each file, in completion order
+    """
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for file_path in scan_folder(folder_path, extensions, recursive):
+            in_flight.add(executor.submit(read_file, file_path))
+            if len(in_flight) < max_in_flight:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                song = future.result()
+                print(f"\nProcessing: {song.path}")
+                yield song
+        for future in as_completed(in_flight):
+            song = future.result()
+            print(f"\nProcessing: {song.path}")
+            yield song
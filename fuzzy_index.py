@@ -0,0 +1,150 @@
+"""
+Trigram index for fuzzy title/artist/album matching.
+
+Names are normalized (NFKC, case-folded, punctuation removed) and split into
+padded character trigrams. An inverted index from trigram to distinct titles
+narrows a query down to the titles sharing the most trigrams with it; every
+track carrying one of those titles is then ranked by Dice similarity over title,
+artist and album. Only the rarest trigrams of a query are used to collect candidates.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_SPACES = re.compile(r'\s+')
+
+# Relative weight of each field in the combined score
+FIELD_WEIGHTS = {'name': 0.6, 'artist': 0.25, 'album': 0.15}
+
+# Number of distinct candidate titles whose tracks are scored in full per query
+CANDIDATES = 50
+
+# Only the rarest query trigrams are used to collect candidates; common ones add little
+CANDIDATE_TRIGRAMS = 8
+
+def normalize(text):
+    """Normalize a name for fuzzy comparison."""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _PUNCTUATION.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+def trigrams(text):
+    """Return the set of padded character trigrams of an already normalized string."""
+    if not text:
+        return frozenset()
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def similarity(a, b):
+    """Dice coefficient of two trigram sets, 0..1."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+class FuzzyIndex:
+    """
+    Trigram inverted index over track names, artists and albums.
+
+    Args:
+        names (list): Track names in library order
+        artists (list): Track artists in library order
+        albums (list): Track albums in library order
+    """
+
+    def __init__(self, names, artists, albums):
+        # Equal trigram sets share one object, so per-query scores can be cached by identity
+        interned = {}
+
+        def intern(value):
+            grams = trigrams(normalize(value))
+            return interned.setdefault(grams, grams)
+
+        self.fields = {
+            'name': [intern(value) for value in names],
+            'artist': [intern(value) for value in artists],
+            'album': [intern(value) for value in albums],
+        }
+        # Normalized artists, for searches restricted to one artist
+        normalized = {}
+        self.artists = [normalized.setdefault(value, normalize(value)) for value in artists]
+        # Tracks grouped by distinct normalized title; postings point at title numbers
+        titles = {}
+        self.title_positions = []
+        for position, grams in enumerate(self.fields['name']):
+            number = titles.setdefault(grams, len(titles))
+            if number == len(self.title_positions):
+                self.title_positions.append([])
+            self.title_positions[number].append(position)
+        self.title_grams = list(titles)
+        self.postings = {}
+        for grams, number in titles.items():
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(number)
+
+    def __len__(self):
+        return len(self.fields['name'])
+
+    def search(self, title, artist=None, album=None, limit=5, exclude=(), artist_contains=None):
+        """
+        Rank tracks by similarity to a title and, optionally, artist and album.
+
+        Args:
+            title (str): Track title to search for
+            artist (str, optional): Artist name
+            album (str, optional): Album name
+            limit (int, optional): Maximum number of results (default: 5)
+            exclude (container, optional): Positions to leave out
+            artist_contains (str, optional): Only rank tracks whose normalized artist contains
+                this one, normalized the same way
+
+        Returns:
+            list: (position, score) pairs, best first; scores range from 0 to 1
+        """
+        query = {'name': trigrams(normalize(title))}
+        if artist:
+            query['artist'] = trigrams(normalize(artist))
+        if album:
+            query['album'] = trigrams(normalize(album))
+        if not query['name']:
+            return []
+        required_artist = normalize(artist_contains) if artist_contains else None
+
+        postings = sorted((self.postings.get(gram, ()) for gram in query['name']), key=len)
+        shared = Counter()
+        for positions in postings[:CANDIDATE_TRIGRAMS]:
+            shared.update(positions)
+        total_weight = sum(FIELD_WEIGHTS[field] for field in query)
+        other_fields = [(field, grams, {}) for field, grams in query.items() if field != 'name']
+        results = []
+        for number, _ in shared.most_common(CANDIDATES):
+            title_score = FIELD_WEIGHTS['name'] * similarity(query['name'], self.title_grams[number])
+            for position in self.title_positions[number]:
+                if position in exclude or (required_artist is not None
+                                           and required_artist not in self.artists[position]):
+                    continue
+                score = title_score
+                for field, grams, scores in other_fields:
+                    value = self.fields[field][position]
+                    if id(value) not in scores:
+                        scores[id(value)] = FIELD_WEIGHTS[field] * similarity(grams, value)
+                    score += scores[id(value)]
+                results.append((position, score / total_weight))
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+    def search_many(self, queries, limit=1):
+        """
+        Run many searches in one call.
+
+        Args:
+            queries (iterable): (title, artist, album) tuples; artist and album may be None
+            limit (int, optional): Maximum number of results per query (default: 1)
+
+        Returns:
+            list: The search() result for each query
+        """
+        return [self.search(title, artist, album, limit) for title, artist, album in queries]
@@ -0,0 +1,205 @@
+"""
+Content hashing with a persistent digest cache.
+
+Files are hashed in large buffered reads on a process pool, and every digest is
+stored keyed by (path, size, mtime) so unchanged files are never hashed again.
+.movpkg packages are directories; they are hashed over their sorted contents.
+"""
+
+import hashlib
+import os
+import sqlite3
+from collections import defaultdict
+
+DEFAULT_HASH_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.amutils', 'hashes.sqlite3')
+
+# Read size for hashing; large reads keep syscall overhead negligible
+BUFFER_SIZE = 1 << 20
+
+# Below this many files to hash, a process pool costs more than it saves
+MIN_POOL_FILES = 8
+
+def _package_files(path):
+    """Yield (relative path, full path) of every file in a package directory, sorted."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            yield os.path.relpath(full_path, path), full_path
+
+def file_signature(path):
+    """
+    Return (size, mtime_ns) of a file or package directory.
+
+    Raises:
+        OSError: If the path can't be read
+    """
+    info = os.stat(path)
+    if not os.path.isdir(path):
+        return info.st_size, info.st_mtime_ns
+    size, mtime = 0, info.st_mtime_ns
+    for _, full_path in _package_files(path):
+        member = os.stat(full_path)
+        size += member.st_size
+        mtime = max(mtime, member.st_mtime_ns)
+    return size, mtime
+
+def _update_from_file(digest, path, buffer):
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+
+def hash_file(path):
+    """
+    Calculate the SHA256 of a file, or of a package directory's sorted contents.
+
+    Args:
+        path (str): Path to the file or package
+
+    Returns:
+        str: SHA256 hash as hexadecimal string
+
+    Raises:
+        OSError: If the file can't be read
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(BUFFER_SIZE)
+    if os.path.isdir(path):
+        for relative_path, full_path in _package_files(path):
+            digest.update(relative_path.encode('utf-8', 'surrogateescape') + b'\0')
+            _update_from_file(digest, full_path, buffer)
+    else:
+        _update_from_file(digest, path, buffer)
+    return digest.hexdigest()
+
+def _hash_or_error(path):
+    try:
+        return path, hash_file(path), None
+    except OSError as e:
+        return path, None, str(e)
+
+class HashCache:
+    """
+    SQLite store of digests keyed by (path, size, mtime).
+
+    Args:
+        path (str, optional): Database path (default: $AMUTILS_HASH_CACHE or ~/.amutils/hashes.sqlite3)
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('AMUTILS_HASH_CACHE') or DEFAULT_HASH_CACHE_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                        'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)')
+
+    def close(self):
+        self.db.close()
+
+    def get(self, path, size, mtime_ns):
+        row = self.db.execute('SELECT sha256 FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?',
+                              (path, size, mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, rows):
+        """Store (path, size, mtime_ns, sha256) rows."""
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)', rows)
+
+def hash_files(paths, cache=None, workers=None, signatures=None):
+    """
+    Hash many files, reusing cached digests for files that haven't changed.
+
+    Args:
+        paths (iterable): File or package paths
+        cache (HashCache, optional): Digest cache (default: a HashCache at the default path)
+        workers (int, optional): Process pool size (default: number of CPUs)
+        signatures (dict, optional): Path mapped to an already known (size, mtime_ns)
+
+    Returns:
+        dict: Path mapped to its SHA256 hex digest; unreadable files are left out
+    """
+    own_cache = cache is None
+    cache = cache or HashCache()
+    signatures = dict(signatures or {})
+    digests = {}
+    missing = []
+
+    try:
+        for path in paths:
+            try:
+                signature = signatures.get(path) or file_signature(path)
+            except OSError as e:
+                print(f"Error calculating hash for {path}: {e}")
+                continue
+            signatures[path] = signature
+            cached = cache.get(path, *signature)
+            if cached:
+                digests[path] = cached
+            else:
+                missing.append(path)
+
+        if len(missing) >= MIN_POOL_FILES and workers != 1:
+            # Imported here: it pulls in multiprocessing, which is slow to load for every command
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_hash_or_error, missing, chunksize=4))
+        else:
+            results = [_hash_or_error(path) for path in missing]
+
+        rows = []
+        for path, digest, error in results:
+            if error:
+                print(f"Error calculating hash for {path}: {error}")
+                continue
+            digests[path] = digest
+            rows.append((path,) + tuple(signatures[path]) + (digest,))
+        cache.put_many(rows)
+    finally:
+        if own_cache:
+            cache.close()
+
+    return digests
+
+def find_duplicates(paths, cache=None, workers=None):
+    """
+    Find files with identical content.
+
+    Files are grouped by size first, so only files sharing a size with another file are hashed.
+
+    Args:
+        paths (iterable): File or package paths
+        cache (HashCache, optional): Digest cache (default: a HashCache at the default path)
+        workers (int, optional): Process pool size (default: number of CPUs)
+
+    Returns:
+        list: Lists of duplicate paths, largest wasted space first
+    """
+    by_size = defaultdict(list)
+    signatures = {}
+    for path in dict.fromkeys(paths):
+        try:
+            signatures[path] = file_signature(path)
+        except OSError:
+            continue
+        by_size[signatures[path][0]].append(path)
+
+    # Empty files are trivially identical and not worth reporting
+    candidates = [path for size, group in by_size.items() if size and len(group) > 1 for path in group]
+    digests = hash_files(candidates, cache, workers, signatures)
+
+    by_digest = defaultdict(list)
+    for path in candidates:
+        if path in digests:
+            by_digest[digests[path]].append(path)
+
+    groups = [group for group in by_digest.values() if len(group) > 1]
+    groups.sort(key=lambda group: signatures[group[0]][0] * (len(group) - 1), reverse=True)
+    return groups
@@ -0,0 +1,424 @@
+"""
+Append-only play count history for ``amutils snapshot`` and ``amutils history``.
+
+Every snapshot appends one compressed record to the history file. Tracks are
+keyed by persistent ID and numbered in the order they were first seen, so a
+snapshot is stored as a delta against the previous one: the persistent IDs,
+names and artists of tracks seen for the first time, the track numbers whose
+play count changed with the change, and the track numbers whose favorite
+status or presence in the library flipped. Track numbers are gap-encoded and
+each record is zlib compressed, so a daily snapshot of a large library costs
+a few kilobytes.
+
+Queries replay the records into play count, favorite and presence columns
+aligned by track number, so comparing two snapshots is a vectorized
+subtraction of two columns (NumPy when installed, ``array`` otherwise).
+
+File layout::
+
+    MAGIC | record ... ; record = length (uint32) | CRC-32 (uint32) | zlib(payload)
+    payload = header | JSON of new and renamed tracks | play numbers | play deltas
+              | favorite numbers | presence numbers
+"""
+
+import heapq
+import json
+import operator
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from itertools import accumulate, compress
+from types import SimpleNamespace
+import library_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.amutils', 'history.amhist')
+
+MAGIC = b'AMUTHIS1'
+
+# Properties read from the library for each snapshot
+SNAPSHOT_PROPERTIES = ['persistent_ID', 'name', 'artist', 'played_count', 'favorited']
+
+# Number of tracks and artists `amutils history` lists
+DEFAULT_TOP = 10
+
+_RECORD = struct.Struct('<II')
+# time, tracks in library, total plays, new plays of known tracks, JSON length, and the
+# lengths of the play, favorite and presence sections
+_HEADER = struct.Struct('<dIQqIIII')
+
+def history_path():
+    """Return the history file path: $AMUTILS_HISTORY or ~/.amutils/history.amhist."""
+    return os.environ.get('AMUTILS_HISTORY') or DEFAULT_HISTORY_PATH
+
+def _gaps(numbers):
+    """Gap-encode ascending track numbers, e.g. [3, 10, 11] -> [3, 7, 1]."""
+    return array('I', map(operator.sub, numbers, [0] + numbers[:-1]))
+
+def _pack(values):
+    """Return an array as little-endian bytes."""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _unpack(typecode, data, offset, count):
+    """Read count little-endian values at offset; returns the array and the offset after it."""
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values, end
+
+def _copy(values):
+    return values.copy() if numpy is not None else values[:]
+
+class History:
+    """
+    The snapshots recorded in a history file.
+
+    Reading keeps every record decoded in memory; they hold only changes, so this stays
+    small. A truncated last record, left by an interrupted write, is ignored and cut off
+    by the next append().
+
+    Args:
+        path (str, optional): History file (default: history_path())
+    """
+
+    def __init__(self, path=None):
+        self.path = path or history_path()
+        self.keys = []
+        self.names = []
+        self.artists = []
+        self.records = []
+        self._valid_length = len(MAGIC)
+        self._read()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not an amutils history file")
+        offset = len(MAGIC)
+        while offset + _RECORD.size <= len(data):
+            length, checksum = _RECORD.unpack_from(data, offset)
+            body = data[offset + _RECORD.size:offset + _RECORD.size + length]
+            if len(body) < length or zlib.crc32(body) != checksum:
+                print(f"Warning: ignoring a damaged record at the end of {self.path}")
+                break
+            self._decode(zlib.decompress(body))
+            offset += _RECORD.size + length
+        self._valid_length = offset
+
+    def _decode(self, payload):
+        (timestamp, tracks, total_plays, new_plays, json_length,
+         play_count, favorite_count, presence_count) = _HEADER.unpack_from(payload)
+        offset = _HEADER.size
+        tracks_json = json.loads(payload[offset:offset + json_length])
+        offset += json_length
+        first_new = len(self.keys)
+        for key, name, artist in tracks_json['new']:
+            self.keys.append(key)
+            self.names.append(name)
+            self.artists.append(artist)
+        for number, name, artist in tracks_json['renamed']:
+            self.names[number] = name
+            self.artists[number] = artist
+        play_gaps, offset = _unpack('I', payload, offset, play_count)
+        play_deltas, offset = _unpack('i', payload, offset, play_count)
+        favorite_gaps, offset = _unpack('I', payload, offset, favorite_count)
+        presence_gaps, offset = _unpack('I', payload, offset, presence_count)
+        self.records.append(SimpleNamespace(
+            time=timestamp, tracks=tracks, total_plays=total_plays, new_plays=new_plays,
+            first_new=first_new, key_count=len(self.keys),
+            play_numbers=array('I', accumulate(play_gaps)), play_deltas=play_deltas,
+            favorite_numbers=array('I', accumulate(favorite_gaps)),
+            presence_numbers=array('I', accumulate(presence_gaps)),
+        ))
+
+    def states(self, numbers):
+        """
+        Replay the history into columns aligned by track number.
+
+        Args:
+            numbers (iterable): 0-based snapshot numbers
+
+        Returns:
+            dict: Snapshot number mapped to SimpleNamespace(time, plays, favorites, present), with
+                columns as long as the track key table (NumPy arrays when installed)
+        """
+        wanted = set(numbers)
+        size = len(self.keys)
+        if numpy is not None:
+            plays = numpy.zeros(size, dtype=numpy.int64)
+            favorites = numpy.zeros(size, dtype=bool)
+            present = numpy.zeros(size, dtype=bool)
+        else:
+            plays = array('q', bytes(8 * size))
+            favorites = bytearray(size)
+            present = bytearray(size)
+        states = {}
+        for number, record in enumerate(self.records[:max(wanted, default=-1) + 1]):
+            if numpy is not None:
+                present[record.first_new:record.key_count] = True
+                present[numpy.asarray(record.presence_numbers, dtype=numpy.intp)] ^= True
+                favorites[numpy.asarray(record.favorite_numbers, dtype=numpy.intp)] ^= True
+                plays[numpy.asarray(record.play_numbers, dtype=numpy.intp)] += numpy.asarray(record.play_deltas)
+            else:
+                present[record.first_new:record.key_count] = b'\1' * (record.key_count - record.first_new)
+                for track in record.presence_numbers:
+                    present[track] ^= 1
+                for track in record.favorite_numbers:
+                    favorites[track] ^= 1
+                for track, delta in zip(record.play_numbers, record.play_deltas):
+                    plays[track] += delta
+            if number in wanted:
+                states[number] = SimpleNamespace(time=record.time, plays=_copy(plays),
+                                                  favorites=_copy(favorites), present=_copy(present))
+        return states
+
+    def append(self, columns, timestamp=None):
+        """
+        Record a snapshot of the library.
+
+        Args:
+            columns (dict): SNAPSHOT_PROPERTIES columns in library order, e.g. from library_cache.get_columns
+            timestamp (float, optional): POSIX time of the snapshot (default: now)
+
+        Returns:
+            SimpleNamespace: The new record (see _decode)
+        """
+        previous = self.states([len(self.records) - 1]).get(len(self.records) - 1)
+        numbers = {key: number for number, key in enumerate(self.keys)}
+        known = len(self.keys)
+        new_tracks, renamed = [], []
+        size = known + len(columns['persistent_ID'])
+        plays = array('q', bytes(8 * size))
+        favorites = bytearray(size)
+        present = bytearray(size)
+        for key, name, artist, play_count, favorite in zip(*(columns[prop] for prop in SNAPSHOT_PROPERTIES)):
+            number = numbers.get(key)
+            if number is None:
+                number = numbers[key] = len(numbers)
+                new_tracks.append([key, name, artist])
+            elif (name, artist) != (self.names[number], self.artists[number]):
+                renamed.append([number, name, artist])
+            plays[number] = play_count or 0
+            favorites[number] = bool(favorite)
+            present[number] = 1
+        size = len(numbers)
+        del plays[size:], favorites[size:], present[size:]
+
+        # Columns of the previous snapshot, extended with zeros for the new tracks
+        if previous is None:
+            old_plays, old_favorites, old_present = array('q', bytes(8 * size)), bytes(size), bytes(size)
+        else:
+            old_plays = array('q', previous.plays) + array('q', bytes(8 * (size - known)))
+            old_favorites = bytes(previous.favorites) + bytes(size - known)
+            old_present = bytes(previous.present) + bytes(size - known)
+        deltas = array('q', map(operator.sub, plays, old_plays))
+        play_numbers = list(compress(range(size), deltas))
+        favorite_numbers = list(compress(range(size), map(operator.xor, favorites, old_favorites)))
+        # New tracks are present implicitly; only known tracks that left or came back are listed
+        presence_numbers = list(compress(range(known), map(operator.xor, present, old_present)))
+
+        timestamp = time.time() if timestamp is None else timestamp
+        total_plays = sum(compress(plays, present))
+        new_plays = sum(compress(deltas[:known], map(operator.and_, present[:known], old_present[:known])))
+        tracks_json = json.dumps({'new': new_tracks, 'renamed': renamed}, ensure_ascii=False).encode('utf-8')
+        payload = b''.join([
+            _HEADER.pack(timestamp, len(columns['persistent_ID']), total_plays, new_plays, len(tracks_json),
+                         len(play_numbers), len(favorite_numbers), len(presence_numbers)),
+            tracks_json,
+            _pack(_gaps(play_numbers)),
+            _pack(array('i', (deltas[number] for number in play_numbers))),
+            _pack(_gaps(favorite_numbers)),
+            _pack(_gaps(presence_numbers)),
+        ])
+        body = zlib.compress(payload, 9)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            elif f.tell() != self._valid_length:
+                # Drop a partly written record left by an interrupted snapshot
+                f.truncate(self._valid_length)
+            f.write(_RECORD.pack(len(body), zlib.crc32(body)) + body)
+            f.flush()
+            os.fsync(f.fileno())
+            self._valid_length = f.tell()
+        self._decode(payload)
+        return self.records[-1]
+
+    def find(self, spec):
+        """
+        Resolve a snapshot given on the command line.
+
+        Args:
+            spec (str): A 1-based snapshot number, negative to count back from the latest,
+                or a date (YYYY-MM-DD) selecting the last snapshot taken on or before it
+
+        Returns:
+            int: 0-based snapshot number
+
+        Raises:
+            ValueError: If spec is malformed or selects no snapshot
+        """
+        try:
+            number = int(spec)
+        except ValueError:
+            day_end = time.mktime(time.strptime(spec, '%Y-%m-%d')) + 86400
+            candidates = [number for number, record in enumerate(self.records) if record.time < day_end]
+            if not candidates:
+                raise ValueError(f"No snapshot was taken on or before {spec}")
+            return candidates[-1]
+        if number == 0 or abs(number) > len(self.records):
+            raise ValueError(f"Snapshot {spec} does not exist; there are {len(self.records)}")
+        return number - 1 if number > 0 else len(self.records) + number
+
+    def diff(self, start, end):
+        """
+        Compare two snapshots.
+
+        Only tracks in the library at both snapshots are compared, so tracks added in between
+        don't count their earlier plays.
+
+        Args:
+            start (int): 0-based number of the earlier snapshot
+            end (int): 0-based number of the later snapshot
+
+        Returns:
+            SimpleNamespace: start and end times, per-track play deltas aligned with keys,
+                tracks newly favorited, and counts of tracks added and removed in between
+        """
+        states = self.states([start, end])
+        old, new = states[start], states[end]
+        if numpy is not None:
+            both = old.present & new.present
+            deltas = numpy.where(both, new.plays - old.plays, 0)
+            favorited = numpy.flatnonzero(both & new.favorites & ~old.favorites).tolist()
+            added = int(numpy.count_nonzero(new.present & ~old.present))
+            removed = int(numpy.count_nonzero(old.present & ~new.present))
+        else:
+            both = bytes(map(operator.and_, old.present, new.present))
+            deltas = array('q', map(operator.mul, map(operator.sub, new.plays, old.plays), both))
+            favorited = list(compress(range(len(both)), map(operator.gt, new.favorites, old.favorites)))
+            favorited = [track for track in favorited if both[track]]
+            added = sum(map(operator.gt, new.present, old.present))
+            removed = sum(map(operator.gt, old.present, new.present))
+        return SimpleNamespace(start=old.time, end=new.time, deltas=deltas, favorited=favorited,
+                               added=added, removed=removed)
+
+    def top_tracks(self, deltas, count=DEFAULT_TOP):
+        """Return (track number, delta) of the tracks whose play counts rose most, largest first."""
+        if numpy is not None:
+            candidates = numpy.flatnonzero(deltas > 0)
+            order = candidates[numpy.argsort(-deltas[candidates], kind='stable')][:count]
+            return [(int(track), int(deltas[track])) for track in order]
+        changed = compress(range(len(deltas)), map((0).__lt__, deltas))
+        return [(track, deltas[track]) for track in heapq.nlargest(count, changed, key=deltas.__getitem__)]
+
+    def artist_deltas(self, deltas):
+        """Return the play deltas summed per artist, as a dict from artist to delta."""
+        if numpy is not None:
+            codes = {}
+            artist_codes = numpy.fromiter((codes.setdefault(artist or '', len(codes)) for artist in self.artists),
+                                          dtype=numpy.int64, count=len(self.artists))
+            sums = numpy.bincount(artist_codes, weights=deltas, minlength=len(codes))
+            return {artist: int(sums[code]) for artist, code in codes.items() if sums[code]}
+        totals = {}
+        for track in compress(range(len(deltas)), deltas):
+            artist = self.artists[track] or ''
+            totals[artist] = totals.get(artist, 0) + deltas[track]
+        return totals
+
+def record_snapshot(max_age=None, path=None):
+    """
+    Append a snapshot of every track's play count and favorite status to the history file.
+
+    Args:
+        max_age (float, optional): Read from the library snapshot if it is at most this many
+            seconds old (float('inf') for any age); None reads the live library
+        path (str, optional): History file (default: history_path())
+
+    Returns:
+        SimpleNamespace: The new record, or None if it could not be written
+    """
+    try:
+        history = History(path)
+        columns = library_cache.get_columns(SNAPSHOT_PROPERTIES, max_age)
+        record = history.append(columns)
+    except (OSError, ValueError) as e:
+        print(f"Error recording snapshot: {e}")
+        return None
+    print(f"Recorded snapshot {len(history)}: {record.tracks} tracks, {record.total_plays} plays")
+    if len(history) > 1:
+        print(f"{record.new_plays} new plays, {len(record.play_numbers)} play counts changed "
+              f"since {time.strftime('%Y-%m-%d %H:%M', time.localtime(history.records[-2].time))}")
+    return record
+
+def print_history(start=None, end=None, top=DEFAULT_TOP, path=None):
+    """
+    List the recorded snapshots, or report plays between two of them.
+
+    Args:
+        start (str, optional): Earlier snapshot, see History.find; None lists every snapshot
+        end (str, optional): Later snapshot (default: the latest)
+        top (int, optional): Number of tracks and artists to list (default: 10)
+        path (str, optional): History file (default: history_path())
+    """
+    try:
+        history = History(path)
+        if not history.records:
+            print("No snapshots recorded yet; run `amutils snapshot` first")
+            return
+        if start is None:
+            print(f"{'#':>5}  {'Date':<16}{'Tracks':>9}{'Plays':>12}{'New plays':>11}")
+            for number, record in enumerate(history.records, 1):
+                when = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.time))
+                print(f"{number:>5}  {when:<16}{record.tracks:>9}{record.total_plays:>12}{record.new_plays:>11}")
+            return
+        first = history.find(start)
+        last = history.find(end) if end is not None else len(history) - 1
+    except (OSError, ValueError) as e:
+        print(f"Error reading history: {e}")
+        return
+    if first > last:
+        first, last = last, first
+
+    result = history.diff(first, last)
+    plays = int(sum(result.deltas))
+    days = (result.end - result.start) / 86400
+    period = ' to '.join(time.strftime('%Y-%m-%d %H:%M', time.localtime(t)) for t in (result.start, result.end))
+    print(f"Snapshots {first + 1} to {last + 1} ({period}, {days:.1f} days)")
+    print(f"{plays} plays" + (f", {plays / days:.1f} per day" if days >= 1 else ""))
+    print(f"{result.added} tracks added, {result.removed} removed, {len(result.favorited)} newly favorited")
+
+    risers = history.top_tracks(result.deltas, top)
+    if risers:
+        print("\nTop tracks:")
+        for track, delta in risers:
+            print(f"  +{delta:<6} '{history.names[track]}' by {history.artists[track] or 'Unknown'}")
+    artists = sorted(history.artist_deltas(result.deltas).items(), key=lambda item: (-item[1], item[0]))[:top]
+    if artists and artists[0][1] > 0:
+        print("\nTop artists:")
+        for artist, delta in artists:
+            if delta > 0:
+                print(f"  +{delta:<6} {artist or 'Unknown'}")
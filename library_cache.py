@@ -0,0 +1,385 @@
+"""
+Persistent on-disk snapshot of the Music library.
+
+The snapshot is a SQLite database holding every Track field plus the persistent ID
+and modification date of each track. Refreshing it only fetches the cheap
+change-detection columns for the whole library and then re-fetches the full rows
+that actually changed, so keeping it current costs a handful of Apple Events.
+"""
+
+import os
+import sqlite3
+import time
+from types import SimpleNamespace
+import bridge
+import stats
+import track_table
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.amutils', 'library.sqlite3')
+
+# Columns fetched for the whole library on every refresh to find changed rows
+CHANGE_PROPERTIES = ['persistent_ID', 'modification_date', 'played_count', 'favorited']
+
+# Properties fetched for rows that are new or changed
+ROW_PROPERTIES = [prop for _, prop in bridge.TRACK_PROPERTIES] + ['persistent_ID', 'modification_date']
+
+# Music property mapped to the snapshot column holding it
+CACHE_COLUMNS = dict({prop: field for field, prop in bridge.TRACK_PROPERTIES}, persistent_ID='persistent_id')
+
+# Above this many separate runs of changed rows, a full column fetch is cheaper
+MAX_REFRESH_RUNS = 32
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tracks (
+    persistent_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    id TEXT,
+    name TEXT,
+    album TEXT,
+    artist TEXT,
+    album_artist TEXT,
+    play_count INTEGER,
+    is_favorite INTEGER,
+    duration REAL,
+    file_path TEXT,
+    modification_date REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+def _timestamp(value):
+    """Convert a Music date to a POSIX timestamp, or None if it is missing."""
+    try:
+        return value.timestamp()
+    except Exception:
+        return None
+
+def _contiguous_runs(positions):
+    """Group sorted 0-based positions into (start, stop) runs, stop inclusive."""
+    runs = []
+    for position in positions:
+        if runs and runs[-1][1] == position - 1:
+            runs[-1][1] = position
+        else:
+            runs.append([position, position])
+    return runs
+
+class LibraryCache:
+    """
+    A SQLite snapshot of the library.
+
+    Args:
+        path (str, optional): Database path (default: $AMUTILS_CACHE or ~/.amutils/library.sqlite3)
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('AMUTILS_CACHE') or DEFAULT_CACHE_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def refreshed_at(self):
+        """Return the POSIX time of the last refresh, or None if the snapshot was never filled."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def age(self):
+        """Return the snapshot age in seconds, or None if the snapshot was never filled."""
+        refreshed_at = self.refreshed_at()
+        return None if refreshed_at is None else time.time() - refreshed_at
+
+    def _store_rows(self, columns, positions):
+        """Insert or replace full rows fetched for the given library positions; rows without an id are left out."""
+        rows = []
+        missing = 0
+        for offset, position in enumerate(positions):
+            values = {prop: columns[prop][offset] for prop in ROW_PROPERTIES}
+            if values['id'] is None:
+                missing += 1
+                continue
+            track = bridge.make_track(values)
+            rows.append((
+                values['persistent_ID'], position, track.id, track.name, track.album, track.artist,
+                track.album_artist, track.play_count, int(track.is_favorite),
+                # Keep the unrounded duration so cached playtime matches the live one
+                values['duration'] or 0, track.file_path, _timestamp(values['modification_date']),
+            ))
+        if missing:
+            print(f"Error processing track: no id for {missing} tracks, leaving them out of the snapshot")
+        self.db.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def refresh(self, full=False):
+        """
+        Bring the snapshot up to date with the library.
+
+        Args:
+            full (bool, optional): Re-fetch every row instead of only the changed ones
+
+        Returns:
+            SimpleNamespace: total, changed and removed row counts
+        """
+        tracks_ref = bridge.app.library_playlists[1].tracks
+
+        if full or self.refreshed_at() is None:
+            columns = bridge.fetch_columns(tracks_ref, ROW_PROPERTIES)
+            count = len(columns['persistent_ID'])
+            with self.db:
+                self.db.execute('DELETE FROM tracks')
+                self._store_rows(columns, range(count))
+                self._mark_refreshed()
+            return SimpleNamespace(total=count, changed=count, removed=0)
+
+        current = bridge.fetch_columns(tracks_ref, CHANGE_PROPERTIES)
+        known = {
+            persistent_id: (modification_date, play_count, is_favorite)
+            for persistent_id, modification_date, play_count, is_favorite
+            in self.db.execute('SELECT persistent_id, modification_date, play_count, is_favorite FROM tracks')
+        }
+
+        changed = []
+        for position, (persistent_id, modification_date, play_count, is_favorite) in enumerate(
+                zip(*(current[prop] for prop in CHANGE_PROPERTIES))):
+            if known.get(persistent_id) != (_timestamp(modification_date), play_count or 0, int(bool(is_favorite))):
+                changed.append(position)
+
+        seen = set(current['persistent_ID'])
+        removed = [persistent_id for persistent_id in known if persistent_id not in seen]
+        runs = _contiguous_runs(changed)
+
+        if len(runs) > MAX_REFRESH_RUNS:
+            return self.refresh(full=True)
+
+        with self.db:
+            self.db.executemany('DELETE FROM tracks WHERE persistent_id = ?', [(pid,) for pid in removed])
+            self.db.executemany('UPDATE tracks SET position = ? WHERE persistent_id = ?',
+                                [(position, pid) for position, pid in enumerate(current['persistent_ID'])])
+            for start, stop in runs:
+                columns = bridge.fetch_columns(tracks_ref, ROW_PROPERTIES, start + 1, stop + 1)
+                self._store_rows(columns, range(start, stop + 1))
+            self._mark_refreshed()
+
+        return SimpleNamespace(total=len(current['persistent_ID']), changed=len(changed), removed=len(removed))
+
+    def _mark_refreshed(self):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed_at', ?)", (str(time.time()),))
+
+    def ensure_fresh(self, max_age=None):
+        """
+        Refresh the snapshot if it is missing or older than max_age seconds.
+
+        Args:
+            max_age (float, optional): Maximum acceptable age; None accepts any existing snapshot
+        """
+        age = self.age()
+        if age is None or (max_age is not None and age > max_age):
+            self.refresh()
+
+    def tracks(self):
+        """Return every cached track as a TrackTable in library order."""
+        tracks = track_table.TrackTable()
+        for chunk in self.track_chunks():
+            tracks.extend(chunk)
+        return tracks
+
+    def track_chunks(self, chunk_size=bridge.TRACK_CHUNK_SIZE):
+        """Yield cached tracks as lists of Track records in library order, chunk_size at a time."""
+        cursor = self.db.execute('SELECT id, name, album, artist, album_artist, play_count, is_favorite, '
+                                 'duration, file_path FROM tracks ORDER BY position')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [
+                bridge.Track(id, name, album, artist, album_artist, play_count, bool(is_favorite),
+                             round(duration or 0, 1), file_path)
+                for id, name, album, artist, album_artist, play_count, is_favorite, duration, file_path in rows
+            ]
+
+    def columns(self, properties):
+        """
+        Read whole columns from the snapshot in library order.
+
+        Args:
+            properties (list): Music property names, e.g. ['duration', 'played_count']
+
+        Returns:
+            dict: Property name mapped to a list of values, like bridge.fetch_columns
+        """
+        names = [CACHE_COLUMNS[prop] for prop in properties]
+        rows = self.db.execute(f"SELECT {', '.join(names)} FROM tracks ORDER BY position").fetchall()
+        return {prop: [row[offset] for row in rows] for offset, prop in enumerate(properties)}
+
+    def total_playtime(self):
+        """Return (total played seconds, track count) computed from the snapshot."""
+        total, count = self.db.execute(
+            'SELECT COALESCE(SUM(duration * play_count), 0), COUNT(*) FROM tracks').fetchone()
+        return total, count
+
+def _server_max_age(max_age):
+    """Translate a max_age option for library_server: live (None) becomes 0, float('inf') any age (None)."""
+    if max_age is None:
+        return 0
+    return None if max_age == float('inf') else max_age
+
+def _open(max_age):
+    cache = LibraryCache()
+    cache.ensure_fresh(None if max_age == float('inf') else max_age)
+    return cache
+
+def get_all_tracks(max_age=None):
+    """
+    Get all tracks, from the snapshot when max_age is given or live otherwise.
+
+    A running ``amutils serve`` answers instead, after an incremental refresh when
+    max_age asks for fresher data than it holds.
+
+    Args:
+        max_age (float, optional): Maximum snapshot age in seconds; float('inf') accepts any
+            snapshot and None bypasses the snapshot entirely
+
+    Returns:
+        TrackTable: The tracks, as returned by bridge.get_all_tracks()
+    """
+    import library_server
+
+    chunks = library_server.stream('tracks', max_age=_server_max_age(max_age), chunk_size=bridge.TRACK_CHUNK_SIZE)
+    if chunks is not library_server.NOT_RUNNING:
+        try:
+            tracks = track_table.TrackTable()
+            for chunk in chunks:
+                tracks.extend(chunk)
+            return tracks
+        except (OSError, ValueError, library_server.ServerError) as e:
+            print(f"Error reading tracks from amutils server, falling back to direct mode: {e}")
+    if max_age is None:
+        return bridge.get_all_tracks()
+    try:
+        cache = _open(max_age)
+        try:
+            return cache.tracks()
+        finally:
+            cache.close()
+    except Exception as e:
+        print(f"Error reading library snapshot, falling back to a live fetch: {e}")
+        return bridge.get_all_tracks()
+
+def iter_track_chunks(max_age=None, chunk_size=bridge.TRACK_CHUNK_SIZE):
+    """
+    Get all tracks in chunks, from the snapshot when max_age is given or live otherwise.
+
+    Args:
+        max_age (float, optional): Maximum snapshot age in seconds; float('inf') accepts any
+            snapshot and None bypasses the snapshot entirely
+        chunk_size (int, optional): Tracks per chunk
+
+    Yields:
+        list: Track objects for consecutive ranges of the library
+    """
+    import library_server
+
+    chunks = library_server.stream('tracks', max_age=_server_max_age(max_age), chunk_size=chunk_size)
+    if chunks is not library_server.NOT_RUNNING:
+        for chunk in chunks:
+            yield [bridge.Track(*row) for row in chunk]
+        return
+    if max_age is None:
+        yield from bridge.iter_track_chunks(chunk_size)
+        return
+    cache = _open(max_age)
+    try:
+        yield from cache.track_chunks(chunk_size)
+    finally:
+        cache.close()
+
+def get_total_playtime(max_age=None):
+    """
+    Get (total played seconds, track count), from the snapshot when max_age is given or live otherwise.
+
+    Args:
+        max_age (float, optional): Maximum snapshot age in seconds; float('inf') accepts any
+            snapshot and None bypasses the snapshot entirely
+    """
+    import library_server
+
+    answer = library_server.request('playtime', max_age=_server_max_age(max_age))
+    if answer is not library_server.NOT_RUNNING:
+        return tuple(answer)
+    if max_age is None:
+        return bridge.get_total_playtime()
+    try:
+        cache = _open(max_age)
+        try:
+            return cache.total_playtime()
+        finally:
+            cache.close()
+    except Exception as e:
+        print(f"Error reading library snapshot, falling back to a live fetch: {e}")
+        return bridge.get_total_playtime()
+
+def get_library_stats(names=stats.DEFAULT_STATS, max_age=None):
+    """
+    Compute library aggregates, from the snapshot when max_age is given or live otherwise.
+
+    Args:
+        names (list, optional): Aggregates registered in stats.py (default: stats.DEFAULT_STATS)
+        max_age (float, optional): Maximum snapshot age in seconds; float('inf') accepts any
+            snapshot and None bypasses the snapshot entirely
+
+    Returns:
+        dict: Aggregate name mapped to its value
+    """
+    import library_server
+
+    answer = library_server.request('stats', names=list(names), max_age=_server_max_age(max_age))
+    if answer is not library_server.NOT_RUNNING:
+        return answer
+    if max_age is None:
+        return bridge.get_library_stats(names)
+    try:
+        cache = _open(max_age)
+        try:
+            return stats.compute(cache.columns(stats.required_columns(names)), names)
+        finally:
+            cache.close()
+    except Exception as e:
+        print(f"Error reading library snapshot, falling back to a live fetch: {e}")
+        return bridge.get_library_stats(names)
+
+def get_columns(properties, max_age=None):
+    """
+    Read whole columns, from the snapshot when max_age is given or live otherwise.
+
+    Args:
+        properties (list): Music property names in CACHE_COLUMNS, e.g. ['persistent_ID', 'played_count']
+        max_age (float, optional): Maximum snapshot age in seconds; float('inf') accepts any
+            snapshot and None bypasses the snapshot entirely
+
+    Returns:
+        dict: Property name mapped to a list of values in library order, with locations as POSIX paths
+    """
+    import library_server
+
+    answer = library_server.request('columns', properties=list(properties), max_age=_server_max_age(max_age))
+    if answer is not library_server.NOT_RUNNING:
+        return answer
+    if max_age is not None:
+        try:
+            cache = _open(max_age)
+            try:
+                return cache.columns(properties)
+            finally:
+                cache.close()
+        except Exception as e:
+            print(f"Error reading library snapshot, falling back to a live fetch: {e}")
+    columns = bridge.fetch_columns(bridge.app.library_playlists[1].tracks, properties)
+    if 'location' in columns:
+        columns['location'] = [bridge._location_path(location) for location in columns['location']]
+    return columns
@@ -0,0 +1,167 @@
+"""
+Duplicate track entries grouped by metadata for ``amutils libdupes``.
+
+Every track gets a signature of its normalized name, artist and album (see
+fuzzy_index.normalize) and its duration bucket, the duration divided by the
+tolerance and rounded down. Tracks are grouped by signature in one pass over
+the library's columns; a bucket is then joined with the next one of the same
+name, artist and album when their closest durations are within the tolerance,
+so two copies whose lengths straddle a bucket boundary still end up together.
+Groups are ranked by their combined play count, and the merge plan keeps the
+most-played copy of each group.
+"""
+
+import csv
+import math
+import library_cache
+from fuzzy_index import normalize
+
+# Default largest difference in seconds between the durations of two copies
+DEFAULT_TOLERANCE = 1.0
+
+# Columns read for the signatures and the report
+PROPERTIES = ['id', 'persistent_ID', 'name', 'artist', 'album', 'duration', 'played_count', 'favorited',
+              'location']
+
+def _find(parents, cell):
+    while parents[cell] != cell:
+        parents[cell] = parents[parents[cell]]
+        cell = parents[cell]
+    return cell
+
+def find_groups(columns, tolerance=DEFAULT_TOLERANCE):
+    """
+    Group tracks whose name, artist and album match and whose durations are within tolerance.
+
+    Args:
+        columns (dict): 'name', 'artist', 'album', 'duration', 'played_count' and 'favorited' columns in
+            library order, as returned by library_cache.get_columns
+        tolerance (float, optional): Duration bucket width in seconds (default: DEFAULT_TOLERANCE)
+
+    Returns:
+        list: Groups of at least two library positions, most-played copy first, with the
+            groups sorted by combined play count
+    """
+    # Signature mapped to the positions in it; tracks without a duration share one bucket
+    cells = {}
+    for position, (name, artist, album, duration) in enumerate(
+            zip(columns['name'], columns['artist'], columns['album'], columns['duration'])):
+        name = normalize(name)
+        if not name:
+            continue
+        bucket = math.floor(duration / tolerance) if duration else None
+        cells.setdefault((name, normalize(artist), normalize(album), bucket), []).append(position)
+
+    durations = columns['duration']
+    parents = {cell: cell for cell in cells}
+    for cell, positions in cells.items():
+        name, artist, album, bucket = cell
+        if bucket is None:
+            continue
+        neighbour = (name, artist, album, bucket + 1)
+        following = cells.get(neighbour)
+        if following is None:
+            continue
+        gap = min(durations[position] for position in following) - max(durations[position] for position in positions)
+        if gap <= tolerance:
+            parents[_find(parents, neighbour)] = _find(parents, cell)
+
+    merged = {}
+    for cell, positions in cells.items():
+        merged.setdefault(_find(parents, cell), []).extend(positions)
+
+    plays = columns['played_count']
+    favorites = columns['favorited']
+    groups = []
+    for positions in merged.values():
+        if len(positions) < 2:
+            continue
+        # Most played first, then favorites, then library order
+        positions.sort(key=lambda position: (-(plays[position] or 0), not favorites[position], position))
+        groups.append(positions)
+    groups.sort(key=lambda group: (-sum(plays[position] or 0 for position in group), group[0]))
+    return groups
+
+def merge_plan(columns, groups):
+    """
+    Plan merging each group into its most-played copy.
+
+    The kept copy gets the combined play count of the group and is favorited if any copy is.
+
+    Args:
+        columns (dict): Library columns, see PROPERTIES
+        groups (list): Groups from find_groups
+
+    Returns:
+        list: One dict per group with keep_id, keep_persistent_id, name, artist, album,
+            play_count, is_favorite and remove_ids (space-separated ids of the other copies)
+    """
+    plan = []
+    for group in groups:
+        keep = group[0]
+        plan.append({
+            'keep_id': columns['id'][keep],
+            'keep_persistent_id': columns['persistent_ID'][keep],
+            'name': columns['name'][keep],
+            'artist': columns['artist'][keep],
+            'album': columns['album'][keep],
+            'play_count': sum(columns['played_count'][position] or 0 for position in group),
+            'is_favorite': any(columns['favorited'][position] for position in group),
+            'remove_ids': ' '.join(str(columns['id'][position]) for position in group[1:]),
+        })
+    return plan
+
+def write_merge_plan(path, plan):
+    """Write a merge plan to a CSV file with one row per group."""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=['keep_id', 'keep_persistent_id', 'name', 'artist', 'album',
+                                               'play_count', 'is_favorite', 'remove_ids'])
+        writer.writeheader()
+        writer.writerows(plan)
+
+def print_library_dupes(max_age=None, tolerance=DEFAULT_TOLERANCE, top=None, plan_path=None):
+    """
+    Print groups of duplicate library entries for ``amutils libdupes``.
+
+    Args:
+        max_age (float, optional): Read the library from a snapshot at most this old
+            (see library_cache.get_columns)
+        tolerance (float, optional): Largest duration difference in seconds (default: DEFAULT_TOLERANCE)
+        top (int, optional): Print only this many groups; all are counted and planned
+        plan_path (str, optional): Write a merge plan CSV to this path
+
+    Returns:
+        bool: True if the library could be read and the plan, if requested, written
+    """
+    try:
+        columns = library_cache.get_columns(PROPERTIES, max_age)
+    except Exception as e:
+        print(f"Error reading library: {e}")
+        return False
+
+    groups = find_groups(columns, tolerance)
+    if not groups:
+        print("No duplicate tracks found in the library")
+        return True
+
+    plays = columns['played_count']
+    for group in groups[:top]:
+        first = group[0]
+        print(f"\n{len(group)} copies, {sum(plays[position] or 0 for position in group)} plays: "
+              f"'{columns['name'][first]}' by {columns['artist'][first]} on {columns['album'][first]}")
+        for position in group:
+            marker = ' (keep)' if position == first else ''
+            print(f"  [{columns['id'][position]}] {plays[position] or 0} plays, "
+                  f"{columns['duration'][position] or 0:.1f}s - {columns['location'][position] or 'no file'}{marker}")
+    if top is not None and len(groups) > top:
+        print(f"\n... and {len(groups) - top} more groups")
+    print(f"\nFound {len(groups)} groups with {sum(len(group) - 1 for group in groups)} duplicate tracks")
+
+    if plan_path:
+        try:
+            write_merge_plan(plan_path, merge_plan(columns, groups))
+        except OSError as e:
+            print(f"Error writing merge plan: {e}")
+            return False
+        print(f"Merge plan written to {plan_path}")
+    return True
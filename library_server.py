@@ -0,0 +1,384 @@
+"""
+Long-running library server for ``amutils serve``.
+
+The server keeps the library in memory: the track columns of the SQLite
+snapshot, the path, duration and fuzzy name indexes built over them, and the
+playlist membership of every track. A background thread refreshes the snapshot
+incrementally and rebuilds the indexes only when tracks changed. Other amutils
+processes send newline-delimited JSON requests over a Unix domain socket, so
+stats and lookups take milliseconds instead of fetching the library again;
+when no server is running, request() returns NOT_RUNNING and callers fall back
+to talking to Music directly.
+
+Protocol: each request is one JSON object ``{"op": ..., <arguments>}`` on its
+own line. The reply is ``{"result": ...}`` or ``{"error": "..."}``; streaming
+operations first send any number of ``{"chunk": [...]}`` lines. A request may
+carry ``max_age``: the server refreshes first if its data is older than that
+many seconds, and answers from what it has when it is omitted or null.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from types import SimpleNamespace
+import bridge
+import library_cache
+import stats
+from duration_index import DurationIndex
+from fuzzy_index import FuzzyIndex
+from path_index import PathIndex
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.amutils', 'server.sock')
+
+# Seconds between background refreshes
+REFRESH_INTERVAL = 30.0
+
+# Seconds to wait for the server to accept a connection, and for an answer
+CONNECT_TIMEOUT = 1.0
+REQUEST_TIMEOUT = 300.0
+
+# Operations answered by LibraryState methods of the same name
+OPERATIONS = {'ping', 'columns', 'stats', 'playtime', 'tracks', 'match_path', 'find_duration', 'find_durations',
+              'find_fuzzy', 'playlist_index', 'refresh'}
+
+# Returned by request() and stream() when no server answered
+NOT_RUNNING = object()
+
+# Cleared by `amutils --direct` and inside the server process itself
+enabled = True
+
+_unreachable = False
+
+class ServerError(Exception):
+    """The server answered a request with an error."""
+
+def socket_path():
+    """Return the server socket path: $AMUTILS_SOCKET or ~/.amutils/server.sock."""
+    return os.environ.get('AMUTILS_SOCKET') or DEFAULT_SOCKET_PATH
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+def _exchange(path, op, args):
+    """Send one request and yield the reply messages, ending with the final one."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(REQUEST_TIMEOUT)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(dict(args, op=op)).encode('utf-8') + b'\n')
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if 'error' in message:
+                    raise ServerError(message['error'])
+                yield message
+                if 'chunk' not in message:
+                    return
+    raise ServerError("connection closed before the reply was complete")
+
+def _usable():
+    # A library swapped in with bridge.use_backend (e.g. a fake one) is not the one the server holds
+    return enabled and not _unreachable and (bridge.backend is None or bridge.backend_is_default)
+
+def _give_up(e):
+    """Stop asking the server for the rest of this process after it failed."""
+    global _unreachable
+    _unreachable = True
+    if not isinstance(e, (FileNotFoundError, ConnectionRefusedError)):
+        print(f"Error talking to amutils server, continuing without it: {e}")
+
+def request(op, **args):
+    """
+    Send a request to the running server.
+
+    Args:
+        op (str): Operation name, e.g. 'stats'
+        **args: Operation arguments; max_age (float) asks for data at most that many seconds old
+
+    Returns:
+        The operation's result, or NOT_RUNNING if no server answered
+    """
+    if not _usable():
+        return NOT_RUNNING
+    try:
+        for message in _exchange(socket_path(), op, args):
+            pass
+        return message['result']
+    except (OSError, ValueError, ServerError) as e:
+        _give_up(e)
+        return NOT_RUNNING
+
+def stream(op, **args):
+    """
+    Send a streaming request to the running server.
+
+    Returns:
+        An iterator over the chunks of the reply, or NOT_RUNNING if no server answered.
+        Errors after the first chunk raise ServerError or OSError from the iterator.
+    """
+    if not _usable():
+        return NOT_RUNNING
+    try:
+        messages = _exchange(socket_path(), op, args)
+        first = next(messages)
+    except (OSError, ValueError, ServerError, StopIteration) as e:
+        _give_up(e)
+        return NOT_RUNNING
+
+    def chunks():
+        message = first
+        while 'chunk' in message:
+            yield message['chunk']
+            message = next(messages)
+    return chunks()
+
+def status(path=None):
+    """Return the server's ping answer, or None if no server is listening on path."""
+    try:
+        for message in _exchange(path or socket_path(), 'ping', {}):
+            pass
+        return message['result']
+    except (OSError, ValueError, ServerError):
+        return None
+
+def stop(path=None):
+    """Ask the server listening on path to shut down; returns False if none was running."""
+    try:
+        for _ in _exchange(path or socket_path(), 'stop', {}):
+            pass
+        return True
+    except (OSError, ValueError, ServerError):
+        return False
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+class LibraryState:
+    """
+    The library held in memory by the server.
+
+    Readers use the current ``snapshot`` namespace, which refresh() replaces as a whole,
+    so answers never mix data from two refreshes. Refreshes are serialized by a lock.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def refresh(self, playlists=False, requested_at=None):
+        """
+        Refresh the snapshot and rebuild whatever changed.
+
+        Args:
+            playlists (bool, optional): Rebuild playlist membership even if no track changed
+            requested_at (float, optional): Skip the refresh if another one finished after this time
+
+        Returns:
+            SimpleNamespace: The library_cache refresh result, or None if it was skipped
+        """
+        with self.lock:
+            current = self.snapshot
+            if requested_at is not None and current is not None and current.refreshed_at >= requested_at:
+                return None
+            refreshed_at = time.time()
+            cache = library_cache.LibraryCache()
+            try:
+                result = cache.refresh()
+                if current is None or result.changed or result.removed:
+                    snapshot = self._load(cache)
+                else:
+                    snapshot = SimpleNamespace(**vars(current))
+            finally:
+                cache.close()
+            if current is None or result.changed or result.removed or playlists:
+                snapshot.playlist_ids, snapshot.members = self._playlist_membership()
+            snapshot.refreshed_at = refreshed_at
+            self.snapshot = snapshot
+            return result
+
+    def ensure_fresh(self, max_age):
+        """Refresh first if the snapshot is older than max_age seconds; None accepts any age."""
+        if max_age is not None and time.time() - self.snapshot.refreshed_at > max_age:
+            self.refresh(requested_at=time.time())
+
+    def _load(self, cache):
+        columns = cache.columns(list(library_cache.CACHE_COLUMNS))
+        columns['id'] = [int(track_id) for track_id in columns['id']]
+        return SimpleNamespace(
+            columns=columns,
+            path_index=PathIndex(columns['id'], columns['name'], columns['location']),
+            duration_index=DurationIndex(columns),
+            fuzzy_index=FuzzyIndex(columns['name'], columns['artist'], columns['album']),
+        )
+
+    def _playlist_membership(self):
+        """Return the playlist persistent IDs and each track's playlists as 1-based playlist numbers."""
+        playlist_ids = bridge.app.playlists.persistent_ID.get()
+        members = {}
+        for number, playlist in enumerate(bridge.get_playlists(refresh=True), 1):
+            for persistent_id in dict.fromkeys(playlist.tracks.persistent_ID.get()):
+                members.setdefault(persistent_id, []).append(number)
+        return playlist_ids, members
+
+    # Operations; each takes the request arguments and returns a JSON-serializable result
+
+    def ping(self):
+        snapshot = self.snapshot
+        return {'pid': os.getpid(), 'backend': bridge.backend.name, 'tracks': len(snapshot.columns['id']),
+                'playlists': len(snapshot.playlist_ids), 'refreshed_at': snapshot.refreshed_at}
+
+    def columns(self, properties):
+        columns = self.snapshot.columns
+        return {prop: columns[prop] for prop in properties}
+
+    def stats(self, names):
+        columns = self.snapshot.columns
+        return stats.compute({prop: columns[prop] for prop in stats.required_columns(names)}, names)
+
+    def playtime(self):
+        columns = self.snapshot.columns
+        total = sum((duration or 0) * (play_count or 0)
+                    for duration, play_count in zip(columns['duration'], columns['played_count']))
+        return [total, len(columns['id'])]
+
+    def tracks(self, chunk_size):
+        """Yield rows of Track fields, like library_cache.LibraryCache.track_chunks."""
+        columns = self.snapshot.columns
+        fields = [columns[prop] for _, prop in bridge.TRACK_PROPERTIES]
+        for start in range(0, len(columns['id']), chunk_size):
+            rows = [list(row) for row in zip(*(column[start:start + chunk_size] for column in fields))]
+            for row in rows:
+                row[0] = str(row[0])
+                row[6] = bool(row[6])
+                row[7] = round(row[7] or 0, 1)
+            yield rows
+
+    def match_path(self, path):
+        return bridge.match_track_path(self.snapshot.path_index, path)
+
+    def find_duration(self, duration, tolerance, album=None, limit=3):
+        return bridge.duration_matches(self.snapshot.duration_index, duration, tolerance, album, limit)
+
+    def find_durations(self, queries, tolerance):
+        index = self.snapshot.duration_index
+        queries = [tuple(query) if isinstance(query, list) else query for query in queries]
+        return [index.ids[position] if position is not None else None
+                for position in index.find_many(queries, tolerance)]
+
+    def find_fuzzy(self, title, artist=None, album=None, limit=5, artist_contains=None):
+        ids = self.snapshot.columns['id']
+        return [[ids[position], score] for position, score
+                in self.snapshot.fuzzy_index.search(title, artist, album, limit, artist_contains=artist_contains)]
+
+    def playlist_index(self):
+        snapshot = self.snapshot
+        return {'playlists': snapshot.playlist_ids, 'members': snapshot.members}
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, state):
+        super().__init__(path, _Handler)
+        self.state = state
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers newline-delimited JSON requests until the client disconnects."""
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    def handle(self):
+        state = self.server.state
+        for line in self.rfile:
+            try:
+                args = json.loads(line)
+                op = args.pop('op', None)
+                if op == 'stop':
+                    self.send({'result': None})
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                if op not in OPERATIONS:
+                    raise ValueError(f"unknown operation {op!r}")
+                max_age = args.pop('max_age', None)
+                if op == 'refresh':
+                    result = vars(state.refresh(playlists=True))
+                else:
+                    state.ensure_fresh(max_age)
+                    result = getattr(state, op)(**args)
+                if op == 'tracks':
+                    for chunk in result:
+                        self.send({'chunk': chunk})
+                    result = None
+                self.send({'result': result})
+            except Exception as e:
+                self.send({'error': f"{type(e).__name__}: {e}"})
+            self.wfile.flush()
+
+def _refresh_periodically(state, interval, stopped):
+    while not stopped.wait(interval):
+        try:
+            state.refresh(playlists=True)
+        except Exception as e:
+            print(f"Error refreshing library: {e}")
+
+def serve(path=None, interval=REFRESH_INTERVAL):
+    """
+    Load the library and answer requests until stopped with Ctrl-C or ``amutils serve stop``.
+
+    Args:
+        path (str, optional): Socket path (default: socket_path())
+        interval (float, optional): Seconds between background refreshes (default: 30)
+
+    Returns:
+        bool: False if the server could not start
+    """
+    global enabled
+    path = path or socket_path()
+    if status(path) is not None:
+        print(f"Error: an amutils server is already listening on {path}")
+        return False
+    # This process answers requests itself rather than forwarding them
+    enabled = False
+
+    state = LibraryState()
+    print("Loading library...")
+    try:
+        state.refresh(playlists=True)
+    except Exception as e:
+        print(f"Error loading library: {e}")
+        return False
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.exists(path):
+        # Left behind by a server that did not shut down cleanly
+        os.remove(path)
+    # Only the owner may connect
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, state)
+    finally:
+        os.umask(umask)
+
+    stopped = threading.Event()
+    refresher = threading.Thread(target=_refresh_periodically, args=(state, interval, stopped), daemon=True)
+    refresher.start()
+    print(f"Serving {len(state.snapshot.columns['id'])} tracks on {path}, refreshing every {interval:g}s")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print("Server stopped")
+    return True
@@ -1,12 +1,14 @@
-import sys, os, bridge, file_reader, math
-import exporter
+import sys, os, math, time
+
+# Library modules are imported by the commands that use them, so --help and argument
+# errors return without loading them or connecting to Music
 
 def print_help():
     print('''amutils - Apple Music Utilities
 
 Usage:
 
-    amutils <command> [file]
+    amutils [--profile [--trace FILE]] [--direct] <command> [file] [--cached | --max-age SECONDS]
 
 Commands:
 
@@ -14,70 +16,313 @@ Commands:
     playedtime     get library total played time
     replace        use the given music file(s) to replace the song with the same metadata
     export         export track list to CSV file with id, name, album, artist, play count, and favorite status
-    import         import track information from CSV file, matching by track ID
+    import         import track information from CSV or columnar file, matching by track ID
+    dupes          list library files with identical content (hashes are cached, so re-runs are fast)
+    libdupes       list library entries of the same song (same name, artist and album, durations within
+                   --tolerance SECONDS, default 1), most played groups first
+                   (usage: libdupes [--tolerance SECONDS] [--top N] [--merge-plan FILE])
+    reconcile      list tracks whose file is missing and media files under the given folders that aren't in the library
+                   (usage: reconcile FOLDER [FOLDER ...])
     addtoplaylist  add all tracks with .movpkg in their file path to a specified playlist (usage: addtoplaylist [playlist_name])
+    snapshot       record every track's play count and favorite status in the play history
+    history        list recorded snapshots, or show plays, top tracks and top artists between two of them
+                   (usage: history [FROM [TO]], each a snapshot number, negative from the latest, or YYYY-MM-DD)
+    serve          keep the library and its indexes in memory and answer other amutils commands from them
+                   (usage: serve [--interval SECONDS], serve status, serve stop)
+
+Options:
+
+    --cached           answer stat, playedtime, export, dupes, libdupes, reconcile and snapshot from the local library snapshot
+    --max-age SECONDS  like --cached, but refresh the snapshot first if it is older than SECONDS
+    --format FORMAT    export format: csv (default) or columnar, a compact binary file that is memory-mapped on read
+    --ext .m4a,.mp3    file extensions replace picks up in folders and their subfolders (default: .m4a),
+                       or reconcile counts as media files (default: common audio and video formats)
+    --jobs N           number of threads replace uses to read file metadata (default: 4), or reconcile
+                       uses to read folders and check files (default: 8)
+    --profile          count Apple Events and time library functions, and print a summary at the end
+    --trace FILE       with --profile, also write a JSON trace (chrome://tracing format) to FILE
+    --top N            number of tracks and artists history lists (default: 10), or of groups libdupes prints
+    --merge-plan FILE  with libdupes, write a CSV that keeps the most played copy of each group and lists the others
+    --direct           talk to Music directly even if an amutils server is running
+    --interval SECONDS with serve, seconds between background library refreshes (default: 30)
 ''')
     sys.exit(0)
 
-def process_folder(folder_path, folder=True):
+# Set by --direct; applied by use_library
+direct = False
+
+# Commands that can be answered from the library snapshot with --cached or --max-age
+CACHED_COMMANDS = ('stat', 'playedtime', 'export', 'dupes', 'libdupes', 'reconcile', 'snapshot')
+
+# Every command run_command knows
+COMMANDS = CACHED_COMMANDS + ('replace', 'import', 'addtoplaylist', 'history', 'serve')
+
+def use_library():
+    """Set up logging and the --direct choice once a command has checked its arguments."""
+    import logging
+    
+    # Match details are logged at INFO; AMUTILS_LOG_LEVEL=DEBUG adds path debugging output
+    logging.basicConfig(level=os.environ.get('AMUTILS_LOG_LEVEL', 'INFO').upper(), format='%(message)s',
+                        stream=sys.stdout)
+    if direct:
+        import library_server
+        library_server.enabled = False
+
+def pop_option(args, name):
+    """Remove `name VALUE` or `name=VALUE` from args and return VALUE, or None if it is absent."""
+    for index, arg in enumerate(args):
+        if arg == name and index + 1 < len(args):
+            value = args[index + 1]
+            del args[index:index + 2]
+            return value
+        if arg.startswith(name + '='):
+            del args[index]
+            return arg.split('=', 1)[1]
+    return None
+
+def pop_cache_options(args):
+    """
+    Remove ``--cached`` and ``--max-age SECONDS`` from a command line argument list.
+
+    Args:
+        args (list): Arguments, modified in place
+
+    Returns:
+        float: The maximum snapshot age to pass to library_cache functions, float('inf')
+            for --cached, or None when neither option was given
+        
+    Raises:
+        ValueError: If --max-age has no value or a value that isn't a number
+    """
+    max_age = None
+    while '--cached' in args:
+        args.remove('--cached')
+        max_age = float('inf')
+    if args and args[-1] == '--max-age':
+        raise ValueError("--max-age without a value")
+    value = pop_option(args, '--max-age')
+    if value is not None:
+        max_age = float(value)
+    return max_age
+
+def pop_file_options(args):
+    """Remove --ext and --jobs from args and return (extensions tuple or None, jobs or None)."""
+    extensions = pop_option(args, '--ext')
+    extensions = tuple(ext if ext.startswith('.') else '.' + ext for ext in extensions.split(',')) if extensions else None
+    jobs = pop_option(args, '--jobs')
+    if jobs is not None and not (jobs.isdigit() and int(jobs) > 0):
+        print("Error: --jobs expects a positive number")
+        sys.exit(1)
+    return extensions, int(jobs) if jobs else None
+
+def process_folder(folder_path, folder=True, extensions=None, jobs=4):
+    import file_reader, pipeline
+    
+    extensions = extensions or file_reader.DEFAULT_EXTENSIONS
     if not os.path.exists(folder_path):
         print(f"Error: Folder or file does not exist")
         return
-    songs = file_reader.get_songs_in_folder(os.path.abspath(folder_path)) if folder else [ file_reader.process_file(os.path.abspath(folder_path)) ]
-    for song in songs:
-        track = bridge.get_song_info(song.meta.title, song.meta.artist, song.meta.album)
-        bridge.replace_song(song, track)
+    songs = file_reader.get_songs_in_folder(os.path.abspath(folder_path), extensions, workers=jobs) if folder else [ file_reader.process_file(os.path.abspath(folder_path)) ]
+    if pipeline.replace_songs(songs) is None:
+        sys.exit(1)
 
-def get_played_time():
-    days, hours, minutes, seconds, original_minutes = bridge.get_formatted_total_playtime()
+def get_played_time(max_age=None):
+    import bridge, library_cache
+    
+    days, hours, minutes, seconds, original_minutes = bridge.format_time_in_days(library_cache.get_total_playtime(max_age)[0])
     print(f"{math.floor(days)} days, {math.floor(hours)} hrs, {math.floor(minutes)} mins, {math.floor(seconds)} seconds ({math.floor(original_minutes)} minutes)")
 
-def get_stat():
-    total_play_time, track_count = bridge.get_total_playtime()
-    days, hours, minutes, seconds, original_minutes = bridge.format_time_in_days(total_play_time)
-    print(f"You have {track_count} songs in your library")
+def get_stat(max_age=None):
+    import bridge, library_cache, stats
+    
+    result = library_cache.get_library_stats(stats.DEFAULT_STATS, max_age)
+    days, hours, minutes, seconds, original_minutes = bridge.format_time_in_days(result['total_playtime'])
+    print(f"You have {result['track_count']} songs in your library")
     print(f"You've listened for {math.floor(days)} days, {math.floor(hours)} hrs, {math.floor(minutes)} mins, {math.floor(seconds)} seconds ({math.floor(original_minutes)} minutes)")
+    print(f"{result['total_plays']} plays in total, {result['played_tracks']} songs played at least once")
+    print(f"Average song length: {math.floor(result['mean_duration'] // 60)} mins {math.floor(result['mean_duration'] % 60)} seconds")
+
+def find_dupes(max_age=None):
+    """List library files whose content is identical."""
+    import library_cache, hashing
+    
+    tracks = library_cache.get_all_tracks(max_age)
+    by_path = {track.file_path: track for track in tracks.where('file_path')}
+    
+    groups = hashing.find_duplicates(by_path)
+    if not groups:
+        print("No duplicate files found in the library")
+        return
+    
+    for group in groups:
+        size, _ = hashing.file_signature(group[0])
+        print(f"\n{len(group)} identical files ({size / (1 << 20):.1f} MB each):")
+        for path in group:
+            track = by_path[path]
+            print(f"  [{track.id}] '{track.name}' by {track.artist} - {path}")
+    print(f"\nFound {len(groups)} groups of duplicate files")
+
+def serve(action=None, interval=None):
+    """Run the library server, or report on or stop the running one."""
+    import library_server
+    
+    if action == "status":
+        info = library_server.status()
+        if info is None:
+            print(f"No amutils server is listening on {library_server.socket_path()}")
+            return
+        age = time.time() - info['refreshed_at']
+        print(f"amutils server (pid {info['pid']}, {info['backend']} backend) holds {info['tracks']} tracks and {info['playlists']} playlists, refreshed {age:.0f}s ago")
+    elif action == "stop":
+        if library_server.stop():
+            print("Stopped the amutils server")
+        else:
+            print(f"No amutils server is listening on {library_server.socket_path()}")
+    elif not library_server.serve(interval=interval or library_server.REFRESH_INTERVAL):
+        sys.exit(1)
 
 def add_to_playlist(playlist_name):
     """Add all tracks with .movpkg in their file path to a specified playlist."""
+    import bridge
     
-    # Get all tracks from library
-    tracks = bridge.get_all_tracks()
-    
-    # Filter for tracks that have .movpkg in their file path
-    movpkg_tracks = [track for track in tracks if track.file_path and ".movpkg" in track.file_path]
+    # Matching tracks are found from one fetch of the location column; tracks already in the playlist are skipped
+    matched, count = bridge.add_matching_tracks_to_playlist(playlist_name, lambda path: ".movpkg" in path)
     
-    if not movpkg_tracks:
+    if not matched:
         print("No tracks with .movpkg in their file path found in the library")
         return
     
-    # Add tracks to playlist
-    count = bridge.add_tracks_to_playlist(movpkg_tracks, playlist_name)
     print(f"Added {count} tracks to playlist '{playlist_name}'")
 
 def main():
-    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help']: print_help()
+    args = sys.argv[1:]
+    if len(args) < 1 or args[0] in ['-h', '--help']: print_help()
+    
+    global direct
+    try:
+        max_age = pop_cache_options(args)
+    except ValueError:
+        print("Error: --max-age expects a number of seconds")
+        sys.exit(1)
+    
+    trace_path = pop_option(args, '--trace')
+    profiler = None
+    if '--profile' in args:
+        args.remove('--profile')
+        import profiler
+        profiler.enable(trace_path)
+    elif trace_path:
+        print("Error: --trace requires --profile")
+        sys.exit(1)
+    if '--direct' in args:
+        args.remove('--direct')
+        direct = True
+    if not args or args[0] in ['-h', '--help']: print_help()
+    
+    try:
+        run_command(args, max_age)
+    finally:
+        if profiler:
+            profiler.report()
+
+def run_command(args, max_age=None):
+    command = args[0]
     
-    command = sys.argv[1]
+    if max_age is not None and command in COMMANDS and command not in CACHED_COMMANDS:
+        print(f"Error: --cached and --max-age only apply to {', '.join(CACHED_COMMANDS)}")
+        sys.exit(1)
     
     if command == "addtoplaylist":
-        if len(sys.argv) < 3:
+        if len(args) < 2:
             print("Error: Missing playlist name. Usage: amutils addtoplaylist [playlist_name]")
             sys.exit(1)
-        playlist_name = sys.argv[2]
+        playlist_name = args[1]
+        use_library()
         add_to_playlist(playlist_name)
     elif command == "replace":
-        path = sys.argv[2] if len(sys.argv) >= 3 else os.getcwd()
-        process_folder(path, folder=os.path.isdir(path))
+        extensions, jobs = pop_file_options(args)
+        path = args[1] if len(args) >= 2 else os.getcwd()
+        use_library()
+        process_folder(path, folder=os.path.isdir(path), extensions=extensions, jobs=jobs or 4)
     elif command == "playedtime": 
-        get_played_time()
+        use_library()
+        get_played_time(max_age)
     elif command == "stat": 
-        get_stat()
+        use_library()
+        get_stat(max_age)
     elif command == "export": 
-        path = sys.argv[2] if len(sys.argv) >= 3 else os.getcwd()
-        exporter.handle_export_command(path)
+        export_format = pop_option(args, '--format') or 'csv'
+        if export_format not in ('csv', 'columnar'):
+            print("Error: --format expects csv or columnar")
+            sys.exit(1)
+        path = args[1] if len(args) >= 2 else os.getcwd()
+        use_library()
+        import exporter
+        exporter.handle_export_command(path, max_age, export_format)
+    elif command == "dupes":
+        use_library()
+        find_dupes(max_age)
+    elif command == "libdupes":
+        top = pop_option(args, '--top')
+        if top is not None and not top.isdigit():
+            print("Error: --top expects a number")
+            sys.exit(1)
+        tolerance = pop_option(args, '--tolerance')
+        try:
+            tolerance = float(tolerance) if tolerance is not None else None
+            if tolerance is not None and tolerance <= 0:
+                raise ValueError(tolerance)
+        except ValueError:
+            print("Error: --tolerance expects a positive number of seconds")
+            sys.exit(1)
+        plan_path = pop_option(args, '--merge-plan')
+        use_library()
+        import library_dupes
+        if not library_dupes.print_library_dupes(max_age, tolerance or library_dupes.DEFAULT_TOLERANCE,
+                                                 int(top) if top else None, plan_path):
+            sys.exit(1)
+    elif command == "reconcile":
+        extensions, jobs = pop_file_options(args)
+        if len(args) < 2:
+            print("Error: Missing folder. Usage: amutils reconcile FOLDER [FOLDER ...]")
+            sys.exit(1)
+        use_library()
+        import reconcile
+        if not reconcile.print_reconciliation(args[1:], max_age, extensions or reconcile.MEDIA_EXTENSIONS,
+                                              jobs or reconcile.DEFAULT_JOBS):
+            sys.exit(1)
+    elif command == "snapshot":
+        use_library()
+        import history
+        if not history.record_snapshot(max_age):
+            sys.exit(1)
+    elif command == "history":
+        top = pop_option(args, '--top')
+        if top is not None and not top.isdigit():
+            print("Error: --top expects a number")
+            sys.exit(1)
+        use_library()
+        import history
+        history.print_history(*args[1:3], top=int(top) if top else history.DEFAULT_TOP)
+    elif command == "serve":
+        interval = pop_option(args, '--interval')
+        try:
+            interval = float(interval) if interval is not None else None
+            if interval is not None and interval <= 0:
+                raise ValueError(interval)
+        except ValueError:
+            print("Error: --interval expects a positive number of seconds")
+            sys.exit(1)
+        action = args[1] if len(args) >= 2 else None
+        if action not in (None, "status", "stop"):
+            print("Error: Unknown serve action. Usage: amutils serve [--interval SECONDS] | serve status | serve stop")
+            sys.exit(1)
+        use_library()
+        serve(action, interval)
     elif command == "import": 
-        path = sys.argv[2] if len(sys.argv) >= 3 else os.getcwd()
+        path = args[1] if len(args) >= 2 else os.getcwd()
+        use_library()
+        import exporter
         exporter.handle_import_command(path)
     else:
         print(f"Error: Unknown command '{command}'. Use --help to see available commands.")
@@ -0,0 +1,162 @@
+"""
+Reusable index of library file paths for bridge.get_track_by_file_path.
+
+The path keys of every library track are computed once and stored in hash maps,
+so each lookup is a handful of dictionary probes instead of a pass over the whole
+library. Lookups return the same match quality tiers (100 down to 30) and the same
+winner as a full scan: the earliest track in library order within the best tier.
+"""
+
+import os
+from bisect import bisect_right
+from collections import defaultdict
+from path_keys import get_path_keys, get_path_keys_many, strip_trailing_number
+
+def _first_positions(pairs):
+    """Map each key to the earliest position it occurs at."""
+    index = {}
+    for key, position in pairs:
+        index.setdefault(key, position)
+    return index
+
+class PathIndex:
+    """
+    Hash maps over the path keys of every library track.
+
+    Args:
+        ids (list): Track ids in library order
+        names (list): Track names in library order
+        paths (list): Track file paths in library order ('' or None for tracks without a file)
+    """
+
+    def __init__(self, ids, names, paths):
+        self.ids = list(ids)
+        self.names = list(names)
+        self.paths = list(paths)
+
+        keyed = [(position, keys) for position, keys in enumerate(get_path_keys_many(self.paths)) if keys]
+
+        self.by_name = _first_positions((name, position) for position, name in enumerate(self.names))
+        self.by_clean_path = _first_positions((keys.clean_path, p) for p, keys in keyed)
+        self.by_filename = _first_positions((keys.filename, p) for p, keys in keyed)
+        self.by_basename = _first_positions((keys.basename, p) for p, keys in keyed)
+        self.by_simple_basename = _first_positions((keys.simple_basename, p) for p, keys in keyed)
+        self.by_movpkg_stem = _first_positions(
+            (strip_trailing_number(keys.basename), p) for p, keys in keyed if keys.is_movpkg)
+        self.by_ascii_name = _first_positions((keys.ascii_name, p) for p, keys in keyed)
+
+        # Segment inverted index and parent directory index, positions in library order
+        self.by_segment = defaultdict(list)
+        self.by_parent = defaultdict(list)
+        self.simple_basenames = {}
+        for position, keys in keyed:
+            for segment in set(keys.segments):
+                self.by_segment[segment].append(position)
+            self.by_parent[os.path.basename(keys.dirname)].append(position)
+            self.simple_basenames[position] = keys.simple_basename
+
+        # All filenames joined in library order, for "filename contains" searches with str.find
+        self._filename_offsets = []
+        parts = []
+        offset = 0
+        for position, keys in keyed:
+            self._filename_offsets.append((offset, position))
+            parts.append(keys.filename)
+            offset += len(keys.filename) + 1
+        self._filename_starts = [start for start, _ in self._filename_offsets]
+        self._filenames = '\0'.join(parts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _first_filename_containing(self, text):
+        """Return the earliest position whose filename contains text, or None."""
+        if not self._filename_offsets:
+            return None
+        found = self._filenames.find(text)
+        if found < 0:
+            return None
+        return self._filename_offsets[bisect_right(self._filename_starts, found) - 1][1]
+
+    def _first_with_common_segments(self, segments, minimum=2):
+        """Return the earliest position sharing at least `minimum` path segments, or None."""
+        counts = defaultdict(int)
+        best = None
+        for segment in set(segments):
+            for position in self.by_segment.get(segment, ()):
+                counts[position] += 1
+                if counts[position] >= minimum and (best is None or position < best):
+                    best = position
+        return best
+
+    def find_name(self, name):
+        """Return the earliest position of a track with exactly this name, or None."""
+        return self.by_name.get(name)
+
+    def match(self, file_path):
+        """
+        Find the best library match for a file path.
+
+        Args:
+            file_path (str): The file path to search for
+
+        Returns:
+            tuple: (quality, position, reason) for the best match, or None if nothing matches
+        """
+        target = get_path_keys(file_path)
+        if not target:
+            return None
+
+        tiers = [
+            (100, "exact path match", lambda: self.by_clean_path.get(target.clean_path)),
+            (90, "exact filename match", lambda: self.by_filename.get(target.filename)),
+            (80, "basename match", lambda: self.by_basename.get(target.basename)),
+            (70, "simple basename match", lambda: self.by_simple_basename.get(target.simple_basename)
+                if target.simple_basename else None),
+            (65, ".movpkg basename match without numbers", lambda: self.by_movpkg_stem.get(
+                strip_trailing_number(target.basename)) if target.is_movpkg else None),
+            (60, "filename contains target basename", lambda: self._first_filename_containing(target.basename)),
+            (50, "common path segments", lambda: self._first_with_common_segments(target.segments)),
+            (40, "same directory, similar filename", lambda: self._first_in_directory(target)),
+            (30, "ASCII-only name match", lambda: self.by_ascii_name.get(target.ascii_name)
+                if len(target.ascii_name) > 3 else None),
+        ]
+
+        for quality, reason, find in tiers:
+            position = find()
+            if position is not None:
+                if quality == 50:
+                    common = set(target.segments).intersection(get_path_keys(self.paths[position]).segments)
+                    reason = f"{len(common)} {reason}"
+                return quality, position, reason
+        return None
+
+    def _first_in_directory(self, target):
+        """Return the earliest track in the same parent directory with a similar filename, or None."""
+        simple_basename = target.simple_basename
+        if len(simple_basename) <= 3:
+            return None
+        for position in self.by_parent.get(os.path.basename(target.dirname), ()):
+            if simple_basename in self.simple_basenames[position]:
+                return position
+        return None
+
+def build_path_index(tracks_ref, fetch_columns):
+    """
+    Build a PathIndex from a tracks reference with one column fetch per property.
+
+    Args:
+        tracks_ref: A tracks reference, e.g. ``app.library_playlists[1].tracks``
+        fetch_columns: bridge.fetch_columns
+
+    Returns:
+        PathIndex: The index of every track in the reference
+    """
+    columns = fetch_columns(tracks_ref, ['id', 'name', 'location'])
+    paths = []
+    for location in columns['location']:
+        try:
+            paths.append(location.path or '')
+        except Exception:
+            paths.append('')
+    return PathIndex(columns['id'], columns['name'], paths)
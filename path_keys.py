@@ -0,0 +1,185 @@
+"""
+Path normalization and match keys for library file paths.
+
+Paths are cleaned (zero-width and line/paragraph separator characters removed,
+NFC normalized, trailing version numbers before the extension dropped) and
+split into the keys bridge.get_track_by_file_path and path_index match on. All
+patterns are compiled once; single lookups go through an LRU cache, and
+get_path_keys_many normalizes a whole column of paths in one call.
+
+Run ``python3 path_keys.py [COUNT]`` for micro-benchmarks on synthetic paths.
+"""
+
+import os
+import re
+import time
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+# Paths whose keys are kept by get_path_keys
+CACHE_SIZE = 1 << 16
+
+_INVISIBLE = re.compile(r'[\u200B-\u200F\u2028-\u202F\uFEFF]')
+_NUMBERED_EXTENSION = re.compile(r'\s+\d+(\.\w+)$')
+_TRAILING_NUMBER = re.compile(r'\s+\d+$')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+# A featured-artist suffix or trailing soft hyphens, which Music leaves out of track names
+_TITLE_SUFFIX = re.compile(r'(?: \(feat\..+?\)|\u00AD+)$')
+
+PathKeys = namedtuple('PathKeys', ['clean_path', 'filename', 'basename', 'simple_basename', 'dirname',
+                                   'is_movpkg', 'segments', 'ascii_name'])
+
+def normalize_path(path):
+    """Remove invisible characters from a path and NFC normalize it, keeping everything else."""
+    # Plain ASCII has no invisible characters and is already NFC
+    if path.isascii():
+        return path
+    # Remove any control characters and zero-width spaces
+    path = _INVISIBLE.sub('', path)
+    # Normalize unicode form
+    if not unicodedata.is_normalized('NFC', path):
+        path = unicodedata.normalize('NFC', path)
+    return path
+
+def deep_clean_path(path):
+    """Create a clean normalized version of a path."""
+    if not path:
+        return ""
+    path = normalize_path(path)
+    # Strip all trailing whitespace, slashes and numbers before extension; a number before the
+    # extension can only be in the last component, so only that is searched
+    head, slash, tail = path.rpartition('/')
+    if any(c.isdigit() for c in tail):
+        path = head + slash + _NUMBERED_EXTENSION.sub(r'\1', tail)
+    return path.rstrip('/ ')
+
+def strip_trailing_number(name):
+    """Remove a trailing version number, e.g. "song 2" -> "song"."""
+    if not name[-1:].isdigit():
+        return name
+    return _TRAILING_NUMBER.sub('', name)
+
+def movpkg_title(basename):
+    """Guess the Music track name of a .movpkg basename: no version number or featured artist."""
+    return _TITLE_SUFFIX.sub('', strip_trailing_number(basename))
+
+def _compute_path_keys(path):
+    # Basic path normalization
+    clean_path = deep_clean_path(path)
+
+    # Get filename components
+    dirname, filename = os.path.split(clean_path)
+
+    # Handle .movpkg special case
+    is_movpkg = clean_path.endswith('.movpkg')
+    if is_movpkg:
+        basename = filename[:-7]  # Remove .movpkg
+    else:
+        basename = os.path.splitext(filename)[0]
+
+    # Clean the basename further (remove special chars and numbers)
+    simple_basename = strip_trailing_number(_PUNCTUATION.sub('', basename)).strip().lower()
+
+    # Last 1-3 path segments are most useful for matching
+    segments = tuple(part for part in clean_path.split('/')[-3:] if part)
+
+    # For Japanese/special char filenames, create an ASCII-only version
+    if simple_basename.isascii():
+        ascii_name = simple_basename
+    else:
+        ascii_name = ''.join(c for c in simple_basename if ord(c) < 128)
+
+    return PathKeys(clean_path, filename, basename, simple_basename, dirname, is_movpkg, segments, ascii_name)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_path_keys(path):
+    """
+    Extract the identifying keys of a path for fuzzy matching.
+
+    Args:
+        path (str): A POSIX file path
+
+    Returns:
+        PathKeys: The keys, or None for an empty path
+    """
+    if not path:
+        return None
+    return _compute_path_keys(path)
+
+def get_path_keys_many(paths):
+    """
+    Extract the keys of many paths in one call, computing each distinct path once.
+
+    Bypasses the LRU cache so that indexing a whole library doesn't evict lookups.
+
+    Args:
+        paths (iterable): File paths; empty entries are allowed
+
+    Returns:
+        list: PathKeys (or None for empty paths) in the same order as paths
+    """
+    seen = {}
+    results = []
+    for path in paths:
+        keys = seen.get(path)
+        if keys is None and path:
+            keys = seen[path] = _compute_path_keys(path)
+        results.append(keys)
+    return results
+
+def synthetic_paths(count, seed=0):
+    """
+    Generate library-like paths for benchmarks.
+
+    Paths come from fake_music.synthetic_tracks (CJK names, numbered copies, .movpkg packages),
+    and some get zero-width characters or NFD decomposed accents added.
+    """
+    import random
+    import fake_music
+
+    rng = random.Random(seed)
+    paths = []
+    for track in fake_music.synthetic_tracks(count, seed):
+        location = track.get('location')
+        path = location or '/Users/me/Music/Media/Unknown/Unknown.m4a'
+        roll = rng.random()
+        if roll < 0.1:
+            cut = rng.randrange(1, len(path))
+            path = path[:cut] + rng.choice(['\u200B', '\u200D', '\uFEFF', '\u2028']) + path[cut:]
+        elif roll < 0.2:
+            path = path.replace('.m4a', ' Cafe\u0301.m4a')
+        paths.append(path)
+    return paths
+
+def benchmark(count=100000, seed=0):
+    """
+    Time path normalization on synthetic paths and print one line per variant.
+
+    Returns:
+        dict: Variant name mapped to microseconds per path
+    """
+    paths = synthetic_paths(count, seed)
+    results = {}
+
+    def run(name, function, size=count):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed / size * 1e6
+        print(f"{name:<36}{elapsed:>10.3f} s{results[name]:>10.2f} us/path")
+
+    print(f"{count} paths, {len(set(paths))} distinct")
+    run('uncached', lambda: [_compute_path_keys(path) for path in paths])
+    get_path_keys.cache_clear()
+    run('get_path_keys (cold cache)', lambda: [get_path_keys(path) for path in paths])
+    # The most recent paths are still cached after the cold run
+    warm = paths[-CACHE_SIZE:]
+    run('get_path_keys (warm cache)', lambda: [get_path_keys(path) for path in warm], len(warm))
+    run('get_path_keys_many', lambda: get_path_keys_many(paths))
+    return results
+
+if __name__ == '__main__':
+    import sys
+
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
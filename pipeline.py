@@ -0,0 +1,244 @@
+"""
+Staged pipeline for the replace command.
+
+Scanning and metadata parsing run on a pool of reader threads and candidate
+lookup runs on its own thread against an in-memory index of the library, while
+the main thread is the single writer that sends Apple Events. Stages are
+connected by bounded queues, so local file work overlaps with Music round trips.
+"""
+
+import queue
+import threading
+import time
+from types import SimpleNamespace
+import bridge
+import file_reader
+import fuzzy_index
+
+# Lowest similarity of the near matches printed as suggestions when no exact match exists
+SUGGESTION_SCORE = 0.6
+
+# Near matches printed per unmatched file
+SUGGESTIONS = 3
+
+# Properties fetched once to answer candidate lookups in memory
+INDEX_PROPERTIES = ['id', 'persistent_ID', 'name', 'artist', 'album', 'played_count',
+                    'favorited', 'date_added', 'location']
+
+_DONE = object()
+
+# Seconds a stage waits on a full or empty queue before checking whether the pipeline was stopped
+PUT_TIMEOUT = 0.1
+
+def _key(name, artist, album):
+    """Return the normalized (name, artist, album) lookup key; missing artist or album is None."""
+    return (fuzzy_index.normalize(name), fuzzy_index.normalize(artist) or None,
+            fuzzy_index.normalize(album) or None)
+
+class LibraryIndex:
+    """
+    Tracks keyed by (name, artist, album), built with one column fetch per property.
+
+    A lookup matches the name and, when given, the artist and album, compared after
+    fuzzy_index.normalize (case, Unicode form, punctuation and spacing), and returns the
+    first such track in library order. Replacing deletes the track, so near matches are
+    only printed as suggestions, never used. Each track is handed out at most once, so
+    two files with the same metadata never replace the same track.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.keys = {}
+        self.claimed = set()
+        self.fuzzy = fuzzy_index.FuzzyIndex(columns['name'], columns['artist'], columns['album'])
+        for position, (name, artist, album) in enumerate(zip(columns['name'], columns['artist'], columns['album'])):
+            name, artist, album = _key(name, artist, album)
+            for key in ((name, artist, album), (name, artist, None), (name, None, album), (name, None, None)):
+                self.keys.setdefault(key, []).append(position)
+
+    @classmethod
+    def build(cls):
+        return cls(bridge.fetch_columns(bridge.app.library_playlists[1].tracks, INDEX_PROPERTIES))
+
+    def lookup(self, name, artist, album):
+        """Return the library position of the first unclaimed exact match, or None."""
+        for position in self.keys.get(_key(name, artist, album), ()):
+            if position not in self.claimed:
+                self.claimed.add(position)
+                return position
+        suggestions = [(position, score) for position, score
+                       in self.fuzzy.search(name, artist, album, limit=SUGGESTIONS, exclude=self.claimed)
+                       if score >= SUGGESTION_SCORE]
+        if suggestions:
+            print(f"No exact match for '{name}' by {artist} on {album}; not replacing. Similar tracks:")
+            for position, score in suggestions:
+                print(f"  ({score:.2f}) [{self.columns['id'][position]}] '{self.columns['name'][position]}' "
+                      f"by {self.columns['artist'][position]} on {self.columns['album'][position]}")
+        return None
+
+    def song_info(self, position, playlist_index):
+        """Build the same record bridge.get_song_info returns for the track at a position."""
+        value = lambda prop: self.columns[prop][position]
+        location = value('location')
+        return SimpleNamespace(
+            track=bridge.app.library_playlists[1].tracks.ID(value('id')),
+            id=value('id'),
+            persistent_id=value('persistent_ID'),
+            play_count=value('played_count'),
+            date_added=value('date_added'),
+            favorite=value('favorited'),
+            location=getattr(location, 'path', None),
+            containing_playlists=list(playlist_index.get(value('persistent_ID'), [])),
+        )
+
+class StageStats:
+    """Item count and busy time of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+
+    def rate(self):
+        return self.items / self.busy if self.busy else 0.0
+
+def _put(output, item, stop):
+    """Put an item on a bounded queue; return False instead if the pipeline is stopped while it is full."""
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(source, stop):
+    """Take the next item from a queue, or _DONE once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return source.get(timeout=PUT_TIMEOUT)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _scan(songs, output, stage, errors, stop):
+    songs = iter(songs)
+    try:
+        while True:
+            # Only parsing counts as busy time, not waiting for the lookup stage to catch up
+            start = time.perf_counter()
+            try:
+                song = next(songs)
+            except StopIteration:
+                break
+            finally:
+                stage.busy += time.perf_counter() - start
+            stage.items += 1
+            if not _put(output, song, stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        if hasattr(songs, 'close'):
+            songs.close()
+        _put(output, _DONE, stop)
+
+def _lookup(source, output, index, playlist_index, stage, errors, stop):
+    try:
+        while True:
+            song = _get(source, stop)
+            if song is _DONE:
+                break
+            start = time.perf_counter()
+            if isinstance(song.meta, str):
+                # Metadata could not be read; report it from the writer thread
+                item = (song, None)
+            else:
+                position = index.lookup(song.meta.title, song.meta.artist, song.meta.album)
+                item = (song, index.song_info(position, playlist_index) if position is not None else None)
+            stage.items += 1
+            stage.busy += time.perf_counter() - start
+            if not _put(output, item, stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(output, _DONE, stop)
+
+def print_report(stages, wall_time):
+    """Print the per-stage throughput table."""
+    print(f"\n{'Stage':<16}{'Items':>8}{'Busy (s)':>12}{'Items/s':>12}")
+    for stage in stages:
+        print(f"{stage.name:<16}{stage.items:>8}{stage.busy:>12.2f}{stage.rate():>12.1f}")
+    print(f"{'Total wall time':<16}{'':>8}{wall_time:>12.2f}")
+
+def replace_songs(songs, queue_size=64):
+    """
+    Replace library tracks with the given songs through the staged pipeline.
+
+    Args:
+        songs (iterable): SimpleNamespace(meta, path) records, e.g. from file_reader.get_songs_in_folder
+        queue_size (int, optional): Capacity of each queue between stages (default: 64)
+
+    Returns:
+        list: StageStats for the scan, lookup and write stages, or None if the library could not be read
+    """
+    started = time.perf_counter()
+    scan_stage, lookup_stage, write_stage = StageStats('scan + parse'), StageStats('lookup'), StageStats('write')
+    parsed, matched = queue.Queue(queue_size), queue.Queue(queue_size)
+    errors = []
+    # Set when the writer stops reading, so stages blocked on a full queue give up instead of hanging
+    stop = threading.Event()
+
+    scanner = threading.Thread(target=_scan, args=(songs, parsed, scan_stage, errors, stop), daemon=True)
+    scanner.start()
+
+    matcher = None
+    try:
+        # The library and playlist indexes are built on this thread, which owns all Apple Events
+        try:
+            index = LibraryIndex.build()
+            playlist_index = bridge.get_playlist_index()
+        except Exception as e:
+            print(f"Error reading library: {e}")
+            return None
+
+        matcher = threading.Thread(target=_lookup, args=(parsed, matched, index, playlist_index, lookup_stage,
+                                                         errors, stop), daemon=True)
+        matcher.start()
+
+        while True:
+            item = matched.get()
+            if item is _DONE:
+                break
+            song, info = item
+            start = time.perf_counter()
+            if isinstance(song.meta, str):
+                print(f"Skipping {song.path}: {song.meta}")
+            else:
+                bridge.replace_song(song, info)
+            write_stage.items += 1
+            write_stage.busy += time.perf_counter() - start
+    finally:
+        # After the lookup stage ends (normally or on an error) nothing reads the parsed queue any more
+        stop.set()
+        scanner.join()
+        if matcher is not None:
+            matcher.join()
+    for error in errors:
+        print(f"Error in replace pipeline: {error}")
+
+    stages = [scan_stage, lookup_stage, write_stage]
+    print_report(stages, time.perf_counter() - started)
+    return stages
+
+def replace_folder(folder_path, extensions=file_reader.DEFAULT_EXTENSIONS, jobs=4):
+    """
+    Replace library tracks with every matching file under a folder.
+
+    Args:
+        folder_path (str): Folder to scan recursively
+        extensions (tuple, optional): File extensions to include (default: ('.m4a',))
+        jobs (int, optional): Number of metadata reader threads (default: 4)
+    """
+    return replace_songs(file_reader.get_songs_in_folder(folder_path, extensions, workers=jobs))
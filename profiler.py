@@ -0,0 +1,306 @@
+"""
+Apple Event instrumentation for ``amutils --profile``.
+
+When enabled, the Music application reference is wrapped in a proxy that times
+every command sent through it (one command is one Apple Event) and records it
+by command and property, e.g. ``get name`` or ``set played_count``. Functions
+of the library modules are wrapped as well, so each event is also attributed
+to the functions that were running when it was sent. A summary table is
+printed at the end and, optionally, a trace in the Chrome trace event format
+(viewable in chrome://tracing or Perfetto) is written.
+"""
+
+import functools
+import importlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Modules whose functions and methods are timed
+PROFILED_MODULES = ['bridge', 'batch_update', 'library_cache', 'exporter', 'pipeline']
+
+# Reference methods that send an Apple Event
+COMMANDS = {'get', 'set', 'count', 'exists', 'delete', 'duplicate', 'add', 'make', 'move', 'select'}
+
+# Element selectors; they only build a reference, so the property name of their parent is kept
+SELECTORS = {'ID', 'first', 'last', 'middle', 'any', 'end', 'beginning', 'before', 'after'}
+
+# Number of rows printed in each summary table
+REPORT_ROWS = 25
+
+_profile = None
+
+class Timing:
+    """Call count, total wall time and Apple Events of one function or event kind."""
+
+    __slots__ = ('calls', 'seconds', 'events')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.events = 0
+
+class Profile:
+    """
+    Collected timings of one profiled run.
+
+    Args:
+        trace_path (str, optional): Write a JSON trace to this path in report()
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.started = time.perf_counter()
+        self.functions = defaultdict(Timing)
+        self.events = defaultdict(Timing)
+        self.trace = [] if trace_path else None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _trace(self, name, category, start, seconds, args=None):
+        if self.trace is None:
+            return
+        entry = {'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'ts': round((start - self.started) * 1e6, 1), 'dur': round(seconds * 1e6, 1)}
+        if args:
+            entry['args'] = args
+        self.trace.append(entry)
+
+    def record_event(self, kind, start, seconds):
+        """Record one Apple Event and charge it to every function on the current thread's stack."""
+        with self.lock:
+            timing = self.events[kind]
+            timing.calls += 1
+            timing.events += 1
+            timing.seconds += seconds
+            for name in set(self.stack()):
+                self.functions[name].events += 1
+            self._trace(kind, 'apple_event', start, seconds)
+
+    def record_call(self, name, start, seconds, outermost):
+        with self.lock:
+            timing = self.functions[name]
+            timing.calls += 1
+            # Recursive calls are already covered by the outermost call's time
+            if outermost:
+                timing.seconds += seconds
+            self._trace(name, 'function', start, seconds)
+
+    def report(self):
+        """Print the summary tables and write the trace file, if one was requested."""
+        wall_time = time.perf_counter() - self.started
+        event_count = sum(timing.calls for timing in self.events.values())
+        event_time = sum(timing.seconds for timing in self.events.values())
+
+        print(f"\n{'Apple Event':<32}{'Count':>8}{'Total (s)':>12}{'Mean (ms)':>12}")
+        for kind, timing in sorted(self.events.items(), key=lambda item: -item[1].seconds)[:REPORT_ROWS]:
+            print(f"{kind:<32}{timing.calls:>8}{timing.seconds:>12.3f}{timing.seconds / timing.calls * 1000:>12.2f}")
+
+        print(f"\n{'Function':<40}{'Calls':>8}{'Total (s)':>12}{'Events':>8}")
+        for name, timing in sorted(self.functions.items(), key=lambda item: -item[1].seconds)[:REPORT_ROWS]:
+            print(f"{name:<40}{timing.calls:>8}{timing.seconds:>12.3f}{timing.events:>8}")
+
+        share = event_time / wall_time * 100 if wall_time else 0.0
+        print(f"\n{event_count} Apple Events took {event_time:.3f}s of {wall_time:.3f}s wall time ({share:.0f}%)")
+
+        if self.trace_path:
+            try:
+                with open(self.trace_path, 'w', encoding='utf-8') as f:
+                    json.dump({'traceEvents': self.trace, 'displayTimeUnit': 'ms'}, f)
+                print(f"Trace written to {self.trace_path}")
+            except OSError as e:
+                print(f"Error writing trace file: {e}")
+
+def _unwrap(value):
+    if isinstance(value, Reference):
+        return value._target
+    if isinstance(value, list):
+        return [_unwrap(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_unwrap(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _unwrap(item) for key, item in value.items()}
+    return value
+
+def _wrap(value, prop, reference_types):
+    if isinstance(value, reference_types):
+        return Reference(value, prop, reference_types)
+    if isinstance(value, list) and value and isinstance(value[0], reference_types):
+        return [_wrap(item, prop, reference_types) for item in value]
+    return value
+
+def _command(command, prop, function, reference_types):
+    """Wrap a reference method so that calling it is timed and recorded as one Apple Event."""
+    def send(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*_unwrap(args), **_unwrap(kwargs))
+        finally:
+            _profile.record_event(f"{command} {prop}", start, time.perf_counter() - start)
+        return _wrap(result, prop, reference_types)
+    return send
+
+class Reference:
+    """
+    Proxy for a backend reference that records every command sent through it.
+
+    Args:
+        target: The wrapped appscript (or fake) reference
+        prop (str): Property or element name the reference ends in, used to label events
+        reference_types (tuple): Types whose instances are references and get wrapped too
+    """
+
+    __slots__ = ('_target', '_property', '_reference_types')
+
+    def __init__(self, target, prop, reference_types):
+        self._target = target
+        self._property = prop
+        self._reference_types = reference_types
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        prop = self._property if name in SELECTORS else name
+        if isinstance(value, self._reference_types):
+            return Reference(value, prop, self._reference_types)
+        if not callable(value):
+            return value
+        if name in COMMANDS:
+            return _command(name, self._property, value, self._reference_types)
+        if name in SELECTORS:
+            return lambda *args, **kwargs: _wrap(value(*_unwrap(args), **_unwrap(kwargs)), prop,
+                                                 self._reference_types)
+        # Any other call on a reference, e.g. playlist.name(), is a get
+        return _command('get', name, value, self._reference_types)
+
+    def __getitem__(self, key):
+        return Reference(self._target[_unwrap(key)], self._property, self._reference_types)
+
+    def __call__(self, *args, **kwargs):
+        return _command('get', self._property, self._target, self._reference_types)(*args, **kwargs)
+
+    def __eq__(self, other):
+        return self._target == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __repr__(self):
+        return repr(self._target)
+
+class ProfiledBackend:
+    """A backend whose application reference records every Apple Event; everything else is delegated."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.its = backend.its
+        self.k = backend.k
+        self.app = Reference(backend.app, 'application', backend.reference_types)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+def _timed(name, function):
+    if inspect.isgeneratorfunction(function):
+        return _timed_generator(name, function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = _profile.stack()
+        outermost = name not in stack
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+            _profile.record_call(name, start, time.perf_counter() - start, outermost)
+    wrapper.__profiled__ = True
+    return wrapper
+
+def _timed_generator(name, function):
+    # Only the time spent producing items counts, not the time the caller holds the generator
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        generator = function(*args, **kwargs)
+        outermost = name not in _profile.stack()
+        started = time.perf_counter()
+        seconds = 0.0
+        try:
+            while True:
+                stack = _profile.stack()
+                stack.append(name)
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    stack.pop()
+                    seconds += time.perf_counter() - start
+                yield item
+        finally:
+            generator.close()
+            _profile.record_call(name, started, seconds, outermost)
+    wrapper.__profiled__ = True
+    return wrapper
+
+def _instrument(module):
+    """Replace the functions and plain methods defined in a module with timed wrappers."""
+    for name, value in list(vars(module).items()):
+        if inspect.isfunction(value) and value.__module__ == module.__name__:
+            if not getattr(value, '__profiled__', False):
+                setattr(module, name, _timed(f"{module.__name__}.{name}", value))
+        elif inspect.isclass(value) and value.__module__ == module.__name__:
+            for attribute, method in list(vars(value).items()):
+                if inspect.isfunction(method) and not attribute.startswith('__') \
+                        and not getattr(method, '__profiled__', False):
+                    setattr(value, attribute, _timed(f"{module.__name__}.{name}.{attribute}", method))
+
+def enable(trace_path=None):
+    """
+    Start profiling: instrument the library modules and wrap the backend.
+
+    Args:
+        trace_path (str, optional): Write a JSON trace to this path when report() is called
+
+    Returns:
+        Profile: The profile being collected
+    """
+    global _profile
+    _profile = Profile(trace_path)
+    import bridge
+
+    for module_name in PROFILED_MODULES:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            # e.g. pipeline without mutagen; commands that need it fail on their own
+            print(f"Not profiling {module_name}: {e}")
+            continue
+        _instrument(module)
+    if bridge.backend is None:
+        # Not connected yet: wrap the backend when it is first created
+        factory = bridge.backend_factory
+        if not getattr(factory, '__profiled__', False):
+            bridge.backend_factory = lambda: ProfiledBackend(factory())
+            bridge.backend_factory.__profiled__ = True
+    elif not isinstance(bridge.backend, ProfiledBackend):
+        # Still the same library, so a running amutils server keeps answering for it
+        is_default = bridge.backend_is_default
+        bridge.use_backend(ProfiledBackend(bridge.backend))
+        bridge.backend_is_default = is_default
+    return _profile
+
+def report():
+    """Print the summary of the running profile, if profiling is enabled."""
+    if _profile is not None:
+        _profile.report()
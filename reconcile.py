@@ -0,0 +1,190 @@
+"""
+Library and disk reconciliation for ``amutils reconcile``.
+
+Compares the file paths of the library's tracks with the media files under one
+or more root folders. Tracks whose file no longer exists are dead; media files
+under the roots that no track points at are orphans.
+
+Folders are read with ``os.scandir`` on a thread pool, one task per folder, and
+the files of each folder are checked against the library's path set as soon as
+the folder has been read, so orphans are reported while the walk is running and
+the files on disk are never collected in memory. Every file the walk sees counts
+for library membership; the extension list only decides which unknown files are
+reported as orphans. Library files the walk didn't see, outside the roots or in
+skipped hidden folders, are checked with ``os.stat`` in batches on the same pool
+before they are reported as dead. Paths are compared
+after the invisible-character removal and NFC normalization path_keys applies,
+so a file whose name is decomposed on disk still matches its track.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import library_cache
+import path_keys
+
+# File extensions counted as media when looking for orphans; .movpkg packages are folders
+MEDIA_EXTENSIONS = ('.m4a', '.m4p', '.m4b', '.m4v', '.mp4', '.mov', '.movpkg', '.mp3', '.aac', '.aif',
+                    '.aiff', '.wav', '.flac')
+
+# Library files the walk didn't see checked per stat task
+STAT_BATCH_SIZE = 256
+
+DEFAULT_JOBS = 8
+
+def _scan_directory(directory):
+    """Return (directory, file paths, subfolder paths, error) for one folder; .movpkg packages count as files."""
+    files, subfolders = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Skip hidden files, including the ._ files macOS leaves on network storage
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    is_folder = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_folder and not entry.name.lower().endswith('.movpkg'):
+                    subfolders.append(entry.path)
+                else:
+                    files.append(entry.path)
+    except OSError as e:
+        return directory, files, subfolders, e
+    return directory, files, subfolders, None
+
+def _missing(paths):
+    """Return the paths that don't exist; files that can't be checked (e.g. no permission) are not included."""
+    missing = []
+    for path in paths:
+        try:
+            os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            missing.append(path)
+        except OSError:
+            continue
+    return missing
+
+class Reconciler:
+    """
+    Finds dead tracks and orphan files; the counters are filled in while run() is consumed.
+
+    Args:
+        roots (list): Folders to scan for media files
+        extensions (tuple, optional): Extensions of media files, lower case (default: MEDIA_EXTENSIONS)
+        jobs (int, optional): Threads reading folders and checking files (default: DEFAULT_JOBS)
+    """
+
+    def __init__(self, roots, extensions=MEDIA_EXTENSIONS, jobs=DEFAULT_JOBS):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.extensions = tuple(extensions)
+        self.jobs = jobs
+        self.folders = 0
+        self.files = 0
+        self.checked = 0
+        self.without_file = 0
+        self.errors = 0
+
+    def run(self, ids, names, paths):
+        """
+        Compare library paths with the files under the roots.
+
+        Args:
+            ids (list): Track ids in library order
+            names (list): Track names in library order
+            paths (list): Track file paths in library order ('' or None for tracks without a file)
+
+        Yields:
+            tuple: ('orphan', path) for every media file under the roots that no track points
+                at, while the folders are read, then ('dead', id, name, path) for every track
+                whose file is missing, in library order
+        """
+        extensions = self.extensions
+        # Normalized path mapped to whether the walk saw it; paths outside the roots are never seen
+        library = {}
+        for path in paths:
+            if not path:
+                self.without_file += 1
+                continue
+            library[path_keys.normalize_path(path)] = False
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            in_flight = {executor.submit(_scan_directory, root) for root in self.roots}
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, files, subfolders, error = future.result()
+                    if error is not None:
+                        print(f"Error reading folder {directory}: {error}")
+                        self.errors += 1
+                    self.folders += 1
+                    in_flight.update(executor.submit(_scan_directory, subfolder) for subfolder in subfolders)
+                    for path in files:
+                        self.files += 1
+                        key = path_keys.normalize_path(path)
+                        if key in library:
+                            library[key] = True
+                        elif path.lower().endswith(extensions):
+                            yield 'orphan', path
+
+            # Library files the walk didn't see only count as dead if they really don't exist
+            unseen = []
+            for path in paths:
+                if path:
+                    key = path_keys.normalize_path(path)
+                    if library[key] is False:
+                        library[key] = None
+                        unseen.append(path)
+            missing = set()
+            batches = [executor.submit(_missing, unseen[start:start + STAT_BATCH_SIZE])
+                       for start in range(0, len(unseen), STAT_BATCH_SIZE)]
+            for future in batches:
+                missing.update(map(path_keys.normalize_path, future.result()))
+            self.checked = len(unseen)
+
+        for track_id, name, path in zip(ids, names, paths):
+            if path and path_keys.normalize_path(path) in missing:
+                yield 'dead', track_id, name, path
+
+def print_reconciliation(roots, max_age=None, extensions=MEDIA_EXTENSIONS, jobs=DEFAULT_JOBS):
+    """
+    Print the dead tracks and orphan files for ``amutils reconcile``.
+
+    Args:
+        roots (list): Folders to scan for media files
+        max_age (float, optional): Read the library paths from a snapshot at most this old
+            (see library_cache.get_columns)
+        extensions (tuple, optional): Extensions of media files (default: MEDIA_EXTENSIONS)
+        jobs (int, optional): Threads reading folders and checking files (default: DEFAULT_JOBS)
+
+    Returns:
+        bool: True if the library and every root could be read
+    """
+    for root in roots:
+        if not os.path.isdir(root):
+            print(f"Error: {root} is not a folder")
+            return False
+    try:
+        columns = library_cache.get_columns(['id', 'name', 'location'], max_age)
+    except Exception as e:
+        print(f"Error reading library: {e}")
+        return False
+
+    start = time.perf_counter()
+    reconciler = Reconciler(roots, tuple(extension.lower() for extension in extensions), jobs)
+    orphans = dead = 0
+    for kind, *details in reconciler.run(columns['id'], columns['name'], columns['location']):
+        if kind == 'orphan':
+            orphans += 1
+            print(f"Orphan file: {details[0]}")
+        else:
+            dead += 1
+            track_id, name, path = details
+            print(f"Dead track [{track_id}] '{name}': {path}")
+
+    print(f"\nScanned {reconciler.files} files in {reconciler.folders} folders and checked "
+          f"{reconciler.checked} library files the scan didn't reach in {time.perf_counter() - start:.1f}s")
+    print(f"{orphans} orphan files, {dead} dead tracks")
+    if reconciler.without_file:
+        print(f"{reconciler.without_file} tracks have no file location (cloud or already missing)")
+    return reconciler.errors == 0
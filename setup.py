@@ -3,12 +3,15 @@ from setuptools import setup, find_packages
 setup(
     name="amutils",
     version="0.0.3",
-    py_modules=["main", "bridge", "file_reader"],
+    py_modules=["main", "bridge", "file_reader", "backend", "fake_music", "library_cache", "path_index", "batch_update", "stats", "pipeline", "hashing", "duration_index", "fuzzy_index", "columnar", "profiler", "path_keys", "library_server", "history", "benchmark", "track_table", "reconcile", "library_dupes"],
     packages=find_packages(),
     install_requires=[
         "appscript",
         "mutagen",
     ],
+    extras_require={
+        "fast": ["numpy"],
+    },
     entry_points={
         "console_scripts": [
             "amutils=main:main",
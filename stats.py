@@ -0,0 +1,136 @@
+"""
+Library statistics computed over whole property columns.
+
+Each aggregate declares the Music property columns it needs, so any set of
+aggregates is answered from a single fetch of the union of those columns.
+The arithmetic runs on NumPy arrays when NumPy is installed and on
+``array('d')`` columns otherwise; NumPy is imported on the first computation,
+so importing this module stays cheap.
+"""
+
+import math
+import operator
+from array import array
+from collections import namedtuple
+
+# The numpy module, False when it isn't installed, or None until the first computation asks
+_numpy = None
+
+Aggregate = namedtuple('Aggregate', ['name', 'label', 'columns', 'compute'])
+
+AGGREGATES = {}
+
+# Aggregates printed by `amutils stat`
+DEFAULT_STATS = ['track_count', 'total_playtime', 'total_plays', 'played_tracks', 'mean_duration']
+
+def register(name, columns, label=None):
+    """
+    Register an aggregate function.
+
+    The decorated function receives a dict of the requested columns as numeric vectors
+    (NumPy arrays or array('d')) and returns a single number.
+
+    Args:
+        name (str): Aggregate name, e.g. 'total_playtime'
+        columns (list): Music properties the aggregate reads, e.g. ['duration', 'played_count']
+        label (str, optional): Human readable description
+    """
+    def decorator(compute):
+        AGGREGATES[name] = Aggregate(name, label or name.replace('_', ' '), list(columns), compute)
+        return compute
+    return decorator
+
+def _load_numpy():
+    """Return the numpy module, or None when it isn't installed."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+def vector(values):
+    """Convert a column to a float vector, with missing values as 0."""
+    values = [float(value) if value is not None else 0.0 for value in values]
+    numpy = _load_numpy()
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float64)
+    return array('d', values)
+
+def dot(a, b):
+    """Dot product of two vectors."""
+    numpy = _load_numpy()
+    if numpy is not None:
+        return float(numpy.dot(a, b))
+    return math.fsum(map(operator.mul, a, b))
+
+def total(a):
+    """Sum of a vector."""
+    numpy = _load_numpy()
+    if numpy is not None:
+        return float(numpy.sum(a))
+    return math.fsum(a)
+
+def count_nonzero(a):
+    """Number of non-zero entries of a vector."""
+    numpy = _load_numpy()
+    if numpy is not None:
+        return int(numpy.count_nonzero(a))
+    return sum(1 for value in a if value)
+
+def mean(a):
+    """Mean of a vector, 0 for an empty one."""
+    return total(a) / len(a) if len(a) else 0.0
+
+@register('track_count', ['duration'], 'tracks in library')
+def _track_count(columns):
+    return len(columns['duration'])
+
+@register('total_playtime', ['duration', 'played_count'], 'seconds listened')
+def _total_playtime(columns):
+    return dot(columns['duration'], columns['played_count'])
+
+@register('total_plays', ['played_count'], 'total plays')
+def _total_plays(columns):
+    return int(total(columns['played_count']))
+
+@register('played_tracks', ['played_count'], 'tracks played at least once')
+def _played_tracks(columns):
+    return count_nonzero(columns['played_count'])
+
+@register('mean_duration', ['duration'], 'average track length in seconds')
+def _mean_duration(columns):
+    return mean(columns['duration'])
+
+@register('mean_plays', ['played_count'], 'average plays per track')
+def _mean_plays(columns):
+    return mean(columns['played_count'])
+
+@register('favorites', ['favorited'], 'favorite tracks')
+def _favorites(columns):
+    return count_nonzero(columns['favorited'])
+
+def required_columns(names):
+    """Return the Music properties needed to compute the given aggregates, without duplicates."""
+    columns = []
+    for name in names:
+        for column in AGGREGATES[name].columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+def compute(columns, names=DEFAULT_STATS):
+    """
+    Compute aggregates from raw property columns.
+
+    Args:
+        columns (dict): Music property name mapped to a list of values, e.g. from bridge.fetch_columns
+        names (list, optional): Aggregates to compute (default: DEFAULT_STATS)
+
+    Returns:
+        dict: Aggregate name mapped to its value
+    """
+    vectors = {column: vector(columns[column]) for column in required_columns(names)}
+    return {name: AGGREGATES[name].compute(vectors) for name in names}
@@ -0,0 +1,41 @@
+import csv
+import pytest
+import backend
+import bridge
+import exporter
+
+def _backend_with_unreadable_id(count=5, position=2):
+    """Return a fake backend whose track at the given library position fails to return its id."""
+    fake = backend.FakeBackend.synthetic(count)
+    del fake.music.library.records[position]['id']
+    bridge.use_backend(fake)
+    return fake
+
+def _readable_ids(fake):
+    return [str(record['id']) for record in fake.music.library.records if 'id' in record]
+
+def test_iter_track_chunks_leaves_out_track_without_id(capsys):
+    fake = _backend_with_unreadable_id()
+
+    tracks = [track for chunk in bridge.iter_track_chunks() for track in chunk]
+
+    assert [track.id for track in tracks] == _readable_ids(fake)
+    assert "no id for 1 tracks" in capsys.readouterr().out
+
+def test_get_all_tracks_leaves_out_track_without_id():
+    fake = _backend_with_unreadable_id()
+
+    assert bridge.get_all_tracks().column('id') == _readable_ids(fake)
+
+def test_csv_export_leaves_out_track_without_id(tmp_path):
+    fake = _backend_with_unreadable_id()
+    output_path = tmp_path / 'tracks.csv'
+
+    assert exporter.export_tracks_to_csv(str(output_path))
+
+    with open(output_path, newline='', encoding='utf-8-sig') as f:
+        assert [row['id'] for row in csv.DictReader(f)] == _readable_ids(fake)
+
+def test_make_track_rejects_missing_id():
+    with pytest.raises(ValueError):
+        bridge.make_track({'id': None, 'name': 'River Home Rain'})
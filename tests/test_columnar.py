@@ -0,0 +1,14 @@
+import bridge
+import columnar
+
+def _track(track_id, name):
+    return bridge.Track(track_id, name, 'Album', 'Artist', 'Artist', 3, False, 200.0, f'/Music/{name}.m4a')
+
+def test_write_snapshot_leaves_out_track_without_id(tmp_path):
+    output_path = str(tmp_path / 'tracks.amcol')
+    chunks = [[_track('1', 'First'), _track(None, 'River Home Rain'), _track('3', 'Third')]]
+
+    assert columnar.write_snapshot(output_path, chunks) == 2
+
+    with columnar.ColumnarSnapshot(output_path) as snapshot:
+        assert [track.id for track in snapshot.tracks()] == ['1', '3']
@@ -0,0 +1,16 @@
+import os
+import stat
+import backend
+import bridge
+import exporter
+
+def test_csv_export_uses_umask_mode(tmp_path):
+    bridge.use_backend(backend.FakeBackend.synthetic(5))
+    output_path = tmp_path / 'tracks.csv'
+    umask = os.umask(0o022)
+    try:
+        assert exporter.export_tracks_to_csv(str(output_path))
+    finally:
+        os.umask(umask)
+
+    assert stat.S_IMODE(os.stat(output_path).st_mode) == 0o644
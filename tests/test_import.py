@@ -0,0 +1,28 @@
+import csv
+import io
+import backend
+import bridge
+import exporter
+
+def test_matched_import_retries_encoding_before_any_change(tmp_path, capsys):
+    fake = backend.FakeBackend([{'name': f'Track {number}', 'location': f'/Music/Artist/Album/{number:04}.m4a'}
+                                for number in range(2000)])
+    bridge.use_backend(fake)
+    records = fake.music.library.records
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(['File Directory', 'Title', 'Album', 'Artist', 'Album Artist'])
+    for record in records:
+        writer.writerow([record['location'].path, 'Edited', 'Album', 'Artist', 'Artist'])
+    # A latin-1 byte past the part of the file the encoding is sniffed from
+    data = text.getvalue().encode('latin-1') + b'/Music/missing.m4a,Caf\xe9,Album,Artist,Artist\r\n'
+    assert len(data) > exporter.SNIFF_BYTES
+    input_path = tmp_path / 'matched.csv'
+    input_path.write_bytes(data)
+
+    assert exporter.import_tracks_from_csv(str(input_path))
+
+    out = capsys.readouterr().out
+    assert 'trying the next encoding' in out
+    assert f'Import complete: {len(records)} tracks updated, 1 failed' in out
+    assert all(record['name'] == 'Edited' for record in records)
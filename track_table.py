@@ -0,0 +1,280 @@
+"""
+Compact in-memory track list returned by ``get_all_tracks``.
+
+A TrackTable stores the Track fields as columns instead of one namedtuple per
+track: numeric fields in packed ``array`` columns, album, artist and album
+artist dictionary-encoded into one shared string pool (they repeat heavily,
+and album artist is usually the artist), and names and paths as plain lists.
+Rows are materialized on access as small ``__slots__`` views with the Track
+attribute names, and filtering or sorting returns a TrackView of row
+positions rather than a copy of the tracks.
+"""
+
+from array import array
+import bridge
+
+# Fields stored as codes into the shared string pool
+POOLED_FIELDS = ('album', 'artist', 'album_artist')
+
+# Array typecode of every numeric field
+NUMERIC_FIELDS = {'id': 'q', 'play_count': 'q', 'is_favorite': 'b', 'duration': 'd'}
+
+class StringPool:
+    """Distinct strings, each stored once and addressed by an integer code; code 0 is None."""
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+def _getter(field):
+    return property(lambda row: row._table.value(field, row._position))
+
+class TrackRow:
+    """
+    Read-only view of one track of a TrackTable, with the attributes of bridge.Track.
+
+    Rows iterate, index and compare like the equivalent Track, and as_track() returns one.
+    """
+
+    __slots__ = ('_table', '_position')
+
+    _fields = tuple(bridge.TRACK_FIELDS)
+
+    def __init__(self, table, position):
+        self._table = table
+        self._position = position
+
+    def __iter__(self):
+        for field in self._fields:
+            yield self._table.value(field, self._position)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(self.as_track())
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def as_track(self):
+        """Return the row as a bridge.Track."""
+        return bridge.Track(*self)
+
+for _field in TrackRow._fields:
+    setattr(TrackRow, _field, _getter(_field))
+del _field
+
+class _Rows:
+    """Sequence behaviour shared by TrackTable and TrackView; subclasses provide _table and _positions."""
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TrackView(self._table, self._positions[index])
+        return TrackRow(self._table, self._positions[index])
+
+    def __iter__(self):
+        table = self._table
+        for position in self._positions:
+            yield TrackRow(table, position)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} of {len(self)} tracks>"
+
+    def column(self, field):
+        """Return the values of one field for these rows, in order, as a list."""
+        column = self._table._columns[field]
+        values = [column[position] for position in self._positions]
+        return self._table._decode(field, values)
+
+    def where(self, field, predicate=bool):
+        """
+        Select rows by the value of one field, without building row views.
+
+        Args:
+            field (str): Track field, e.g. 'file_path'
+            predicate (callable, optional): Called with each value; True keeps the row
+                (default: keep rows whose value is truthy)
+
+        Returns:
+            TrackView: The matching rows, in order
+        """
+        positions = self._positions
+        return TrackView(self._table, array('I', (position for position, value
+                                                  in zip(positions, self.column(field)) if predicate(value))))
+
+    def filter(self, predicate):
+        """Select rows for which predicate(row) is true; returns a TrackView."""
+        table = self._table
+        return TrackView(table, array('I', (position for position in self._positions
+                                            if predicate(TrackRow(table, position)))))
+
+    def sorted(self, field=None, key=None, reverse=False):
+        """
+        Return the rows sorted by a field or by key(row), as a TrackView.
+
+        Args:
+            field (str, optional): Track field to sort by; faster than an equivalent key
+            key (callable, optional): Called with each row to get its sort key
+            reverse (bool, optional): Sort in descending order
+        """
+        positions = list(self._positions)
+        if field is not None:
+            values = dict(zip(positions, self.column(field)))
+            positions.sort(key=values.__getitem__, reverse=reverse)
+        else:
+            table = self._table
+            positions.sort(key=lambda position: key(TrackRow(table, position)), reverse=reverse)
+        return TrackView(self._table, array('I', positions))
+
+    def tracks(self):
+        """Return the rows as a list of bridge.Track."""
+        return [row.as_track() for row in self]
+
+class TrackTable(_Rows):
+    """
+    Column store of Track records in library order.
+
+    Args:
+        rows (iterable, optional): Track records or sequences of Track field values to append
+    """
+
+    def __init__(self, rows=()):
+        self.pool = StringPool()
+        self._columns = {field: array(NUMERIC_FIELDS[field]) if field in NUMERIC_FIELDS
+                         else array('I') if field in POOLED_FIELDS else []
+                         for field in bridge.TRACK_FIELDS}
+        self.extend(rows)
+
+    @property
+    def _table(self):
+        return self
+
+    @property
+    def _positions(self):
+        return range(len(self._columns['id']))
+
+    def value(self, field, position):
+        """Return one field of the track at a position."""
+        value = self._columns[field][position]
+        if field in POOLED_FIELDS:
+            return self.pool.values[value]
+        if field == 'id':
+            return str(value)
+        if field == 'is_favorite':
+            return bool(value)
+        return value
+
+    def _decode(self, field, values):
+        if field in POOLED_FIELDS:
+            strings = self.pool.values
+            return [strings[code] for code in values]
+        if field == 'id':
+            return [str(value) for value in values]
+        if field == 'is_favorite':
+            return [bool(value) for value in values]
+        return values
+
+    def column(self, field):
+        """Return the values of one field for every track, in library order, as a list."""
+        return self._decode(field, list(self._columns[field]))
+
+    def raw_column(self, field):
+        """
+        Return the stored column of a field without copying it.
+
+        Numeric fields are arrays (ids as integers, favorite status as 0/1) that
+        numpy.frombuffer can wrap; pooled fields are codes into self.pool.values.
+        """
+        return self._columns[field]
+
+    def append(self, track):
+        """Append one Track record or sequence of Track field values."""
+        self.extend((track,))
+
+    def extend(self, rows):
+        """Append Track records or sequences of Track field values."""
+        columns = self._columns
+        ids, names, albums, artists, album_artists, play_counts, favorites, durations, paths = (
+            columns[field] for field in bridge.TRACK_FIELDS)
+        encode = self.pool.encode
+        for id, name, album, artist, album_artist, play_count, is_favorite, duration, file_path in rows:
+            ids.append(int(id))
+            names.append(name)
+            albums.append(encode(album))
+            artists.append(encode(artist))
+            album_artists.append(encode(album_artist))
+            play_counts.append(play_count or 0)
+            favorites.append(bool(is_favorite))
+            durations.append(duration or 0.0)
+            paths.append(file_path or '')
+
+    def extend_properties(self, columns):
+        """
+        Append tracks from raw Music property columns, as returned by bridge.fetch_columns.
+
+        Values are cleaned up the way bridge.make_track does it, one column at a time. Rows
+        whose id could not be read (None from a per-track fallback fetch) are left out.
+
+        Args:
+            columns (dict): Music property name (see bridge.TRACK_PROPERTIES) mapped to a column
+        """
+        missing = [position for position, value in enumerate(columns['id']) if value is None]
+        if missing:
+            print(f"Error processing track: no id for {len(missing)} tracks, leaving them out")
+            missing = set(missing)
+            columns = {prop: [value for position, value in enumerate(column) if position not in missing]
+                       for prop, column in columns.items()}
+        encode = self.pool.encode
+        artists = columns['artist']
+        table = self._columns
+        table['id'].extend(int(value) for value in columns['id'])
+        table['name'].extend(columns['name'])
+        table['album'].extend(map(encode, columns['album']))
+        table['artist'].extend(map(encode, artists))
+        # Default to regular artist if album artist is not available
+        table['album_artist'].extend(encode(album_artist if album_artist is not None else artist)
+                                     for album_artist, artist in zip(columns['album_artist'], artists))
+        table['play_count'].extend(value or 0 for value in columns['played_count'])
+        table['is_favorite'].extend(bool(value) for value in columns['favorited'])
+        # Track duration in seconds rounded to one decimal place
+        table['duration'].extend(round(value or 0, 1) for value in columns['duration'])
+        table['file_path'].extend(map(bridge._location_path, columns['location']))
+
+class TrackView(_Rows):
+    """
+    Rows of a TrackTable selected by position, e.g. by TrackTable.where; holds no track data.
+
+    Args:
+        table (TrackTable): The table the rows belong to
+        positions (array): Row positions in the table, in view order
+    """
+
+    def __init__(self, table, positions):
+        self._table = table
+        self._positions = positions